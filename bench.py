@@ -0,0 +1,1094 @@
+'''
+Contains rough benchmarks for the performance-sensitive parts of Morpher.
+
+Each bench function builds its own inputs, times the operation it is
+interested in and prints the results. The benchmarks don't depend on the
+debugger, so they can be run on any platform the L{trace} package runs on;
+benchmarks that replay traces use the C library as a stand-in for the
+target DLL.
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 12, 2011
+'''
+
+from morpher.misc import config
+from morpher.trace import trace, snapshot, tag, manifest, memory, block, overlay
+from morpher.trace import typemanager, trace_file, trace_store, tag_table
+from morpher.fuzzer import harness, fork_server, fuzzer, generator, vector_generator
+from morpher.collector import model_index, range_union, page_cache, func_recorder
+import xml.dom.minidom as xml
+import multiprocessing
+import collections
+import random
+import ctypes.util
+import ctypes
+import tempfile
+import pickle
+import struct
+import time
+import sys
+import os
+
+def benchConfig():
+    '''
+    Builds a L{Config} that targets the C library with logging turned off
+
+    @return: The configuration object
+    @rtype: L{Config} object
+    '''
+    cfg = config.Config()
+    cfg.set('logging', 'enabled', "no")
+    cfg.set('directories', 'logs', tempfile.gettempdir())
+    cfg.set('directories', 'data', tempfile.gettempdir())
+    cfg.set('fuzzer', 'target', ctypes.util.find_library("c"))
+    cfg.set('fuzzer', 'dll_type', "cdecl")
+    return cfg
+
+def benchTrace(calls=3, blocksize=0):
+    '''
+    Builds a small L{Trace} of calls to abs() in the C library
+
+    @param calls: The number of calls in the trace
+    @type calls: integer
+
+    @param blocksize: The size of an extra block captured with each call,
+                      or 0 for none
+    @type blocksize: integer
+
+    @return: The trace
+    @rtype: L{Trace} object
+    '''
+    snaps = []
+    for i in range(calls) :
+        blocks = [(0x1000, struct.pack("i", -i))]
+        if blocksize :
+            blocks.append((0x100000, "\x00" * blocksize))
+        s = snapshot.Snapshot("abs", blocks)
+        t = tag.Tag(0x1000, "i")
+        s.addTag(t)
+        s.setArgs([t])
+        snaps.append(s)
+    return trace.Trace(snaps)
+
+def benchForkServer(cases=200):
+    '''
+    Compares the time per case of spawning one L{Harness} per replay
+    against replaying every case through a single L{ForkServer}.
+
+    @param cases: The number of replays to time for each method
+    @type cases: integer
+    '''
+    cfg = benchConfig()
+    mytrace = benchTrace()
+
+    start = time.time()
+    for _ in range(cases) :
+        (inpipe, outpipe) = multiprocessing.Pipe()
+        h = harness.Harness(cfg, (inpipe, outpipe))
+        h.start()
+        outpipe.send(mytrace)
+        outpipe.send(True)
+        h.join()
+    spawned = (time.time() - start) / cases
+
+    (conn, theirs) = multiprocessing.Pipe()
+    server = fork_server.ForkServer(cfg, theirs)
+    server.start()
+    start = time.time()
+    for _ in range(cases) :
+        conn.send(("trace", mytrace))
+        conn.recv()
+    forked = (time.time() - start) / cases
+    conn.send(None)
+    server.join()
+
+    print "Harness per case:  %8.3f ms" % (spawned * 1000)
+    print "Fork server:       %8.3f ms" % (forked * 1000)
+    print "Speedup:           %8.1fx" % (spawned / forked)
+
+def benchPatches(cases=200, blocksize=65536):
+    '''
+    Compares sending each fuzzed case to a L{ForkServer} as a whole
+    L{Trace} against sending the base L{Trace} once and then only the
+    patches for each case, for a trace with large captured blocks.
+
+    @param cases: The number of replays to time for each method
+    @type cases: integer
+
+    @param blocksize: The size of the extra block captured with each call
+    @type blocksize: integer
+    '''
+    cfg = benchConfig()
+    mytrace = benchTrace(blocksize=blocksize)
+    base = pickle.dumps(mytrace, pickle.HIGHEST_PROTOCOL)
+    patches = [(1, 0x1000, struct.pack("i", -12345))]
+
+    full = len(pickle.dumps(("trace", mytrace), pickle.HIGHEST_PROTOCOL))
+    case = ("case", (patches, len(mytrace.snapshots)))
+    delta = len(pickle.dumps(case, pickle.HIGHEST_PROTOCOL))
+
+    (conn, theirs) = multiprocessing.Pipe()
+    server = fork_server.ForkServer(cfg, theirs)
+    server.start()
+    start = time.time()
+    for _ in range(cases) :
+        conn.send(("trace", mytrace))
+        conn.recv()
+    wholetime = (time.time() - start) / cases
+    conn.send(("base", base))
+    start = time.time()
+    for _ in range(cases) :
+        conn.send(case)
+        conn.recv()
+    patchtime = (time.time() - start) / cases
+    conn.send(None)
+    server.join()
+
+    print "Whole trace:  %8d bytes %8.3f ms per case" % (full, wholetime * 1000)
+    print "Patches:      %8d bytes %8.3f ms per case" % (delta, patchtime * 1000)
+
+def benchCheckpoint(calls=20, cases=50, delay=2000):
+    '''
+    Compares replaying every case of the last L{Snapshot} of a long
+    L{Trace} in full against forking each one from a checkpoint taken
+    after the unfuzzed calls before it.
+
+    @param calls: The number of calls in the trace
+    @type calls: integer
+
+    @param cases: The number of fuzzed values to replay for the last call
+    @type cases: integer
+
+    @param delay: The number of microseconds each call sleeps for
+    @type delay: integer
+    '''
+    snaps = []
+    for _ in range(calls) :
+        s = snapshot.Snapshot("usleep", [(0x1000, struct.pack("I", delay))])
+        t = tag.Tag(0x1000, "I")
+        s.addTag(t)
+        s.setArgs([t])
+        snaps.append(s)
+    base = pickle.dumps(trace.Trace(snaps), pickle.HIGHEST_PROTOCOL)
+
+    times = {}
+    for checkpoint in ["no", "yes"] :
+        cfg = benchConfig()
+        cfg.set('fuzzer', 'checkpoint', checkpoint)
+        (conn, theirs) = multiprocessing.Pipe()
+        server = fork_server.ForkServer(cfg, theirs)
+        server.start()
+        conn.send(("base", base))
+        saved = 0.0
+        start = time.time()
+        for i in range(cases) :
+            conn.send(("case", ([(calls - 1, 0x1000, struct.pack("I", i))], calls)))
+            saved += conn.recv()[3]
+        times[checkpoint] = (time.time() - start) / cases
+        conn.send(None)
+        server.join()
+        print "Checkpoint %-3s: %8.3f ms per case, %.3f s saved" % \
+              (checkpoint, times[checkpoint] * 1000, saved)
+    print "Speedup:        %8.1fx" % (times["no"] / times["yes"])
+
+def benchManifest(numtraces=1000):
+    '''
+    Compares counting the tags in a directory of traces by loading
+    every trace against reading the directory's L{Manifest}.
+
+    @param numtraces: The number of traces in the directory
+    @type numtraces: integer
+    '''
+    tracedir = tempfile.mkdtemp()
+    mytrace = benchTrace(calls=10, blocksize=4096)
+    data = trace_file.dumps(mytrace)
+    man = manifest.Manifest(tracedir)
+    for i in range(numtraces) :
+        name = "trace-%d.trc" % i
+        f = open(os.path.join(tracedir, name), "wb")
+        f.write(data)
+        f.close()
+        man.add(name, mytrace, data)
+    man.save()
+
+    start = time.time()
+    numtags = 0
+    for name in os.listdir(tracedir) :
+        if name.endswith(".trc") :
+            for snap in trace_file.load(os.path.join(tracedir, name)).snapshots :
+                numtags += len(snap.tags)
+    loaded = time.time() - start
+
+    start = time.time()
+    man = manifest.Manifest(tracedir)
+    man.load()
+    numtags = man.countTags()
+    indexed = time.time() - start
+
+    print "Load every trace:     %8.3f ms" % (loaded * 1000)
+    print "Read manifest:        %8.3f ms" % (indexed * 1000)
+
+def benchStreaming(cases=1000000):
+    '''
+    Compares generating a large number of random values for an integer
+    L{Tag} as a list against streaming them from the L{Generator}, along
+    with the memory each approach holds on to.
+    
+    @param cases: The number of random values to generate
+    @type cases: integer
+    '''
+    cfg = benchConfig()
+    cfg.set('fuzzer', 'random', "on")
+    cfg.set('fuzzer', 'random_cases', str(cases))
+    
+    cfg.set('fuzzer', 'streaming', "no")
+    gen = generator.Generator(cfg)
+    start = time.time()
+    (count, values) = gen.cases("I", 1000)
+    values = list(values)
+    listed = time.time() - start
+    held = sys.getsizeof(values) + sum([sys.getsizeof(v) for v in values])
+    del values
+    
+    cfg.set('fuzzer', 'streaming', "yes")
+    gen = generator.Generator(cfg)
+    start = time.time()
+    (estimate, values) = gen.cases("I", 1000)
+    produced = 0
+    for _ in values :
+        produced += 1
+    streamed = time.time() - start
+    # The stream holds its fixed values and a bloom filter sized for cases
+    seen = generator.bloom_filter.BloomFilter(cases)
+    
+    print "List:    %8d values %8.3f s %10d bytes" % (count, listed, held)
+    print "Stream:  %8d values %8.3f s %10d bytes (estimated %d)" % \
+          (produced, streamed, len(seen.bits), estimate)
+
+def benchHeuristics(tags=20000):
+    '''
+    Compares getting the packed fuzzed values for many integer L{Tag}s
+    with the L{Generator}'s heuristic tables rebuilt for every L{Tag},
+    as they were before being memoized, against reusing them.
+    
+    @param tags: The number of L{Tag}s to generate values for
+    @type tags: integer
+    '''
+    cfg = benchConfig()
+    cfg.set('fuzzer', 'mutational', "on")
+    cfg.set('fuzzer', 'heuristic', "on")
+    cfg.set('fuzzer', 'random', "off")
+    gen = generator.Generator(cfg)
+    
+    times = {}
+    for memoized in [False, True] :
+        start = time.time()
+        for i in range(tags) :
+            if not memoized :
+                generator.Generator.tables.clear()
+            (_, values) = gen.cases("I", i)
+            for (v, packed) in values :
+                pass
+        times[memoized] = time.time() - start
+    
+    print "Rebuilt tables:  %8.3f ms per tag" % (times[False] * 1000 / tags)
+    print "Memoized tables: %8.3f ms per tag" % (times[True] * 1000 / tags)
+
+def benchVectorize(tags=100, cases=10000):
+    '''
+    Compares building and packing the values for integer and float 
+    L{Tag}s with many random cases in pure Python against building them
+    with NumPy, if it is installed.
+    
+    @param tags: The number of L{Tag}s of each type
+    @type tags: integer
+    
+    @param cases: The number of random values per L{Tag}
+    @type cases: integer
+    '''
+    if not vector_generator.available() :
+        print "NumPy is not installed"
+        return
+    cfg = benchConfig()
+    cfg.set('fuzzer', 'mutational', "on")
+    cfg.set('fuzzer', 'random', "on")
+    cfg.set('fuzzer', 'random_cases', str(cases))
+    
+    for vectorize in ["no", "yes"] :
+        cfg.set('fuzzer', 'vectorize', vectorize)
+        gen = generator.Generator(cfg)
+        for fmt in ["I", "d"] :
+            start = time.time()
+            for i in range(tags) :
+                (_, values) = gen.cases(fmt, i, (0, 0, i))
+                for (v, packed) in values :
+                    pass
+            elapsed = (time.time() - start) * 1000 / tags
+            print "Vectorize %-3s %s: %8.3f ms per tag" % (vectorize, fmt, elapsed)
+
+def benchFindBlock(lookups=20000):
+    '''
+    Compares finding the L{Block} holding an address by scanning every
+    L{Block}, as L{Memory} used to, against its sorted index, for 
+    L{Memory}s with more and more L{Block}s.
+    
+    @param lookups: The number of lookups to time for each size
+    @type lookups: integer
+    '''
+    def scan(mem, addr, size) :
+        for blk in mem.mem.values() :
+            if blk.contains(addr, size) :
+                return blk
+        return None
+    
+    for numblocks in [10, 100, 1000, 10000] :
+        mem = memory.Memory([(0x10000 * i, "\x00" * 64) for i in range(numblocks)])
+        addrs = [0x10000 * ((i * 7919) % numblocks) + 8 for i in range(lookups)]
+        start = time.time()
+        for addr in addrs :
+            scan(mem, addr, 4)
+        scanned = (time.time() - start) / lookups
+        start = time.time()
+        for addr in addrs :
+            mem._findBlock(addr, 4)
+        indexed = (time.time() - start) / lookups
+        print "%6d blocks: scan %9.3f us, index %6.3f us per lookup" % \
+              (numblocks, scanned * 1000000, indexed * 1000000)
+
+def benchBlockAccess(tags=100000):
+    '''
+    Compares the read, write and restore done for each fuzzed L{Tag} 
+    using temporary buffers and memmove, as L{Block} used to, against
+    unpacking and packing in place through its memoryview.
+    
+    @param tags: The number of L{Tag}s to time
+    @type tags: integer
+    '''
+    def oldRead(blk, addr, fmt) :
+        size = struct.calcsize(fmt)
+        buf = ctypes.create_string_buffer(size)
+        ctypes.memmove(buf, blk.translate(addr), size)
+        return struct.unpack(fmt, buf.raw)
+    
+    def oldWrite(blk, addr, data, fmt) :
+        data = struct.pack(fmt, *data)
+        ctypes.memmove(blk.translate(addr), ctypes.c_char_p(data), len(data))
+    
+    blk = block.Block(0x1000, "\x00" * 4096)
+    addrs = [0x1000 + (i * 4) % 4096 for i in range(tags)]
+    
+    start = time.time()
+    for addr in addrs :
+        (old,) = oldRead(blk, addr, "I")
+        oldWrite(blk, addr, (12345,), "I")
+        oldWrite(blk, addr, (old,), "I")
+    copied = (time.time() - start) / tags
+    
+    start = time.time()
+    for addr in addrs :
+        (old,) = blk.read(addr, fmt="I")
+        blk.write(addr, (12345,), fmt="I")
+        blk.write(addr, (old,), fmt="I")
+    inplace = (time.time() - start) / tags
+    
+    print "Temporary buffers: %8.3f us per tag" % (copied * 1000000)
+    print "In place:          %8.3f us per tag" % (inplace * 1000000)
+
+def benchArena(numblocks=500, blocksize=256, rounds=200):
+    '''
+    Compares pickling and unpickling a L{Memory} made of many separate
+    L{Block}s against one in arena mode, and restoring every L{Block} of
+    it by rewriting them against a single copy back from the arena.
+    
+    @param numblocks: The number of L{Block}s in the L{Memory}
+    @type numblocks: integer
+    
+    @param blocksize: The size of each L{Block}
+    @type blocksize: integer
+    
+    @param rounds: The number of times to time each operation
+    @type rounds: integer
+    '''
+    blklist = [(0x10000 * i, chr(i % 256) * blocksize) for i in range(numblocks)]
+    for arena in [False, True] :
+        mem = memory.Memory(blklist, arena)
+        start = time.time()
+        for _ in range(rounds) :
+            mem = pickle.loads(pickle.dumps(mem, pickle.HIGHEST_PROTOCOL))
+        pickled = (time.time() - start) / rounds
+        
+        start = time.time()
+        if arena :
+            mem.savePristine()
+            for _ in range(rounds) :
+                mem.restore()
+        else :
+            for _ in range(rounds) :
+                for (addr, data) in blklist :
+                    mem.write(addr, data)
+        restored = (time.time() - start) / rounds
+        print "Arena %-5s: pickle round trip %8.3f ms, restore %8.3f ms" % \
+              (arena, pickled * 1000, restored * 1000)
+
+def benchPointerPatch(pointers=5000, numblocks=1000, rounds=50):
+    '''
+    Compares patching every registered pointer of a L{Memory} by looking
+    up both ends of each pointer, as L{Memory.patch} used to, against 
+    following its cached patch plan. The L{Memory} is in arena mode so it
+    can be put back between rounds, which both methods pay for.
+    
+    @param pointers: The number of registered pointers
+    @type pointers: integer
+    
+    @param numblocks: The number of L{Block}s the pointers point into
+    @type numblocks: integer
+    
+    @param rounds: The number of times to patch every pointer
+    @type rounds: integer
+    '''
+    def oldPatch(mem) :
+        for addr in mem.pointers :
+            blk = mem._findBlock(addr, struct.calcsize("P"))
+            p = blk.read(addr, fmt="P")[0]
+            tgtblk = mem._findBlock(p, 1)
+            if tgtblk == None :
+                continue
+            p = tgtblk.translate(p)
+            blk.write(addr, (p,), fmt="P")
+    
+    size = struct.calcsize("P")
+    targets = [0x100000 + 0x1000 * ((i * 7919) % numblocks) + 8 for i in range(pointers)]
+    blklist = [(0x1000, "".join([struct.pack("P", t) for t in targets]))]
+    blklist += [(0x100000 + 0x1000 * i, "\x00" * 64) for i in range(numblocks)]
+    mem = memory.Memory(blklist, True)
+    for i in range(pointers) :
+        mem.registerPointer(0x1000 + i * size)
+    mem.savePristine()
+    
+    times = {}
+    for (name, func) in [("lookups", oldPatch), ("plan", memory.Memory.patch)] :
+        start = time.time()
+        for _ in range(rounds) :
+            mem.restore()
+            func(mem)
+        times[name] = (time.time() - start) / rounds
+    print "Lookups per pointer: %8.3f ms per patch" % (times["lookups"] * 1000)
+    print "Patch plan:          %8.3f ms per patch" % (times["plan"] * 1000)
+
+def benchLoadObject(loads=20000):
+    '''
+    Compares loading a nested user type from memory field by field, 
+    looking up each field's format, size and alignment as 
+    L{Snapshot._loadObject} used to, against its compiled loader.
+    
+    @param loads: The number of objects to load with each method
+    @type loads: integer
+    '''
+    def oldLoad(typeman, mem, addr, fmt, objclass=None) :
+        def getFormat(cls) :
+            for (key, value) in typeman.table.items() :
+                if value == cls :
+                    return key
+        if objclass == None :
+            objclass = typeman.getClass(fmt)
+        if issubclass(objclass, ctypes.Structure) :
+            offset = 0
+            myinst = objclass()
+            for (fieldname, fieldclass) in objclass._fields_ :
+                fieldfmt = getFormat(fieldclass)
+                (size, alignment) = typeman.getInfo(fieldfmt)
+                offset = typeman.align(offset, alignment)
+                obj = oldLoad(typeman, mem, addr + offset, fieldfmt, fieldclass)
+                setattr(myinst, fieldname, obj)
+                offset += size
+            return myinst
+        return objclass(mem.read(addr, fmt=fmt)[0])
+    
+    usertypes = {"1": ("struct", ["i", "P", "d", "2", "I", "I"]),
+                 "2": ("struct", ["c", "h", "I", "q"])}
+    typeman = typemanager.TypeManager(usertypes)
+    mem = memory.Memory([(0x1000, "\x01" * 256)])
+    
+    start = time.time()
+    for _ in range(loads) :
+        oldLoad(typeman, mem, 0x1000, "1")
+    fieldwise = (time.time() - start) / loads
+    loader = typeman.getLoader("1")
+    start = time.time()
+    for _ in range(loads) :
+        loader(mem, 0x1000)
+    compiled = (time.time() - start) / loads
+    print "Field by field:  %8.3f us per object" % (fieldwise * 1000000)
+    print "Compiled loader: %8.3f us per object" % (compiled * 1000000)
+
+def benchTypeCache(numtypes=50, traces=100):
+    '''
+    Compares unpickling L{Trace}s of the same model and loading one object
+    of each of its user types when every L{Trace} builds its own classes,
+    as each L{TypeManager} used to, against sharing them through the
+    process-wide cache warmed once.
+    
+    @param numtypes: The number of user-defined struct types
+    @type numtypes: integer
+    
+    @param traces: The number of L{Trace}s to unpickle
+    @type traces: integer
+    '''
+    # Each struct holds a few numbers and the struct before it
+    usertypes = {"1": ("struct", ["i", "d", "P"])}
+    for i in range(2, numtypes + 1) :
+        usertypes[str(i)] = ("struct", ["i", "d", "P", str(i - 1)])
+    snap = snapshot.Snapshot("abs", [(0x1000, "\x00" * 4096)])
+    data = pickle.dumps(trace.Trace([snap], usertypes), pickle.HIGHEST_PROTOCOL)
+    
+    times = {}
+    for warm in [False, True] :
+        typemanager.TypeManager.shared.clear()
+        if warm :
+            typemanager.TypeManager(usertypes).warm()
+        start = time.time()
+        for _ in range(traces) :
+            if not warm :
+                typemanager.TypeManager.shared.clear()
+            mytrace = pickle.loads(data)
+            mysnap = mytrace.snapshots[0]
+            mysnap.type_manager = mytrace.type_manager
+            for fmt in usertypes :
+                mysnap._loadObject(0x1000, fmt)
+        times[warm] = (time.time() - start) / traces
+    print "Classes per trace: %8.3f ms per trace" % (times[False] * 1000)
+    print "Shared cache:      %8.3f ms per trace" % (times[True] * 1000)
+
+def benchArrays(arraysize=4096, loads=200):
+    '''
+    Compares a struct holding a char array modelled as one field per
+    element, as the parser used to write it, against a single array
+    field: the time to build its class and loader, to load it from one
+    L{Block} and split across two, and to tag the array in a L{Snapshot}.
+    
+    @param arraysize: The number of chars in the array
+    @type arraysize: integer
+    
+    @param loads: The number of objects to load with each model
+    @type loads: integer
+    '''
+    models = [("Field per element", ["i"] + ["c"] * arraysize + ["d"]),
+              ("Array field", ["i", "c[%d]" % arraysize, "d"])]
+    for (label, fields) in models :
+        typemanager.TypeManager.shared.clear()
+        start = time.time()
+        typeman = typemanager.TypeManager({"1": ("struct", fields)})
+        loader = typeman.getLoader("1")
+        build = time.time() - start
+        
+        (size, _) = typeman.getInfo("1")
+        data = "\x01" * size
+        whole = memory.Memory([(0x1000, data)])
+        split = memory.Memory([(0x1000, data[:size // 2]), (0x1000 + size // 2, data[size // 2:])])
+        start = time.time()
+        for _ in range(loads) :
+            loader(whole, 0x1000)
+        wholetime = (time.time() - start) / loads
+        start = time.time()
+        for _ in range(loads) :
+            loader(split, 0x1000)
+        splittime = (time.time() - start) / loads
+        
+        snap = snapshot.Snapshot("abs", [(0x1000, data)])
+        start = time.time()
+        if len(fields) == 3 :
+            snap.addRange(0x1004, "c", arraysize)
+        else :
+            for i in range(arraysize) :
+                snap.addTag(tag.Tag(0x1004 + i, "c"))
+        tagtime = time.time() - start
+        print "%-17s build %8.3f ms  load %8.3f us  split %8.3f us  tag %8.3f ms" % \
+              (label + ":", build * 1000, wholetime * 1000000, splittime * 1000000, tagtime * 1000)
+    typemanager.TypeManager.shared.clear()
+
+def benchModelIndex(numfuncs=200, numtypes=100, calls=2000):
+    '''
+    Compares walking the types of a function's arguments through the DOM
+    of the model, finding the function and each user type's node by
+    searching it as L{FuncRecorder} used to, against looking them up in a
+    L{ModelIndex}. Only the lookups are timed, not the tagging itself.
+    
+    @param numfuncs: The number of functions in the model
+    @type numfuncs: integer
+    
+    @param numtypes: The number of user-defined struct types
+    @type numtypes: integer
+    
+    @param calls: The number of function calls to walk
+    @type calls: integer
+    '''
+    # Each struct holds a few numbers, a buffer and a pointer to the last
+    lines = ["<dll>"]
+    for i in range(1, numtypes + 1) :
+        lines.append('<usertype id="%d" type="struct">' % i)
+        for fmt in ["i", "d", "c[64]"] + (["P%d" % (i - 1)] if i > 1 else []) :
+            lines.append('<param type="%s"/>' % fmt)
+        lines.append('</usertype>')
+    for i in range(numfuncs) :
+        lines.append('<function name="func%d"><param type="i"/>' % i)
+        lines.append('<param type="P%d"/></function>' % (i % numtypes + 1))
+    lines.append("</dll>")
+    model = xml.parseString("".join(lines)).documentElement
+    names = ["func%d" % (i*7 % numfuncs) for i in range(calls)]
+    
+    def walkModel(fmt) :
+        fmt = fmt.lstrip("P")
+        if fmt.isdigit() :
+            for typenode in model.getElementsByTagName("usertype") :
+                if int(typenode.getAttribute("id")) == int(fmt) :
+                    usernode = typenode
+                    break
+            for childnode in usernode.getElementsByTagName("param") :
+                childtype = childnode.getAttribute("type")
+                if childtype.startswith("P") :
+                    # Just one level of pointers
+                    usernode.getAttribute("type")
+    
+    def walkIndex(fmt) :
+        layout = index.layouts[fmt]
+        if layout[0] == model_index.BASIC and layout[3] != None :
+            layout = index.layouts[layout[3]]
+        if layout[0] == model_index.USER :
+            for (_, fieldtype) in layout[2] :
+                index.layouts[fieldtype]
+    
+    start = time.time()
+    for name in names :
+        for node in model.getElementsByTagName("function") :
+            if name == node.getAttribute("name") :
+                break
+        for param in node.getElementsByTagName("param") :
+            walkModel(param.getAttribute("type"))
+    domtime = (time.time() - start) / calls
+    start = time.time()
+    index = model_index.ModelIndex(model)
+    compiletime = time.time() - start
+    start = time.time()
+    for name in names :
+        for (paramtype, _, _) in index.functions[name] :
+            walkIndex(paramtype)
+    indextime = (time.time() - start) / calls
+    print "Compiled %d functions and %d layouts in %.3f ms" % \
+          (len(index.functions), len(index.layouts), compiletime * 1000)
+    print "DOM search:  %8.3f us per call" % (domtime * 1000000)
+    print "Model index: %8.3f us per call" % (indextime * 1000000)
+
+def benchRangeUnion(objects=5000, gap=64):
+    '''
+    Compares building the ranges to capture for a number of small 
+    objects in random order by merging each into a deque, as 
+    L{RangeUnion.add} used to, against adding each with a binary search
+    and against adding them all with L{RangeUnion.extend}, and counts the
+    reads needed with and without a gap tolerance.
+    
+    @param objects: The number of objects
+    @type objects: integer
+    
+    @param gap: The gap tolerance to count reads with
+    @type gap: integer
+    '''
+    Range = range_union.RangeUnion.Range
+    def oldAdd(rlist, x) :
+        left = collections.deque()
+        while len(rlist) > 0 :
+            r = rlist.popleft()
+            if x.low <= r.high + 1 and x.high >= r.low - 1 :
+                x = Range(min(x.low, r.low), max(x.high, r.high))
+                continue
+            if x.high < r.low - 1 :
+                rlist.appendleft(r)
+                break
+            left.append(r)
+        left.append(x)
+        left.extend(rlist)
+        return left
+    
+    # Small objects with a few bytes of padding between most of them
+    random.seed(1)
+    ranges = []
+    addr = 0x100000
+    for i in range(objects) :
+        size = random.choice([1, 2, 4, 8, 16])
+        ranges.append(Range(addr, addr + size - 1))
+        addr += size + random.choice([0, 0, 4, 8, 32, 4096])
+    random.shuffle(ranges)
+    
+    start = time.time()
+    rlist = collections.deque()
+    for r in ranges :
+        rlist = oldAdd(rlist, r)
+    oldtime = time.time() - start
+    start = time.time()
+    ru = range_union.RangeUnion()
+    for r in ranges :
+        ru.add(r)
+    addtime = time.time() - start
+    start = time.time()
+    ru = range_union.RangeUnion()
+    ru.extend(ranges)
+    extendtime = time.time() - start
+    gapped = range_union.RangeUnion(ranges, gap=gap)
+    print "Deque merge: %8.3f ms" % (oldtime * 1000)
+    print "Bisect add:  %8.3f ms" % (addtime * 1000)
+    print "Extend:      %8.3f ms" % (extendtime * 1000)
+    print "%d objects read in %d reads, %d with a gap of %d bytes" % \
+          (objects, len(ru.rlist), len(gapped.rlist), gap)
+
+def benchPageCache(nodes=100, calls=20, delay=0.00002):
+    '''
+    Records calls passing a linked list through L{FuncRecorder.capture}
+    against a L{FakeDebuggee}, and compares the reads the capture asks 
+    for with the reads the L{PageCache} passes on to the debuggee. Each
+    read of the debuggee takes the given delay, standing in for the cost 
+    of reading another process's memory.
+    
+    @param nodes: The number of nodes in the list
+    @type nodes: integer
+    
+    @param calls: The number of calls to record
+    @type calls: integer
+    
+    @param delay: Number of seconds each read of the debuggee takes
+    @type delay: float
+    '''
+    model = xml.parseString('<dll><usertype id="1" type="struct">'
+                            '<param type="i"/><param type="c[64]"/>'
+                            '<param type="P1"/><param type="Pd"/></usertype>'
+                            '<function name="walk"><param type="P1"/></function></dll>')
+    index = model_index.ModelIndex(model)
+    (size, _) = index.type_manager.getInfo("1")
+    ptr = struct.calcsize("P")
+    # Nodes packed together, each pointing to the next and to a double
+    # stored after all the nodes
+    base = 0x100000
+    values = base + nodes*size
+    fake = page_cache.FakeDebuggee(delay=delay)
+    for i in range(nodes) :
+        nextaddr = base + (i + 1)*size if i + 1 < nodes else 0
+        node = index.type_manager.getClass("1")()
+        node.field_0 = i
+        node.field_2 = nextaddr
+        node.field_3 = values + i*8
+        fake.write(base + i*size, buffer(node)[:])
+        fake.write(values + i*8, struct.pack("d", i))
+    fake.write(0x8000, struct.pack("P", base))
+    
+    cfg = benchConfig()
+    recorder = func_recorder.FuncRecorder(cfg, index)
+    asked = 0
+    start = time.time()
+    for _ in range(calls) :
+        snap = recorder.capture(fake, 0x8000, "walk")
+        asked += recorder.cache.hits + recorder.cache.misses
+    elapsed = (time.time() - start) / calls
+    print "%d tags, %d blocks per call" % (len(snap.tags), len(snap.mem.mem))
+    print "Reads asked for:   %6d per call, %8.3f ms of reading at %d us each" % \
+          (asked // calls, asked // calls * delay * 1000, delay * 1000000)
+    print "Reads of debuggee: %6d per call, %8.3f ms of reading" % \
+          (fake.reads // calls, fake.reads // calls * delay * 1000)
+    print "Whole capture:     %8.3f ms per call" % (elapsed * 1000)
+
+def benchOverlay(variants=200, blocksize=65536):
+    '''
+    Compares keeping many fuzzed variants of a L{Trace} with large captured
+    blocks alive at once as whole copies against keeping them as
+    L{Overlay}s, and times building the fuzzed L{Trace} from an L{Overlay}.
+    
+    @param variants: The number of variants to create
+    @type variants: integer
+    
+    @param blocksize: The size of the extra block captured with each call
+    @type blocksize: integer
+    '''
+    mytrace = benchTrace(blocksize=blocksize)
+    base = pickle.dumps(mytrace, pickle.HIGHEST_PROTOCOL)
+    
+    start = time.time()
+    copies = []
+    for i in range(variants) :
+        variant = pickle.loads(base)
+        variant.snapshots[1].mem.write(0x1000, struct.pack("i", i))
+        copies.append(variant)
+    copytime = (time.time() - start) / variants
+    copysize = len(base) * variants
+    
+    start = time.time()
+    overlays = []
+    ov = overlay.Overlay(mytrace)
+    for i in range(variants) :
+        ov.set(1, 0x1000, struct.pack("i", i))
+        overlays.append(ov.copy())
+    overlaytime = (time.time() - start) / variants
+    overlaysize = sum([len(pickle.dumps(o.getPatches(), pickle.HIGHEST_PROTOCOL)) \
+                       for o in overlays])
+    
+    start = time.time()
+    for o in overlays :
+        o.materialize()
+    buildtime = (time.time() - start) / variants
+    
+    print "Whole copies: %10d bytes %8.3f ms per variant" % (copysize, copytime * 1000)
+    print "Overlays:     %10d bytes %8.3f ms per variant" % (overlaysize, overlaytime * 1000)
+    print "Materialize:  %21.3f ms per variant" % (buildtime * 1000)
+
+def benchTraceFile(calls=50, blocksize=4096, rounds=20):
+    '''
+    Compares storing and loading a L{Trace} as a pickle against the binary
+    trace file format, and times loading its last L{Snapshot} alone from
+    a memory-mapped trace file.
+    
+    @param calls: The number of calls in the trace
+    @type calls: integer
+    
+    @param blocksize: The size of the extra block captured with each call
+    @type blocksize: integer
+    
+    @param rounds: The number of times each operation is timed
+    @type rounds: integer
+    '''
+    mytrace = benchTrace(calls=calls, blocksize=blocksize)
+    for s in mytrace.snapshots :
+        s.mem.registerPointer(0x100000)
+    
+    start = time.time()
+    for _ in range(rounds) :
+        pickled = pickle.dumps(mytrace, pickle.HIGHEST_PROTOCOL)
+    pickledump = (time.time() - start) / rounds
+    start = time.time()
+    for _ in range(rounds) :
+        pickle.loads(pickled)
+    pickleload = (time.time() - start) / rounds
+    
+    start = time.time()
+    for _ in range(rounds) :
+        data = trace_file.dumps(mytrace)
+    filedump = (time.time() - start) / rounds
+    start = time.time()
+    for _ in range(rounds) :
+        trace_file.loads(data)
+    fileload = (time.time() - start) / rounds
+    
+    (fd, path) = tempfile.mkstemp(suffix=".trc")
+    os.close(fd)
+    trace_file.save(mytrace, path)
+    start = time.time()
+    for _ in range(rounds) :
+        tracefile = trace_file.mapFile(path)
+        tracefile.loadSnapshot(calls - 1)
+        tracefile.close()
+    snapload = (time.time() - start) / rounds
+    os.remove(path)
+    
+    print "Pickle:      %8d bytes %8.3f ms store %8.3f ms load" % \
+          (len(pickled), pickledump * 1000, pickleload * 1000)
+    print "Trace file:  %8d bytes %8.3f ms store %8.3f ms load" % \
+          (len(data), filedump * 1000, fileload * 1000)
+    print "One snapshot: %37.3f ms load" % (snapload * 1000)
+
+def benchTraceStore(numtraces=2000):
+    '''
+    Compares writing a collection of traces as separate files with a
+    L{Manifest}, then counting their tags and loading every one, against
+    doing the same with a L{TraceStore}.
+    
+    @param numtraces: The number of traces in the collection
+    @type numtraces: integer
+    '''
+    mytrace = benchTrace(calls=10, blocksize=1024)
+    times = {}
+    
+    filedir = tempfile.mkdtemp()
+    start = time.time()
+    man = manifest.Manifest(filedir)
+    for i in range(numtraces) :
+        name = "trace-%d.trc" % i
+        data = trace_file.dumps(mytrace)
+        f = open(os.path.join(filedir, name), "wb")
+        f.write(data)
+        f.close()
+        man.add(name, mytrace, data)
+    man.save()
+    times["files", "write"] = time.time() - start
+    start = time.time()
+    man = manifest.Manifest(filedir)
+    man.load()
+    man.countTags()
+    times["files", "count"] = time.time() - start
+    start = time.time()
+    for entry in man.entries :
+        man.loadTrace(entry)
+    times["files", "load"] = time.time() - start
+    
+    storedir = tempfile.mkdtemp()
+    start = time.time()
+    store = trace_store.TraceStore(storedir)
+    for i in range(numtraces) :
+        store.append(mytrace)
+    times["store", "write"] = time.time() - start
+    start = time.time()
+    store = trace_store.TraceStore(storedir)
+    store.countTags()
+    times["store", "count"] = time.time() - start
+    start = time.time()
+    for t in store :
+        pass
+    times["store", "load"] = time.time() - start
+    store.clear()
+    
+    for kind in ["files", "store"] :
+        print "%-6s %8.3f s write %8.3f ms count %8.3f s load" % \
+              (kind, times[kind, "write"], times[kind, "count"] * 1000, times[kind, "load"])
+    for name in os.listdir(filedir) :
+        os.remove(os.path.join(filedir, name))
+    os.rmdir(filedir)
+    os.rmdir(storedir)
+
+def benchDedup(numtraces=100, calls=20, blocksize=16384):
+    '''
+    Measures how much storing blocks by content saves for a corpus where
+    every trace calls the same function with mostly the same buffers, as
+    the collector sees when several programs use an API the same way.
+    Compares the total size of the traces pickled separately with the
+    size of the L{TraceStore}, and the memory taken by their blocks when
+    each is unpickled against loaded from the store.
+    
+    @param numtraces: The number of traces in the corpus
+    @type numtraces: integer
+    
+    @param calls: The number of calls in each trace
+    @type calls: integer
+    
+    @param blocksize: The size of the extra block captured with each call
+    @type blocksize: integer
+    '''
+    storedir = tempfile.mkdtemp()
+    store = trace_store.TraceStore(storedir)
+    pickled = 0
+    start = time.time()
+    for i in range(numtraces) :
+        mytrace = benchTrace(calls=calls, blocksize=blocksize)
+        # One call in each trace passes a buffer of its own
+        mytrace.snapshots[0].mem.write(0x100000, struct.pack("i", i))
+        pickled += len(pickle.dumps(mytrace, pickle.HIGHEST_PROTOCOL))
+        store.append(mytrace)
+    elapsed = time.time() - start
+    stats = store.getStats()
+    store.clear()
+    os.rmdir(storedir)
+    
+    print "Pickled traces: %10d bytes" % pickled
+    print "Trace store:    %10d bytes  (%.3f s to append)" % (stats["datasize"], elapsed)
+    print "Block data:     %10d bytes logical, %d stored, ratio %.1fx" % \
+          (stats["logical"], stats["stored"], stats["ratio"])
+    print "Loaded blocks:  %10d bytes unpickled, %d from the store" % \
+          (stats["logical"], stats["loaded"])
+
+def benchTagTable(buffersize=65536, lookups=20000):
+    '''
+    Compares keeping the tags of a buffer tagged one byte at a time as a
+    set of L{Tag} objects with keeping them in a L{TagTable}: the time
+    to add them, the time to look them up, and the size of each pickled.
+    
+    @param buffersize: The number of bytes in the buffer
+    @type buffersize: integer
+    
+    @param lookups: The number of membership checks to time
+    @type lookups: integer
+    '''
+    base = 0x100000
+    addrs = [base + (i*7919) % buffersize for i in range(lookups)]
+    
+    start = time.time()
+    tset = set()
+    for i in xrange(buffersize) :
+        tset.add(tag.Tag(base + i, "c"))
+    setadd = time.time() - start
+    start = time.time()
+    for addr in addrs :
+        tag.Tag(addr, "c") in tset
+    setlookup = time.time() - start
+    setsize = len(pickle.dumps(tset, pickle.HIGHEST_PROTOCOL))
+    
+    start = time.time()
+    table = tag_table.TagTable()
+    for i in xrange(buffersize) :
+        table.add(base + i, "c")
+    tableadd = time.time() - start
+    start = time.time()
+    for addr in addrs :
+        table.contains(addr, "c")
+    tablelookup = time.time() - start
+    tablesize = len(pickle.dumps(table, pickle.HIGHEST_PROTOCOL))
+    
+    print "%d tags, %d runs in the table" % (len(table), table.numRuns())
+    print "Tag set:   add %8.3f s  lookup %8.3f s  pickled %9d bytes" % \
+          (setadd, setlookup, setsize)
+    print "Tag table: add %8.3f s  lookup %8.3f s  pickled %9d bytes" % \
+          (tableadd, tablelookup, tablesize)
+
+def benchWorkers(numtraces=4):
+    '''
+    Times a complete L{Fuzzer} run over a few small traces with one worker
+    and with one worker per core, using the persistent fork server.
+    
+    @param numtraces: The number of traces to fuzz
+    @type numtraces: integer
+    '''
+    cfg = benchConfig()
+    tracedir = os.path.join(cfg.get('directories', 'data'), "traces")
+    if not os.path.isdir(tracedir) :
+        os.mkdir(tracedir)
+    store = trace_store.TraceStore(tracedir)
+    store.clear()
+    for i in range(numtraces) :
+        store.append(benchTrace())
+    cfg.set('fuzzer', 'persistent', "yes")
+    cfg.set('fuzzer', 'save_traces', "no")
+    
+    times = {}
+    for workers in [1, max(2, multiprocessing.cpu_count())] :
+        cfg.set('fuzzer', 'workers', str(workers))
+        start = time.time()
+        fuzzer.Fuzzer(cfg).fuzz()
+        times[workers] = time.time() - start
+        print
+    for (workers, elapsed) in sorted(times.items()) :
+        print "%3d workers: %8.3f s" % (workers, elapsed)
+
+if __name__ == '__main__':
+    benches = {
+               "forkserver": benchForkServer,
+               "patches": benchPatches,
+               "checkpoint": benchCheckpoint,
+               "manifest": benchManifest,
+               "streaming": benchStreaming,
+               "heuristics": benchHeuristics,
+               "vectorize": benchVectorize,
+               "findblock": benchFindBlock,
+               "blockaccess": benchBlockAccess,
+               "arena": benchArena,
+               "overlay": benchOverlay,
+               "pointerpatch": benchPointerPatch,
+               "loadobject": benchLoadObject,
+               "typecache": benchTypeCache,
+               "tracefile": benchTraceFile,
+               "tracestore": benchTraceStore,
+               "dedup": benchDedup,
+               "tagtable": benchTagTable,
+               "arrays": benchArrays,
+               "modelindex": benchModelIndex,
+               "rangeunion": benchRangeUnion,
+               "pagecache": benchPageCache,
+               "workers": benchWorkers
+              }
+    names = sys.argv[1:] or sorted(benches.keys())
+    for name in names :
+        print "== %s ==" % name
+        benches[name]()
@@ -0,0 +1,348 @@
+'''
+Checks of the trace storage structures, each comparing a structure
+against a plain model of what it should hold and failing an assertion
+if they disagree. Run as "python checks.py [name ...]" to run the named
+checks, or all of them.
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 23, 2011
+'''
+import logging
+import os
+import pickle
+import random
+import shutil
+import struct
+import sys
+import tempfile
+from morpher.collector import range_union
+from morpher.trace import snapshot, tag, trace, overlay, trace_file, trace_store
+from morpher.trace import tag_table
+
+# The blocks of memory in each snapshot of a sample trace
+BLOCKS = [(0x1000, 16), (0x2000, 8)]
+
+def sampleTrace(calls=3):
+    '''
+    Builds a small L{Trace} whose snapshots each hold two blocks, some
+    tags including a pointer, and a user type
+
+    @param calls: The number of snapshots in the trace
+    @type calls: integer
+
+    @return: The trace
+    @rtype: L{Trace} object
+    '''
+    snaps = []
+    for i in range(calls) :
+        blocks = [(0x1000, struct.pack("4i", i, -i, 2*i, 3)),
+                  (0x2000, struct.pack("<I", 0x1000) + "abcd")]
+        s = snapshot.Snapshot("func%d" % i, blocks)
+        for addr in range(0x1000, 0x1010, 4) :
+            s.addTag(tag.Tag(addr, "i"))
+        s.addTag(tag.Tag(0x2000, "P"))
+        for addr in range(0x2004, 0x2008) :
+            s.addTag(tag.Tag(addr, "c"))
+        s.addTag(tag.Tag(0x1008, "1"))
+        s.setArgs([tag.Tag(0x2000, "P"), tag.Tag(0x1000, "i")])
+        snaps.append(s)
+    return trace.Trace(snaps, {"1": ("struct", ["i", "i"])})
+
+def readBlocks(snap):
+    '''
+    Reads the contents of the sample blocks from a snapshot
+
+    @param snap: A snapshot of a trace from L{sampleTrace}
+    @type snap: L{Snapshot} object
+
+    @return: The contents of each block
+    @rtype: string list
+    '''
+    return [snap.mem.read(addr, size) for (addr, size) in BLOCKS]
+
+def sameTrace(first, second):
+    '''
+    Asserts that two traces hold the same snapshots
+
+    @param first: The first trace
+    @type first: L{Trace} object
+
+    @param second: The second trace
+    @type second: L{Trace} object
+    '''
+    assert len(first.snapshots) == len(second.snapshots)
+    assert first.type_manager.usertypes == second.type_manager.usertypes
+    for (s1, s2) in zip(first.snapshots, second.snapshots) :
+        assert s1.name == s2.name
+        assert [(t.addr, t.fmt) for t in s1.args] == \
+               [(t.addr, t.fmt) for t in s2.args]
+        assert s1.tags == s2.tags
+        assert set(s1.mem.pointers) == set(s2.mem.pointers)
+        assert readBlocks(s1) == readBlocks(s2)
+
+def checkArena():
+    '''
+    Checks that a L{Memory} in arena mode keeps its size and contents
+    through repeated pickling
+    '''
+    mytrace = sampleTrace()
+    mytrace.toArena()
+    original = [readBlocks(s) for s in mytrace.snapshots]
+    size = len(mytrace.snapshots[0].mem.arena)
+    assert size == sum([blksize for (_, blksize) in BLOCKS])
+    for _ in range(3) :
+        mytrace = pickle.loads(pickle.dumps(mytrace, pickle.HIGHEST_PROTOCOL))
+        assert [len(s.mem.arena) for s in mytrace.snapshots] == [size] * 3
+        assert [readBlocks(s) for s in mytrace.snapshots] == original
+
+def checkOverlay():
+    '''
+    Checks that traces materialized from an L{Overlay} hold only their
+    own patches and leave the base trace untouched, both before and
+    after the base is moved into arenas
+    '''
+    for arena in [False, True] :
+        base = sampleTrace()
+        if arena :
+            base.toArena()
+        original = [readBlocks(s) for s in base.snapshots]
+        o = overlay.Overlay(base)
+        o.set(1, 0x1004, "AAAA")
+        first = o.materialize()
+        o.remove(1, 0x1004)
+        o.set(1, 0x2004, "BBBB")
+        second = o.materialize()
+
+        assert [readBlocks(s) for s in base.snapshots] == original
+        expected = list(original[1][0])
+        expected[4:8] = "AAAA"
+        assert readBlocks(first.snapshots[1]) == ["".join(expected), original[1][1]]
+        assert readBlocks(second.snapshots[1]) == [original[1][0], original[1][1][:4] + "BBBB"]
+        for i in [0, 2] :
+            assert readBlocks(first.snapshots[i]) == original[i]
+            assert readBlocks(second.snapshots[i]) == original[i]
+
+        # Unpatched snapshots are shared, patched ones are not
+        assert second.snapshots[0] is base.snapshots[0]
+        assert second.snapshots[1] is not base.snapshots[1]
+        assert second.snapshots[1].mem is not first.snapshots[1].mem
+
+def checkTraceFile():
+    '''
+    Checks that a trace written with L{trace_file.dumps} reads back the
+    same, whole or a snapshot at a time
+    '''
+    mytrace = sampleTrace(5)
+    data = trace_file.dumps(mytrace)
+    sameTrace(mytrace, trace_file.loads(data))
+    tf = trace_file.TraceFile(data)
+    assert len(tf) == 5
+    for i in range(5) :
+        s = tf.loadSnapshot(i)
+        assert s.name == mytrace.snapshots[i].name
+        assert s.tags == mytrace.snapshots[i].tags
+        assert readBlocks(s) == readBlocks(mytrace.snapshots[i])
+    sameTrace(mytrace, tf.loadTrace())
+    tf.close()
+
+def checkTraceStore():
+    '''
+    Checks that a L{TraceStore} recovers from an append cut off part
+    way, from losing its index, and from having its index rebuilt
+    '''
+    tempdir = tempfile.mkdtemp()
+    try :
+        traces = [sampleTrace(i + 1) for i in range(4)]
+        store = trace_store.TraceStore(tempdir)
+        for mytrace in traces[:3] :
+            store.append(mytrace)
+        store.close()
+
+        # An append cut off part way through the record and the index
+        f = open(store.datapath, "ab")
+        f.write(trace_store.RECORD_MAGIC + "x"*30)
+        f.close()
+        f = open(store.indexpath, "ab")
+        f.write("\1" * (trace_store.ENTRY.size - 1))
+        f.close()
+        store = trace_store.TraceStore(tempdir)
+        assert len(store) == 3
+        for (i, mytrace) in enumerate(store) :
+            sameTrace(traces[i], mytrace)
+
+        # Appending after the torn record still gives a readable store
+        store.append(traces[3])
+        store.close()
+        store = trace_store.TraceStore(tempdir)
+        assert len(store) == 4
+        assert os.path.getsize(store.indexpath) % trace_store.ENTRY.size == 0
+        for (i, mytrace) in enumerate(store) :
+            sameTrace(traces[i], mytrace)
+        entries = list(store.entries)
+        store.close()
+
+        # A lost index is rebuilt from the data file
+        os.remove(store.indexpath)
+        store = trace_store.TraceStore(tempdir)
+        assert list(store.entries) == entries
+        store.rebuildIndex()
+        assert list(store.entries) == entries
+        for (i, mytrace) in enumerate(store) :
+            sameTrace(traces[i], mytrace)
+
+        store.clear()
+        assert len(store) == 0
+        store.close()
+    finally :
+        shutil.rmtree(tempdir)
+
+def checkStoreBlocks():
+    '''
+    Checks that a L{TraceStore} keeps each distinct block once, ignores
+    block index entries past the last stored L{Trace}, and rebuilds its
+    block index along with the trace index
+    '''
+    tempdir = tempfile.mkdtemp()
+    try :
+        store = trace_store.TraceStore(tempdir)
+        store.append(sampleTrace(3))
+        # Three different first blocks and one shared second block
+        assert len(store.blocks) == 4
+        store.append(sampleTrace(3))
+        assert len(store.blocks) == 4
+        blocks = dict(store.blocks)
+        store.close()
+
+        # A block entry left by an append cut off before its trace
+        f = open(store.blockpath, "ab")
+        f.write(trace_store.BLOCKENTRY.pack("x"*20, os.path.getsize(store.datapath), 16))
+        f.close()
+        store = trace_store.TraceStore(tempdir)
+        traces = [sampleTrace(3), sampleTrace(3), sampleTrace(4)]
+        store.append(traces[2])
+        assert len(store.blocks) == 5
+        for (i, mytrace) in enumerate(store) :
+            sameTrace(traces[i], mytrace)
+        store.close()
+
+        # Both indexes are rebuilt from the data file
+        os.remove(store.indexpath)
+        os.remove(store.blockpath)
+        store = trace_store.TraceStore(tempdir)
+        assert len(store) == 3
+        store.append(sampleTrace(2))
+        assert len(store.blocks) == 5
+        for (digest, offsets) in blocks.items() :
+            assert store.blocks[digest] == offsets
+        for (i, mytrace) in enumerate(store) :
+            sameTrace((traces + [sampleTrace(2)])[i], mytrace)
+        store.clear()
+        assert not os.path.exists(store.blockpath)
+        store.close()
+    finally :
+        shutil.rmtree(tempdir)
+
+def checkTagTable():
+    '''
+    Checks a L{TagTable} against a set of (address, format) pairs
+    through random adds, lookups and removals
+    '''
+    random.seed(1)
+    sizes = dict((fmt, struct.calcsize(fmt)) for fmt in "chiP")
+    for trial in range(20) :
+        table = tag_table.TagTable()
+        model = set()
+        for _ in range(300) :
+            fmt = random.choice("cchiP1")
+            addr = random.randrange(0, 1000)
+            if fmt == "1" :
+                count = 1
+            elif random.random() < 0.2 :
+                count = random.randrange(1, 200)
+            else :
+                count = 1
+            # Objects of a format may overlap each other, but not repeat
+            objs = [(addr + i*sizes.get(fmt, 1), fmt) for i in range(count)]
+            if model.intersection(objs) :
+                continue
+            table.add(addr, fmt, count)
+            model.update(objs)
+
+        assert len(table) == len(model)
+        assert set((t.addr, t.fmt) for t in table) == model
+        for addr in range(-1, 1900) :
+            for fmt in "chiP1d" :
+                assert table.contains(addr, fmt) == ((addr, fmt) in model)
+        for _ in range(200) :
+            fmt = random.choice("chiP1d")
+            addr = random.randrange(0, 1900)
+            count = random.randrange(1, 5)
+            size = sizes.get(fmt, 1)
+            hit = any(a < addr + count*size and a + size > addr
+                      for (a, f) in model if f == fmt)
+            assert table.overlaps(addr, fmt, count) == hit
+
+        copied = pickle.loads(pickle.dumps(table, 2))
+        assert copied == table
+
+        # Removals split runs without disturbing the other objects
+        for obj in random.sample(sorted(model), len(model) // 3) :
+            table.remove(*obj)
+            model.remove(obj)
+        assert len(table) == len(model)
+        assert set((t.addr, t.fmt) for t in table) == model
+        for (addr, fmt) in model :
+            assert table.contains(addr, fmt)
+        assert not table.contains(-5, "c")
+
+def checkRangeUnion():
+    '''
+    Checks that adding ranges to a L{RangeUnion} one at a time and all at
+    once with L{RangeUnion.extend} give the same covering ranges
+    '''
+    random.seed(3)
+    Range = range_union.RangeUnion.Range
+    for trial in range(300) :
+        ranges = []
+        for _ in range(random.randrange(1, 60)) :
+            low = random.randrange(0, 500)
+            ranges.append(Range(low, low + random.randrange(0, 20)))
+        covered = set(x for r in ranges for x in range(r.low, r.high + 1))
+        for gap in [0, 1, 3, 10] :
+            single = range_union.RangeUnion(gap=gap)
+            for r in ranges :
+                single.add(r)
+            half = len(ranges) // 2
+            batch = range_union.RangeUnion(ranges[:half], gap=gap)
+            batch.extend(ranges[half:])
+            assert single.rlist == batch.rlist
+            assert single.lows == [r.low for r in single.rlist]
+            merged = set(x for r in single.rlist for x in range(r.low, r.high + 1))
+            assert covered <= merged
+            if gap == 0 :
+                assert covered == merged
+            for (r1, r2) in zip(single.rlist, single.rlist[1:]) :
+                assert r2.low - r1.high - 1 > gap
+            for r in single.rlist :
+                assert r.low in covered and r.high in covered
+
+# Map of check names to the functions that run them
+CHECKS = {
+          "arena": checkArena,
+          "overlay": checkOverlay,
+          "tracefile": checkTraceFile,
+          "tracestore": checkTraceStore,
+          "storeblocks": checkStoreBlocks,
+          "tagtable": checkTagTable,
+          "rangeunion": checkRangeUnion,
+          }
+
+if __name__ == '__main__':
+    # The store warns about the damage the checks cause on purpose
+    logging.basicConfig(level=logging.ERROR)
+    names = sys.argv[1:] or sorted(CHECKS)
+    for name in names :
+        CHECKS[name]()
+        print "%s: ok" % name
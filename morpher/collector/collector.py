@@ -11,9 +11,9 @@ list of programs.
 import xml.dom.minidom as xml
 import trace_recorder
 import os
-import pickle
 import logging
 from morpher.misc import status_reporter
+from morpher.trace import trace_store
 
 class Collector(object):
     '''
@@ -59,7 +59,7 @@ class Collector(object):
         parses it, then uses a L{TraceRecorder} object to launch the 
         specified program and create a L{Trace} object with the contents
         of the function calls executed by that program.Each L{Trace} is
-        pickled and stored to the trace directory.
+        appended to the L{TraceStore} in the trace directory.
         '''
         # Check if collecting is enabled
         if not self.cfg.getboolean('collector', 'enabled') : 
@@ -67,15 +67,18 @@ class Collector(object):
             self.log.info("Collecting is off")
             return
         
-        # Clear out or create data/traces
+        # Clear out or create data/traces, including old separate files
         if os.path.isdir(self.tracedir) :
             for filename in os.listdir(self.tracedir) :
                 path = os.path.join(self.tracedir, filename)
-                if os.path.isfile(path) and filename.startswith('trace-') and \
-                    filename.endswith('.pkl'):
+                if os.path.isfile(path) and (filename == 'manifest.json' or \
+                    (filename.startswith('trace-') and \
+                     os.path.splitext(filename)[1] in ('.trc', '.pkl'))):
                     os.remove(path)
         else :
             os.mkdir(self.tracedir)
+        store = trace_store.TraceStore(self.tracedir)
+        store.clear()
             
         # Get configuration info
         listfile = self.cfg.get('collector', 'list')
@@ -118,16 +121,13 @@ class Collector(object):
                 continue
             trace = recorder.record(exe, args)
             if trace != None :
-                # Dump to a new tracefile
-                tracepath = os.path.join(self.tracedir, 'trace-%d.pkl' % self.counter)
+                # Add to the trace store
                 try :
-                    tracefile = open(tracepath, "wb")
-                except :
-                    self.log.warning("Couldn't open file for storing trace: %s", tracepath)
+                    traceid = store.append(trace)
+                except (IOError, OSError) :
+                    self.log.exception("Couldn't store trace in %s", store.datapath)
                     continue
-                self.log.info("Creating trace file %s", tracepath)
-                pickle.dump(trace, tracefile)
-                tracefile.close()
+                self.log.info("Stored trace %d", traceid)
                 self.counter += 1
             sr.pulse()
         
@@ -138,6 +138,13 @@ class Collector(object):
                        number_collected, possible)
         
         sr.done()
+        # Report what storing the blocks by content saved
+        stats = store.getStats()
+        self.log.info("Stored %d bytes of block data in %d bytes (%.2fx), %d bytes once loaded",\
+                      stats["logical"], stats["stored"], stats["ratio"], stats["loaded"])
+        print "  Stored %d traces, %d KB of captured memory deduplicated to %d KB (%.1fx)" % \
+              (stats["traces"], stats["logical"] // 1024, stats["stored"] // 1024, stats["ratio"])
+        store.close()
         self.log.info("Collection process complete")
       
     def parseline(self,line):
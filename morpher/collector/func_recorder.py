@@ -11,8 +11,8 @@ of a function call
 import logging
 import struct
 import snapshot_manager
-from morpher.pydbg import pdx
-from morpher.trace import typemanager
+import model_index
+import page_cache
 
 class FuncRecorder(object):
     '''
@@ -32,50 +32,39 @@ class FuncRecorder(object):
     
     @ivar cfg: The L{Config} object
     @ivar log: The L{logging} object
-    @ivar model: The XML root L{Node} for the DLL model
+    @ivar index: The L{ModelIndex} of the DLL model
     @ivar stack_align: The alignment requirement for the stack
     @ivar type_manager: The L{TypeManager} used for type information 
-    @ivar dbg: The L{pydbg} debugger
+    @ivar cache: The L{PageCache} reading the target's memory during a 
+                 capture
     @ivar sm: L{SnapshotManager} object for creating image
     '''
 
-    def __init__(self, cfg, model):
+    def __init__(self, cfg, index):
         '''
         Stores the given config object for local configuration
         information and initializes the instance variables. The 
-        local type manager is initialized using the supplied model
-        data, which is also used to traverse the stack of the 
-        function being recorded.
+        compiled model is used to traverse the stack of the function
+        being recorded, and its type manager for type information.
         
         @param cfg: The configuration object to use
         @type cfg: L{Config} object
         
-        @param model: The root node of the XML DLL model 
-        @type model: L{Node} object
+        @param index: The compiled DLL model
+        @type index: L{ModelIndex} object
         '''
         # The Config object used for configuration info
         self.cfg = cfg
         # The logging object used for reporting
         self.log = logging.getLogger(__name__)
-        # The xml model used for traversal
-        self.model = model
+        # The compiled model used for traversal
+        self.index = index
         # Stack alignment
         self.stack_align = self.cfg.getint('collector', 'stack_align')
-        
-        # Gather custom type information for the type manager
-        usertypes = {}
-        for usernode in model.getElementsByTagName("usertype"):
-            userid = usernode.getAttribute("id")
-            usertype = usernode.getAttribute("type")
-            userparams = []
-            for childnode in usernode.getElementsByTagName("param") :
-                userparams.append(childnode.getAttribute("type"))
-            usertypes[userid] = (usertype, userparams)
-            
         # Type interpreter  
-        self.type_manager = typemanager.TypeManager(usertypes)
-        # Debugger
-        self.dbg = None
+        self.type_manager = index.type_manager
+        # Cache of the target's memory
+        self.cache = None
         # Snapshot manager
         self.sm = None
     
@@ -97,29 +86,48 @@ class FuncRecorder(object):
         @return: The filled snapshot containing the image of this function call
         @rtype: L{Snapshot} object
         '''
-        self.dbg = dbg
-        startaddr = self.dbg.context.Esp + 0x4
-        # Figure out what function this is
-        for node in self.model.getElementsByTagName("function") :
-            if name == node.getAttribute("name") :
-                func = node
-                break
-        # Create the snapshot manager
-        self.sm = snapshot_manager.SnapshotManager(self.cfg, self.dbg, name)
-        # Tag arguments
-        self.tagArgs(startaddr, func)        
-        # Create the snapshot
-        snap = self.sm.snapshot()
+        backend = page_cache.DebuggerBackend(dbg)
+        return self.capture(backend, dbg.context.Esp + 0x4, name)
+    
+    def capture(self, backend, startaddr, name):
+        '''
+        Records a function call whose arguments start at the given address,
+        reading memory from the given backend through a L{PageCache}. The
+        cache is emptied before returning, since the target resumes once
+        the call has been recorded.
+        
+        @param backend: The backend used to read the target's memory
+        @type backend: L{MemoryBackend} object
+        
+        @param startaddr: Address the function arguments start at
+        @type startaddr: integer
+        
+        @param name: The name of the function we are recording
+        @type name: string
+        
+        @return: The filled snapshot containing the image of this function call
+        @rtype: L{Snapshot} object
+        '''
+        self.cache = page_cache.PageCache(backend)
+        try :
+            # Create the snapshot manager
+            self.sm = snapshot_manager.SnapshotManager(self.cfg, self.cache, name)
+            # Tag arguments
+            self.tagArgs(startaddr, self.index.functions[name])
+            # Create the snapshot
+            snap = self.sm.snapshot()
+        finally :
+            self.cache.invalidate()
         
         return snap
     
-    def tagArgs(self, addr, funcnode):
+    def tagArgs(self, addr, args):
         '''
         Starts the recursive tag process for this function's args.
         
-        Given the function XML's model and the address of the arguments,
-        walks through the arguments and tags each one using this object's
-        snapshot manager. 
+        Given the function's argument layout from the L{ModelIndex} and
+        the address of the arguments, walks through the arguments and tags
+        each one using this object's snapshot manager. 
         
         @note: We can't rely on the arguments being properly aligned - 
                they only need to be aligned to the stack requirements.
@@ -127,19 +135,14 @@ class FuncRecorder(object):
         @param addr: Address the function arguments start at on the stack
         @type addr: integer
         
-        @param funcnode: XML L{Node} for the function
-        @type funcnode: L{Node} object
+        @param args: (format, argument format, size) of each argument
+        @type args: tuple list
         '''
         curaddr = addr
-        for param in funcnode.getElementsByTagName("param") :
-            paramtype = param.getAttribute("type")
-            (size, _) = self.type_manager.getInfo(paramtype)
+        for (paramtype, argtype, size) in args :
             curaddr = self.type_manager.align(curaddr, self.stack_align)
             self.tag(curaddr, paramtype)
-            if paramtype.isdigit() :
-                self.sm.addArg(curaddr, paramtype)
-            else :
-                self.sm.addArg(curaddr, paramtype[0])
+            self.sm.addArg(curaddr, argtype)
             curaddr += size
     
     def tag(self, addr, paramtype):
@@ -149,8 +152,11 @@ class FuncRecorder(object):
         member objects or objects it points to.
         
         If the type is user-defined (for example, "1" indicates a user-defined
-        type such as a struct), the type's definition is looked up using the
-        model and the fields of the type are individually tagged. If the type
+        type such as a struct), the type's layout is looked up in the
+        L{ModelIndex} and the fields of the type are individually tagged. If the type
+        is an array (such as "c[4096]"), an array of a basic type other than
+        a pointer is tagged as a single run of elements, while the elements
+        of any other array are tagged one at a time. If the type
         is a basic type, the type is tagged. If the type is a pointer type,
         such as "PPI", a pointer tag ("P") is added and the tagging is 
         recursively performed on the type pointed to ("PI") at the address
@@ -166,60 +172,49 @@ class FuncRecorder(object):
         @param paramtype: The format string representing the object's type
         @type paramtype: string
         '''
-        # Check the node type
-        if paramtype.isdigit() :
+        layout = self.index.layouts[paramtype]
+        kind = layout[0]
+        if kind == model_index.USER :
             if not self.sm.checkObject(addr, paramtype) :
-                (size, _) = self.type_manager.getInfo(paramtype)
+                (_, size, fields) = layout
                 self.sm.addObject(addr, size, paramtype)
-                # This is a user-defined type - get definition node
-                for typenode in self.model.getElementsByTagName("usertype"):
-                    if int(typenode.getAttribute("id")) == int(paramtype) :
-                        usernode = typenode
-                        break
-                # Check if this is a struct or union type
-                if usernode.getAttribute("type") == "struct" :
-                    # Struct type. Use alignment on offset, not address - we know
-                    # structure will be internally aligned, but can't guarantee
-                    # it's stack address is aligned properly
-                    offset = 0
-                    for childnode in usernode.getElementsByTagName("param") :
-                        childtype = childnode.getAttribute("type")
-                        (size, alignment) = self.type_manager.getInfo(childtype)
-                        offset = self.type_manager.align(offset, alignment)
-                        self.tag(addr + offset, childtype)
-                        offset += size
-                else :
-                    # Union type - tag all elements with same address
-                    for childnode in usernode.getElementsByTagName("param") :
-                        self.tag(addr, childnode.getAttribute("type"))
+                # Struct fields at their offsets, union fields all at 0 -
+                # offsets are within the type, since we can't guarantee
+                # its stack address is aligned properly
+                for (offset, fieldtype) in fields :
+                    self.tag(addr + offset, fieldtype)
+                
+        elif kind == model_index.ARRAY :
+            (_, elemtype, elemsize, count, run) = layout
+            if run :
+                self.sm.addObject(addr, elemsize, elemtype, count)
+            else :
+                # Elements may lead to other objects - tag each one
+                for i in xrange(count) :
+                    self.tag(addr + i*elemsize, elemtype)
                 
         else :
             # This is a basic type - add it if tag does not already exist
-            basictype = paramtype[0]
+            (_, size, basictype, ptype, psize) = layout
             if not self.sm.checkObject(addr, basictype) :
-                (size, _) = self.type_manager.getInfo(basictype)
                 self.sm.addObject(addr, size, basictype)
             # If it's a pointer follow it even if it's already been added -
             # the type it points to could be different. Don't follow if
             # its just "P" (a void * pointer)
-            if paramtype[0] == "P" and len(paramtype) > 1:
-                # Get the pointer's type (everything after the first P)
-                ptype = paramtype[1:]
+            if ptype != None :
                 # Read the pointer's value (address of object)
                 try :
-                    size = struct.calcsize("P")
-                    raw = self.dbg.read_process_memory(addr, size)
+                    raw = self.cache.read(addr, size)
                     paddr = struct.unpack("P", raw)[0]
-                except pdx.pdx :
+                except page_cache.ReadError :
                     # Shouldn't have gotten here, someone gave bad argument
                     # This is a bad object, not in valid memory
                     # We'll discard it during the snapshot
                     return
                 # Check if this paddr is to valid user memory
-                (size, _) = self.type_manager.getInfo(ptype)
                 try : 
-                    self.dbg.read_process_memory(paddr, size)
-                except pdx.pdx :
+                    self.cache.read(paddr, psize)
+                except page_cache.ReadError :
                     return
                 # Tag the pointed-to object
                 self.tag(paddr, ptype)
\ No newline at end of file
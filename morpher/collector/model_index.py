@@ -0,0 +1,119 @@
+'''
+Contains the L{ModelIndex} class for looking up the layouts of the
+functions and types described by the XML model
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 21, 2011
+'''
+
+from morpher.trace import typemanager
+
+# Kinds of layout
+USER = 0
+ARRAY = 1
+BASIC = 2
+
+class ModelIndex(object):
+    '''
+    Compiles the XML model produced by the parser into plain tables, so
+    that recording a function call doesn't search the DOM.
+
+    Every function in the model is mapped to the layout of its arguments,
+    and every format string the arguments can lead to - through the
+    fields of user types, the elements of arrays and the targets of
+    pointers - is mapped to a layout describing how to tag an object of
+    that type. Layouts are tuples whose first item is the kind:
+
+      - (USER, size, fields) for a user-defined type, where fields is a
+        tuple of (offset, format) pairs - every field of a struct, or
+        every field of a union at offset 0
+      - (ARRAY, elemtype, elemsize, count, run) for an array, where run
+        is I{True} if the elements can be tagged as a single run (a basic
+        type other than a pointer)
+      - (BASIC, size, basictype, ptype, psize) for a basic type, where
+        ptype is the format pointed to and psize its size, or I{None} and
+        0 if the type isn't a pointer to a known type
+
+    All the tables are built up front, so a L{FuncRecorder} only looks up
+    dictionaries and walks tuples while the debuggee is paused.
+
+    @ivar usertypes: The usertypes of the model, as used by L{TypeManager}
+    @ivar type_manager: The L{TypeManager} for the usertypes
+    @ivar functions: Map of function names to the layout of their
+                     arguments, a tuple of (format, argument format, size)
+                     triples in argument order
+    @ivar layouts: Map of format strings to layouts
+    '''
+
+    def __init__(self, model):
+        '''
+        Compiles the given model
+
+        @param model: The root node of the XML DLL model
+        @type model: L{Node} object
+        '''
+        self.usertypes = typemanager.readUsertypes(model)
+        self.type_manager = typemanager.TypeManager(self.usertypes)
+        self.functions = {}
+        self.layouts = {}
+
+        pending = list(self.usertypes)
+        for node in model.getElementsByTagName("function") :
+            args = []
+            for param in node.getElementsByTagName("param") :
+                paramtype = str(param.getAttribute("type"))
+                (size, _) = self.type_manager.getInfo(paramtype)
+                if paramtype.isdigit() :
+                    args.append((paramtype, paramtype, size))
+                else :
+                    args.append((paramtype, paramtype[0], size))
+                pending.append(paramtype)
+            self.functions[str(node.getAttribute("name"))] = tuple(args)
+
+        # Compile every format reachable from the arguments and usertypes
+        while pending :
+            fmt = str(pending.pop())
+            if fmt not in self.layouts :
+                self.layouts[fmt] = self._compile(fmt, pending)
+
+    def _compile(self, fmt, pending):
+        '''
+        Builds the layout of a format string, as described in L{ModelIndex}
+
+        @param fmt: The format string
+        @type fmt: string
+
+        @param pending: List to add the formats the layout refers to
+        @type pending: string list
+
+        @return: The layout
+        @rtype: tuple
+        '''
+        tm = self.type_manager
+        (elemtype, count) = typemanager.splitArray(fmt)
+        if count != None :
+            (elemsize, _) = tm.getInfo(elemtype)
+            pending.append(elemtype)
+            run = not elemtype.isdigit() and len(elemtype) == 1
+            return (ARRAY, elemtype, elemsize, count, run)
+        if fmt.isdigit() :
+            (size, _) = tm.getInfo(fmt)
+            objclass = tm.getClass(fmt)
+            (_, userparams) = self.usertypes[fmt]
+            fields = []
+            for (index, fieldtype) in enumerate(userparams) :
+                # Offsets as laid out by ctypes - 0 for every union field
+                offset = getattr(objclass, "field_" + str(index)).offset
+                fields.append((offset, str(fieldtype)))
+                pending.append(fieldtype)
+            return (USER, size, tuple(fields))
+        basictype = fmt[0]
+        (size, _) = tm.getInfo(basictype)
+        if basictype == "P" and len(fmt) > 1 :
+            ptype = fmt[1:]
+            (psize, _) = tm.getInfo(ptype)
+            pending.append(ptype)
+            return (BASIC, size, basictype, ptype, psize)
+        return (BASIC, size, basictype, None, 0)
@@ -0,0 +1,264 @@
+'''
+Contains the L{PageCache} class for reading the memory of a paused
+debuggee a page at a time, and the L{MemoryBackend}s it reads from
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 22, 2011
+'''
+
+import time
+
+# Size of a page of the target's memory
+PAGE_SIZE = 0x1000
+
+class ReadError(Exception):
+    '''
+    Raised when memory of the debuggee can't be read
+    '''
+    pass
+
+class MemoryBackend(object):
+    '''
+    Reads the memory of a debuggee. Subclasses implement L{read} for a
+    particular debugger.
+
+    @ivar reads: The number of reads made
+    @ivar bytes: The number of bytes read
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the read counters
+        '''
+        self.reads = 0
+        self.bytes = 0
+
+    def read(self, addr, size):
+        '''
+        Reads memory of the debuggee
+
+        @raise ReadError: If any of the memory can't be read
+
+        @param addr: The address to read from
+        @type addr: integer
+
+        @param size: The number of bytes to read
+        @type size: integer
+
+        @return: The bytes read
+        @rtype: string
+        '''
+        raise NotImplementedError()
+
+class DebuggerBackend(MemoryBackend):
+    '''
+    Reads the memory of a process attached to a L{pydbg} debugger
+
+    @ivar dbg: The L{pydbg} debugger
+    @ivar error: The exception raised by the debugger for a failed read
+    '''
+
+    def __init__(self, dbg):
+        '''
+        Stores the debugger to read with
+
+        @param dbg: The debugger attached to the target process
+        @type dbg: L{pydbg} object
+        '''
+        MemoryBackend.__init__(self)
+        # Imported here so the rest of the module works without pydbg
+        from morpher.pydbg import pdx
+        self.dbg = dbg
+        self.error = pdx.pdx
+
+    def read(self, addr, size):
+        '''
+        Reads memory of the process with the debugger, as in
+        L{MemoryBackend.read}
+        '''
+        self.reads += 1
+        try :
+            data = self.dbg.read_process_memory(addr, size)
+        except self.error :
+            raise ReadError("Couldn't read %d bytes at %x" % (size, addr))
+        self.bytes += size
+        return data
+
+class FakeDebuggee(MemoryBackend):
+    '''
+    Stands in for a debugged process, holding its memory as a dictionary
+    of pages, so that recording can be run and measured on any platform.
+    As in a real process, memory can only be read from pages that have
+    been mapped by writing to them.
+
+    @ivar pages: Map of page numbers to the contents of mapped pages
+    @ivar delay: Number of seconds each read takes, to stand in for the
+                 cost of reading another process's memory
+    '''
+
+    def __init__(self, regions=None, delay=0):
+        '''
+        Maps the given regions of memory
+
+        @param regions: The (address, data) regions to write
+        @type regions: tuple list
+
+        @param delay: Number of seconds each read takes
+        @type delay: float
+        '''
+        MemoryBackend.__init__(self)
+        self.pages = {}
+        self.delay = delay
+        for (addr, data) in regions or [] :
+            self.write(addr, data)
+
+    def write(self, addr, data):
+        '''
+        Writes data to memory, mapping any pages it covers that are not
+        already mapped with zeros
+
+        @param addr: The address to write to
+        @type addr: integer
+
+        @param data: The bytes to write
+        @type data: string
+        '''
+        done = 0
+        while done < len(data) :
+            (page, offset) = divmod(addr + done, PAGE_SIZE)
+            size = min(PAGE_SIZE - offset, len(data) - done)
+            contents = self.pages.get(page, "\0" * PAGE_SIZE)
+            self.pages[page] = contents[:offset] + data[done:done + size] + \
+                               contents[offset + size:]
+            done += size
+
+    def read(self, addr, size):
+        '''
+        Reads memory of the fake process, as in L{MemoryBackend.read}
+        '''
+        self.reads += 1
+        if self.delay :
+            time.sleep(self.delay)
+        first = addr // PAGE_SIZE
+        last = (addr + size - 1) // PAGE_SIZE
+        pieces = []
+        for page in xrange(first, last + 1) :
+            if page not in self.pages :
+                raise ReadError("Couldn't read %d bytes at %x" % (size, addr))
+            pieces.append(self.pages[page])
+        self.bytes += size
+        start = addr - first*PAGE_SIZE
+        return "".join(pieces)[start:start + size]
+
+class PageCache(object):
+    '''
+    Answers reads of a debuggee's memory from whole pages read once.
+
+    While a breakpoint is handled the same memory is read several times -
+    probing pointers while tagging, then capturing the ranges of the
+    tagged objects. The first read touching a page fetches the whole page
+    from the backend, with any neighbouring pages the read also needs in
+    the same call, and later reads of it are answered from the cache.
+    Pages that can't be read are remembered as well.
+
+    The cache is only valid while the debuggee is paused, so it must be
+    invalidated (see L{invalidate}) before the debuggee resumes.
+
+    @ivar backend: The L{MemoryBackend} to read pages from
+    @ivar pages: Map of page numbers to their contents
+    @ivar bad: Set of page numbers that couldn't be read
+    @ivar hits: The number of reads answered without the backend
+    @ivar misses: The number of reads that needed the backend
+    '''
+
+    def __init__(self, backend):
+        '''
+        Creates an empty cache in front of a backend
+
+        @param backend: The backend to read from
+        @type backend: L{MemoryBackend} object
+        '''
+        self.backend = backend
+        self.pages = {}
+        self.bad = set()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, addr, size):
+        '''
+        Reads memory of the debuggee, fetching the pages it covers that
+        aren't cached yet
+
+        @raise ReadError: If any of the memory can't be read
+
+        @param addr: The address to read from
+        @type addr: integer
+
+        @param size: The number of bytes to read
+        @type size: integer
+
+        @return: The bytes read
+        @rtype: string
+        '''
+        first = addr // PAGE_SIZE
+        last = (addr + size - 1) // PAGE_SIZE
+        pages = self.pages
+        missing = [page for page in xrange(first, last + 1) if page not in pages]
+        if missing :
+            self.misses += 1
+            self._fetch(missing)
+        else :
+            self.hits += 1
+        start = addr - first*PAGE_SIZE
+        if first == last :
+            return pages[first][start:start + size]
+        data = "".join([pages[page] for page in xrange(first, last + 1)])
+        return data[start:start + size]
+
+    def invalidate(self):
+        '''
+        Empties the cache. Must be called before the debuggee resumes,
+        since its memory may change once it runs.
+        '''
+        self.pages = {}
+        self.bad = set()
+
+    def _fetch(self, missing):
+        '''
+        Reads pages into the cache, each run of consecutive pages in a
+        single read. If a run can't be read, its pages are read one at a
+        time to find the ones that can.
+
+        @raise ReadError: If any of the pages can't be read
+
+        @param missing: The page numbers to read, in increasing order
+        @type missing: integer list
+        '''
+        for page in missing :
+            if page in self.bad :
+                raise ReadError("Couldn't read page at %x" % (page*PAGE_SIZE))
+        # Split into runs of consecutive pages
+        runs = []
+        for page in missing :
+            if runs and runs[-1][-1] + 1 == page :
+                runs[-1].append(page)
+            else :
+                runs.append([page])
+        for run in runs :
+            try :
+                data = self.backend.read(run[0]*PAGE_SIZE, len(run)*PAGE_SIZE)
+            except ReadError :
+                if len(run) == 1 :
+                    self.bad.add(run[0])
+                    raise
+                # Keep whichever pages of the run can be read
+                for page in run :
+                    try :
+                        self.pages[page] = self.backend.read(page*PAGE_SIZE, PAGE_SIZE)
+                    except ReadError :
+                        self.bad.add(page)
+                raise ReadError("Couldn't read pages at %x" % (run[0]*PAGE_SIZE))
+            for (i, page) in enumerate(run) :
+                self.pages[page] = data[i*PAGE_SIZE:(i + 1)*PAGE_SIZE]
@@ -8,7 +8,7 @@ Contains the L{RangeUnion} class for maintaining a "covering" set of ranges
 '''
 
 from collections import namedtuple
-from collections import deque
+import bisect
 
 class RangeUnion(object):
     '''
@@ -18,37 +18,54 @@ class RangeUnion(object):
     is given and needs to be "simplified" to an equivalent list with 
     the minimum possible number of ranges and no overlaps. The range list
     is maintained as the instance variable rlist, and rlist is updated
-    each time a new range is added with the L{add} method.
+    each time a new range is added with the L{add} method, or with many
+    ranges at once with L{extend}.
+    
+    The ranges that a new range touches are found by a binary search of
+    the low ends of the ranges, so only those ranges are merged rather 
+    than the whole list being rebuilt. L{extend} sorts the new ranges 
+    together with the existing ones and merges them in a single pass, 
+    which is quicker still when many ranges are known up front.
+    
+    Ranges separated by a gap of no more than the gap tolerance are 
+    merged as well, covering the bytes between them, so that memory 
+    holding many small objects close together is read with one call 
+    instead of one per object. 
     
     Ranges are represented by the "Range" L{namedtuple}
     
     @invariant: Intervals in the range list do not overlap, are in sorted
                 order from lowest address to highest, and for any two 
                 consecutive ranges in the list there is a separation of 
-                at least 1 between the ending address of the first and 
-                the beginning address of the second.
-    
-    @todo: Improve performance of the RangeUnion - use a tree structure?
+                at least gap + 1 between the ending address of the first
+                and the beginning address of the second.
     
     @ivar rlist: A list of Range objects
+    @ivar lows: The low end of each range in rlist, for searching
+    @ivar gap: The largest gap between two ranges that are merged
     '''
     # Our Range type, a tuple of the high and low number
     Range = namedtuple('Range', ['low', 'high'])
     
-    def __init__(self, startlist=None):
+    def __init__(self, startlist=None, gap=0):
         '''
         Takes an optional argument that allows this L{RangeUnion} to 
         be initialized from an existing range list, otherwise empty.
         
         @param startlist: The list of ranges to be initialized from
         @type startlist: Range object list
+        
+        @param gap: The largest gap between two ranges that are merged
+        @type gap: integer
         '''
         # The internal sorted list of non-overlapping ranges
-        self.rlist = deque()
+        self.rlist = []
+        # The low end of each range, kept alongside for bisect
+        self.lows = []
+        self.gap = gap
         
         if startlist :
-            for x in startlist :
-                self.add(x)
+            self.extend(startlist)
         
     def add(self, c):
         '''
@@ -61,33 +78,39 @@ class RangeUnion(object):
         @param c: Range to add
         @type c: Range object
         '''
-        if len(self.rlist) == 0 :
-            c = RangeUnion.Range(c.low, c.high)
-            self.rlist.append(c)
-            return
-        x = c
-        left = deque()
-        # Pop ranges from range list, and compare. If ranges overlap, merge
-        # and pop the next range; else add the popped range to a 'done' list
-        while len(self.rlist) > 0:
-            r = self.rlist.popleft()
-            # Check for overlap and merge
-            if x.low <= r.high + 1 and x.high >= r.low - 1 :
-                low = x.low if x.low < r.low else r.low
-                high = x.high if x.high > r.high else r.high
-                x =  self.Range(low, high)
-                continue
-            # Check to see if any remaining ranges could possibly overlap
-            if x.high < r.low - 1 :
-                # Put the current range back before we exit
-                self.rlist.appendleft(r)
-                break
-            left.append(r)
-        # Add the merged range to the done list
-        left.append(x)
-        # Add all of the remaining to the done list
-        left.extend(self.rlist)
-        # Set range list = done list
-        self.rlist = left
-                        
-            
\ No newline at end of file
+        reach = self.gap + 1
+        # The first range that could touch c is the one starting before
+        # it, if it reaches far enough, or else the one after
+        start = bisect.bisect_left(self.lows, c.low)
+        if start > 0 and self.rlist[start - 1].high + reach >= c.low :
+            start -= 1
+        low = c.low
+        high = c.high
+        end = start
+        while end < len(self.rlist) and self.rlist[end].low <= high + reach :
+            r = self.rlist[end]
+            low = min(low, r.low)
+            high = max(high, r.high)
+            end += 1
+        self.rlist[start:end] = [self.Range(low, high)]
+        self.lows[start:end] = [low]
+    
+    def extend(self, ranges):
+        '''
+        Adds many ranges at once, sorting them with the existing ranges
+        and merging them all in one pass. Gives the same result as 
+        calling L{add} for each.
+        
+        @param ranges: The ranges to add
+        @type ranges: Range object list
+        '''
+        reach = self.gap + 1
+        merged = []
+        for r in sorted(self.rlist + list(ranges)) :
+            if merged and r.low <= merged[-1].high + reach :
+                if r.high > merged[-1].high :
+                    merged[-1] = self.Range(merged[-1].low, r.high)
+            else :
+                merged.append(self.Range(r.low, r.high))
+        self.rlist = merged
+        self.lows = [r.low for r in merged]
@@ -8,9 +8,9 @@ Contains the L{SnapshotManager} class for creating a L{Snapshot}
 '''
 
 import range_union
+import page_cache
 import logging
-from morpher.trace import snapshot, tag
-from morpher.pydbg import pdx
+from morpher.trace import snapshot, tag, tag_table
 
 class SnapshotManager(object):
     '''
@@ -19,33 +19,36 @@ class SnapshotManager(object):
     
     The L{SnapshotManager} provides a simple interface consisting
     of functions like L{addArg} and L{addObject} and handles the more complex
-    issues in the background, such as using sets to ensure the uniqueness of
-    L{Tag}s added to the L{Snapshot} and L{RangeUnion} objects to ensure that
+    issues in the background, such as using a L{TagTable} to ensure the
+    uniqueness of L{Tag}s added to the L{Snapshot} and L{RangeUnion} objects to ensure that
     the minimal amount of memory is copied for the L{Snapshot}. The contents
     of the target process memory are not copied until the L{snapshot} method 
     is called, which uses all the information accumulated to record areas of
-    memory using the debugger and create the requested L{Snapshot}
+    memory through the page cache and create the requested L{Snapshot}
     
     @ivar cfg: The L{Config} object
     @ivar log: The L{logging} object
-    @ivar dbg: The L{pydbg} debugger for capturing memory
+    @ivar cache: The L{PageCache} for reading the target's memory
     @ivar name: Name of the function we are recording
-    @ivar tset: The set of L{Tag} objects for this capture
+    @ivar tags: The L{TagTable} of L{Tag}s for this capture, in the order
+                they were added
     @ivar ru: L{RangeUnion} object used for ensuring that the minimum necessary 
               amount of process memory is captured
+    @ivar ranges: The ranges of the objects added, given to the L{RangeUnion}
+                  all at once when the L{Snapshot} is taken
     @ivar args: Ordered list of L{Tag}s corresponding to the function arguments
     '''
 
-    def __init__(self, cfg, dbg, name):
+    def __init__(self, cfg, cache, name):
         '''
-        Stores the configuration object, a pydbg debugger attached to
+        Stores the configuration object, a cache reading the memory of
         the target process, and the name of the function being captured.
         
         @param cfg: The configuration object to use
         @type cfg: L{Config} object
         
-        @param dbg: The debugger used to access the target process
-        @type dbg: L{pydbg} object
+        @param cache: The cache used to read the target process's memory
+        @type cache: L{PageCache} object
         
         @param name: The name of the function being called
         @type name: string
@@ -54,15 +57,19 @@ class SnapshotManager(object):
         self.cfg = cfg
         # The logging object used for reporting
         self.log = logging.getLogger(__name__)
-        # The pydbg object used to read the process memory for the snapshot
-        self.dbg = dbg
+        # The page cache used to read the process memory for the snapshot
+        self.cache = cache
         # Name of the function we are snapshotting
         self.name = name
-        # Set of tags that need to be registered in the snapshot
-        self.tset = set()
+        # Table of tags that need to be registered in the snapshot
+        self.tags = tag_table.TagTable()
         # The RangeUnion object used to construct the final list of memory
-        # ranges we need to capture for the snapshot
-        self.ru = range_union.RangeUnion()
+        # ranges we need to capture for the snapshot. Gaps are only bridged
+        # within a page, since the next page might not be readable
+        gap = min(self.cfg.getint('collector', 'read_gap'), page_cache.PAGE_SIZE - 1)
+        self.ru = range_union.RangeUnion(gap=gap)
+        # Ranges of the objects added so far
+        self.ranges = []
         # The function's argument tags
         self.args = []
         
@@ -91,12 +98,15 @@ class SnapshotManager(object):
         @return: I{True} if tag already registered, I{False} otherwise
         @rtype: Boolean
         '''
-        return tag.Tag(addr, str(fmt)) in self.tset
+        return self.tags.contains(addr, str(fmt))
         
-    def addObject(self, start, size, fmt):
+    def addObject(self, start, size, fmt, count=1):
         '''
         Adds the memory range from start to start + (size of fmt) -1 to the 
         list of areas to capture. A (start, fmt) tag is added for the object.
+        Given a count, adds that many consecutive objects - the elements 
+        of an array - as one range and one run of tags, skipping any that 
+        are already tagged.
         
         @param start: Address of the object being added
         @type start: integer
@@ -106,19 +116,26 @@ class SnapshotManager(object):
         
         @param fmt: Format string representing the object type
         @type fmt: string
+        
+        @param count: The number of objects
+        @type count: integer
         '''
-        # Create and add the tag
-        t = tag.Tag(start, str(fmt))
-        self.tset.add(t)
+        fmt = str(fmt)
+        # Add the tags
+        if count == 1 or not self.tags.overlaps(start, fmt, count) :
+            self.tags.add(start, fmt, count)
+        else :
+            for i in xrange(count) :
+                if not self.tags.contains(start + i*size, fmt) :
+                    self.tags.add(start + i*size, fmt)
         # Create the range to record
-        r = self.ru.Range(start, start + size - 1)
+        r = self.ru.Range(start, start + size*count - 1)
         self.log.debug("Adding objects type %s, total range from %x to %x to recorder", str(fmt), r.low, r.high)
-        self.ru.add(r)
-        self.log.debug("%s", str(self.ru.rlist))
+        self.ranges.append(r)
         
     def snapshot(self):
         '''
-        Uses the debugger to record the requested areas of the process's memory
+        Uses the page cache to record the requested areas of the process's memory
         and returns the contents as a new L{Snapshot} object. The L{Snapshot}
         is populated using the tags registered using L{addObject} and the 
         arguments added using L{addArg}.
@@ -128,14 +145,17 @@ class SnapshotManager(object):
         '''
         blist = []
         self.log.info("Recording snapshot to file")
+        # Merge the ranges of all the objects
+        self.ru.extend(self.ranges)
+        self.ranges = []
         # Record memory blocks
         for r in self.ru.rlist :
             self.log.debug("Recording range from %x to %x", r.low, r.high)
             addr = r.low
             size = r.high - r.low + 1
             try :
-                data = self.dbg.read_process_memory(addr, size)
-            except pdx.pdx :
+                data = self.cache.read(addr, size)
+            except page_cache.ReadError :
                 # Bad pointers shouldn't have gotten to this point
                 self.log.error("Error trying to access memory for range %x to %x", r.low, r.high)
                 continue
@@ -146,9 +166,9 @@ class SnapshotManager(object):
         # Create the Snapshot and populate it
         s = snapshot.Snapshot(self.name, blist)
         s.setArgs(self.args)
-        for t in self.tset :
-            if not t.fmt.isdigit() :
-                s.addTag(t)     
+        for (addr, fmt, count) in self.tags.runs() :
+            if not fmt.isdigit() :
+                s.addRange(addr, fmt, count)
         if self.log.isEnabledFor(logging.DEBUG):
             self.log.debug("Returning memory object:\n\n%s\n", s.toString())
         return s
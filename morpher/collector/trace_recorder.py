@@ -9,7 +9,7 @@ observing a program using a DLL
 '''
 
 import os
-from morpher.collector import func_recorder
+from morpher.collector import func_recorder, model_index
 from morpher.pydbg import pydbg, defines
 from morpher.trace import trace
 import logging
@@ -26,6 +26,7 @@ class TraceRecorder(object):
     @ivar cfg: The L{Config} object
     @ivar log: The L{logging} object
     @ivar model: The XML root L{Node} for the DLL model
+    @ivar index: The L{ModelIndex} compiled from the model
     @ivar dllpath: Path to the target DLL
     @ivar trace: The list of L{Snapshot} objects to turn into a L{Trace}
     @ivar limit: The number of seconds a program can run before its 
@@ -69,8 +70,10 @@ class TraceRecorder(object):
         self.copies = {}
         # Set of unique functions recorded
         self.collected = set()
+        # The model compiled for quick lookups at each breakpoint
+        self.index = model_index.ModelIndex(model)
         # Function recorder
-        self.func_recorder = func_recorder.FuncRecorder(cfg, model)
+        self.func_recorder = func_recorder.FuncRecorder(cfg, self.index)
     
     def record(self, exe, arg):
         '''
@@ -119,15 +122,7 @@ class TraceRecorder(object):
         self.log.info("Program terminated, recording type information")
         # Record the type information and create the Trace
         if not len(self.trace) == 0 :
-            usertypes = {}
-            for usernode in self.model.getElementsByTagName("usertype"):
-                userid = usernode.getAttribute("id")
-                usertype = usernode.getAttribute("type")
-                userparams = []
-                for childnode in usernode.getElementsByTagName("param") :
-                    userparams.append(childnode.getAttribute("type"))
-                usertypes[userid] = (usertype, userparams)
-            newtrace = trace.Trace(self.trace, usertypes)
+            newtrace = trace.Trace(self.trace, self.index.usertypes)
         else :
             newtrace = None
             
@@ -21,5 +21,8 @@ __all__ = \
     "fuzzer",
     "harness",
     "monitor",
-    "generator"
+    "generator",
+    "vector_generator",
+    "fork_server",
+    "dispatcher"
 ]
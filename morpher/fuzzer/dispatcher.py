@@ -0,0 +1,375 @@
+'''
+Contains the L{Dispatcher} and L{Worker} classes for replaying fuzzed
+L{Trace}s on several L{Monitor}s in parallel
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 13, 2011
+'''
+
+import multiprocessing
+import Queue
+import pickle
+import logging
+import monitor
+from morpher.misc import log_setup
+from morpher.trace import overlay
+
+class Dispatcher(object):
+    '''
+    Hands fuzzed L{Trace}s out to a pool of L{Worker} processes, each of
+    which replays them using its own L{Monitor}.
+
+    The L{Dispatcher} offers the same interface as a L{Monitor} -
+    L{setTraceNum}, L{setBase}, L{run} and L{close} - so the L{Fuzzer} can
+    use either one. Instead of replaying the L{Trace} itself, L{run} puts
+    the run on the short queue of a L{Worker} with room for it, so fuzzing
+    never gets more than a few runs ahead of replay. Outcomes come back on
+    a shared results queue and are totalled in L{stats}.
+
+    The unfuzzed L{Trace} given to L{setBase} is serialized once, and sent
+    to each L{Worker} just before its first run of the batch. Runs are then
+    sent as the patches of their L{Overlay}, which the L{Worker} rebuilds
+    over its copy of the base, so the copy itself is never changed. Runs 
+    without an L{Overlay} are sent as a whole serialized L{Trace}.
+
+    Every run is numbered by the L{Dispatcher} before it is queued, and
+    the L{Worker} passes that number on to its L{Monitor}, so dump files
+    are named by the same trace-X-run-Y scheme as a single L{Monitor}
+    without two workers ever picking the same name.
+
+    A L{Worker} can exit with runs still on its queue, so nothing is ever
+    put on a queue without a time limit: a put that times out checks the
+    L{Worker} is still alive before trying again. Runs that were queued
+    to a L{Worker} that has exited are logged and counted as errors.
+
+    @ivar cfg: The L{Config} configuration object
+    @ivar log: The L{logging} object
+    @ivar numworkers: The number of L{Worker} processes
+    @ivar workers: The list of running L{Worker} processes
+    @ivar queues: One queue of requests per L{Worker}
+    @ivar results: Queue of (tracenum, runnum, outcome, saving, skipping)
+                   results
+    @ivar base: The pickled unfuzzed L{Trace} of the current batch
+    @ivar sent: The batch number of the base each L{Worker} was last sent
+    @ivar next: The L{Worker} to try first for the next run
+    @ivar queued: Map of (tracenum, runnum) of each run without an outcome
+                  yet to the L{Worker} it was queued to
+    @ivar finished: The number of L{Worker}s that have shut down cleanly
+    @ivar tracenum: The number identifying the current batch of L{Trace}s
+    @ivar iter: The number of L{Trace}s queued so far for this batch
+    @ivar stats: Map of run outcome to number of runs, as in L{Monitor}
+    @ivar saved: Map of trace number to seconds of replay skipped by
+                 checkpoints, as in L{Monitor}
+    @ivar skipped: Number of calls left out because of the suffix limit
+    '''
+
+    def __init__(self, cfg, numworkers):
+        '''
+        Stores the configuration and starts the L{Worker} processes.
+
+        @param cfg: The configuration object to use
+        @type cfg: L{Config} object
+
+        @param numworkers: The number of L{Worker} processes to start
+        @type numworkers: integer
+        '''
+        # The config object used for setup info
+        self.cfg = cfg
+        # The logging object
+        self.log = logging.getLogger(__name__)
+        # Queues of runs waiting for each worker, kept short to bound memory
+        self.numworkers = numworkers
+        self.queues = [multiprocessing.Queue(2) for _ in range(numworkers)]
+        # Queue of outcomes coming back from the workers
+        self.results = multiprocessing.Queue()
+        # The base trace for this batch and which workers have been sent it
+        self.base = None
+        self.sent = [None] * numworkers
+        self.next = 0
+        # Runs waiting for an outcome, and the workers that have shut down
+        self.queued = {}
+        self.finished = 0
+        # The trace and iteration number used to name dump files
+        self.tracenum = 0
+        self.iter = 0
+        # Outcome counts across all runs
+        self.stats = {"pass": 0, "crash": 0, "hang": 0, "error": 0}
+        self.saved = {}
+        self.skipped = 0
+
+        self.log.info("Starting %d fuzzing workers", numworkers)
+        self.workers = []
+        for i in range(numworkers) :
+            w = Worker(cfg, i, self.queues[i], self.results)
+            w.start()
+            self.workers.append(w)
+
+    def setTraceNum(self, tracenum):
+        '''
+        Change the trace number used for naming dump files. Automatically sets
+        the iteration number back to 0
+
+        @param tracenum: The new number to use to identify this L{Trace} batch
+        @type tracenum: integer
+        '''
+        self.tracenum = tracenum
+        self.iter = 0
+
+    def setBase(self, trace):
+        '''
+        Registers the unfuzzed L{Trace} of the current batch, which is
+        serialized once here rather than for every L{Worker}.
+
+        @param trace: The original, unfuzzed L{Trace}
+        @type trace: L{Trace} object
+        '''
+        self.base = pickle.dumps(trace, pickle.HIGHEST_PROTOCOL)
+        self.sent = [None] * self.numworkers
+
+    def run(self, trace, overlay=None):
+        '''
+        Queues the run for replay by a L{Worker} with room on its queue,
+        blocking while every queue is full.
+
+        @raise Exception: If every L{Worker} has exited
+
+        @param trace: The trace to run and monitor, or the base of the
+                      overlay if one is given
+        @type trace: L{Trace} object
+
+        @param overlay: The fuzzed variant of the L{Trace} to run instead,
+                        over the L{Trace} given to L{setBase}
+        @type overlay: L{Overlay} object
+        '''
+        if overlay == None or self.base == None :
+            if overlay != None :
+                trace = overlay.materialize()
+            # Serialize now - the caller may change the trace after we return
+            data = pickle.dumps(trace, pickle.HIGHEST_PROTOCOL)
+            case = ("trace", self.tracenum, self.iter, data)
+        else :
+            case = ("case", self.tracenum, self.iter, overlay.getPatches())
+        while True :
+            i = self._pickWorker()
+            if case[0] == "case" and self.sent[i] != self.tracenum :
+                if not self._put(i, ("base", self.tracenum, self.base)) :
+                    continue
+                self.sent[i] = self.tracenum
+            # Listed first, in case the outcome comes back before put returns
+            self.queued[(self.tracenum, self.iter)] = i
+            if self._put(i, case) :
+                break
+            del self.queued[(self.tracenum, self.iter)]
+        self.iter += 1
+        self._collect()
+
+    def close(self):
+        '''
+        Tells the L{Worker}s to finish up, waits for every queued run to
+        be replayed and collects the remaining outcomes.
+        '''
+        self.log.info("Waiting for fuzzing workers to finish")
+        stopping = 0
+        for i in range(self.numworkers) :
+            if self.workers[i].is_alive() and self._put(i, None) :
+                stopping += 1
+        while self.finished < stopping :
+            try :
+                self._record(self.results.get(True, 1))
+            except Queue.Empty :
+                if not any([w.is_alive() for w in self.workers]) :
+                    self.log.error("Fuzzing workers exited early")
+                    break
+        for w in self.workers :
+            w.join()
+        # Anything still without an outcome was lost with its worker
+        for i in range(self.numworkers) :
+            self._lost(i)
+        self.log.info("All fuzzing workers finished")
+
+    def _pickWorker(self):
+        '''
+        Finds a L{Worker} with room on its queue, trying them in turn and
+        waiting for a run to finish while they are all busy.
+
+        @raise Exception: If every L{Worker} has exited
+
+        @return: The index of the chosen L{Worker}
+        @rtype: integer
+        '''
+        while True :
+            for k in range(self.numworkers) :
+                i = (self.next + k) % self.numworkers
+                if not self.workers[i].is_alive() :
+                    self._lost(i)
+                elif not self.queues[i].full() :
+                    self.next = i + 1
+                    return i
+            # A finished run means a worker is taking its next request
+            try :
+                self._record(self.results.get(True, 1))
+            except Queue.Empty :
+                if not any([w.is_alive() for w in self.workers]) :
+                    msg = "All fuzzing workers have exited"
+                    self.log.error(msg)
+                    raise Exception(msg)
+
+    def _put(self, i, request):
+        '''
+        Puts a request on the queue of a L{Worker}, waiting while the queue
+        is full for as long as the L{Worker} is alive.
+
+        @param i: The index of the L{Worker}
+        @type i: integer
+
+        @param request: The request to send
+        @type request: tuple or I{None}
+
+        @return: I{True} if the request was queued, I{False} if the
+                 L{Worker} has exited
+        @rtype: boolean
+        '''
+        while True :
+            try :
+                self.queues[i].put(request, True, 1)
+                return True
+            except Queue.Full :
+                if not self.workers[i].is_alive() :
+                    self._lost(i)
+                    return False
+                self._collect()
+
+    def _lost(self, i):
+        '''
+        Counts the runs queued to a L{Worker} that has exited as errors,
+        after recording any outcomes it sent back before it did
+
+        @param i: The index of the L{Worker}
+        @type i: integer
+        '''
+        self._collect()
+        lost = sorted([key for (key, worker) in self.queued.items() if worker == i])
+        for (tracenum, runnum) in lost :
+            self.log.error("Trace %d run %d was lost when worker %d exited",
+                           tracenum, runnum, i)
+            del self.queued[(tracenum, runnum)]
+            self.stats["error"] += 1
+
+    def _collect(self):
+        '''
+        Records any outcomes the L{Worker}s have sent back, without waiting
+        '''
+        while True :
+            try :
+                result = self.results.get_nowait()
+            except Queue.Empty :
+                return
+            self._record(result)
+
+    def _record(self, result):
+        '''
+        Adds a single (tracenum, runnum, outcome, saving, skipping) result
+        to L{stats}, L{saved} and L{skipped}, or counts a L{Worker} as
+        finished for the I{None} it sends when it shuts down
+
+        @param result: The result sent back by a L{Worker}
+        @type result: (integer, integer, string, float, integer) tuple or
+                      I{None}
+        '''
+        if result == None :
+            self.finished += 1
+            return
+        (tracenum, runnum, outcome, saving, skipping) = result
+        if self.queued.pop((tracenum, runnum), None) == None :
+            # Already counted as an error when its worker was found dead
+            return
+        self.log.debug("Trace %d run %d finished: %s", tracenum, runnum, outcome)
+        self.stats[outcome] += 1
+        self.saved[tracenum] = self.saved.get(tracenum, 0.0) + saving
+        self.skipped += skipping
+
+class Worker(multiprocessing.Process):
+    '''
+    A process that takes queued runs from a L{Dispatcher} and replays
+    them with its own L{Monitor}, sending each outcome back.
+
+    Requests are ("base", tracenum, pickled L{Trace}) to set the base
+    L{Trace} of a batch, ("case", tracenum, runnum, patches) to replay
+    the base with the patches of an L{Overlay} applied, and ("trace",
+    tracenum, runnum, pickled L{Trace}) to replay a whole L{Trace}.
+
+    Each L{Worker} logs to its own file (morpher-worker-N.log) so workers
+    don't clobber each other's output. A I{None} on the run queue tells
+    the L{Worker} to shut down, which it acknowledges with a I{None} on
+    the results queue.
+
+    @ivar cfg: The configuration object
+    @ivar id: The number identifying this L{Worker}
+    @ivar cases: The queue of requests for this L{Worker}
+    @ivar results: The queue to send outcomes back on
+    '''
+
+    def __init__(self, cfg, workerid, cases, results):
+        '''
+        Stores the config and queues for use by the new process.
+
+        @warning: This code is still in the same process as the object creator
+
+        @param cfg: The configuration object
+        @type cfg: L{Config} object
+
+        @param workerid: The number identifying this L{Worker}
+        @type workerid: integer
+
+        @param cases: The queue of requests for this L{Worker}
+        @type cases: L{multiprocessing} Queue
+
+        @param results: The queue of (tracenum, runnum, outcome, saving,
+                        skipping) results
+        @type results: L{multiprocessing} Queue
+        '''
+        multiprocessing.Process.__init__(self)
+        self.cfg = cfg
+        # Not a daemon - daemonic processes can't start harnesses
+        self.daemon = False
+        self.id = workerid
+        self.cases = cases
+        self.results = results
+
+    def run(self):
+        '''
+        Replays queued runs until told to stop.
+        '''
+        log_setup.setupLogging(self.cfg, logname="morpher-worker-%d" % self.id)
+        self.log = logging.getLogger(__name__)
+        self.log.info("Worker %d is running...", self.id)
+
+        # The dispatcher's monitor has already cleaned the dump directories
+        mon = monitor.Monitor(self.cfg, clean=False)
+        base = None
+        while True :
+            case = self.cases.get()
+            if case == None :
+                break
+            if case[0] == "base" :
+                (_, tracenum, data) = case
+                base = pickle.loads(data)
+                mon.setTraceNum(tracenum)
+                mon.setBase(base)
+                continue
+            (kind, tracenum, runnum, data) = case
+            if tracenum != mon.tracenum :
+                mon.setTraceNum(tracenum)
+            mon.setRunNum(runnum)
+            if kind == "case" :
+                # Our copy of the base is shared by every case, never patched
+                outcome = mon.run(base, overlay.Overlay(base, data))
+            else :
+                outcome = mon.run(pickle.loads(data))
+            self.results.put((tracenum, runnum, outcome, mon.saving, mon.skipping))
+
+        mon.close()
+        self.log.info("Worker %d shutting down", self.id)
+        self.results.put(None)
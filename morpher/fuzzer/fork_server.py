@@ -0,0 +1,460 @@
+'''
+Contains the L{ForkServer} class for replaying many L{Trace}s from a
+single, persistent harness process.
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 12, 2011
+'''
+
+import os
+import sys
+import time
+import errno
+import select
+import pickle
+import signal
+import logging
+import itertools
+import multiprocessing
+import harness
+from morpher.misc import log_setup
+
+class ForkServer(harness.Harness):
+    '''
+    A persistent L{Harness} that loads the target library once and then
+    replays every L{Trace} it is given in a child forked from itself.
+
+    Spawning a new L{Harness} for every fuzzed L{Trace} means paying for a
+    new interpreter, a fresh load of the target library and a new debugger
+    attach on every single run. The L{ForkServer} pays those costs once: it
+    loads the library, then sits in a loop waiting for L{Trace}s on its
+    connection. For each one it forks a child, which inherits the loaded
+    library copy-on-write and replays the trace, while the server waits for
+    the child to finish. A crash or hang only ever takes down the child, so
+    the server itself stays up for the whole fuzzing run.
+
+    Progress is reported through a private pipe per child - the child
+    writes a single byte just before each L{Snapshot} is replayed, so the
+    server knows how many calls were started when the child died. Each
+    request is answered with a (status, detail, started, saved) tuple, where
+    status is one of "pass", "crash", "hang" or "error", detail is the
+    terminating signal number for a crash (or exit code for an error),
+    started is the number of L{Snapshot}s that began replaying and saved is
+    the number of seconds of replay skipped thanks to a checkpoint.
+
+    Requests are (kind, data) tuples. A ("trace", L{Trace}) request replays
+    the given L{Trace}. A ("base", pickled L{Trace}) request stores a base
+    L{Trace} and gets no answer; each following ("case", (patches, stop))
+    request replays the base with the patches applied (see 
+    L{Trace.applyPatches}), stopping once stop L{Snapshot}s have been
+    replayed.
+    The patches are only ever applied in the forked child, so the server's
+    copy of the base never changes and nothing has to be reverted.
+
+    When checkpoints are enabled (fuzzer->checkpoint), a case whose
+    patches all fall in L{Snapshot} k or later doesn't replay the
+    unchanged calls 0..k-1 itself. Instead a checkpoint process is forked
+    that replays them once and then waits; every case starting at the same
+    L{Snapshot} is forked from the checkpoint and only replays the rest.
+    In sequential trace mode every value tried for L{Snapshot} k shares
+    the checkpoint, so the prefix is replayed once per L{Snapshot} rather
+    than once per case. The checkpoint is replaced whenever a case starts
+    at a different L{Snapshot}, and is killed along with a case that hangs.
+
+    @note: Only available on platforms supporting I{os.fork} - the
+           L{Monitor} falls back to one L{Harness} per run elsewhere.
+
+    @ivar cfg: The configuration object
+    @ivar inpipe: The connection used to receive L{Trace}s and send results
+    @ivar outpipe: Same connection as inpipe
+    @ivar limit: Number of seconds a child may run before it is killed
+    @ivar target: The loaded target library
+    @ivar base: The base L{Trace} that "case" requests are patched from
+    @ivar checkpoint: Whether cases are started from checkpoints
+    @ivar ckpt_pid: The process id of the running checkpoint, or I{None}
+    @ivar ckpt_conn: The connection used to send cases to the checkpoint
+    @ivar ckpt_rfd: The read end of the checkpoint's progress pipe
+    @ivar ckpt_index: The L{Snapshot} cases from the checkpoint start at
+    @ivar ckpt_time: The number of seconds the checkpoint's prefix took
+    '''
+
+    def __init__(self, cfg, conn):
+        '''
+        Stores the config and the server's end of a duplex connection
+        back to the L{Monitor}.
+
+        @warning: This code is still in the same process as the object creator
+
+        @param cfg: The configuration object with target and logging info
+        @type cfg: L{Config} object
+
+        @param conn: The server's end of a duplex L{multiprocessing} pipe
+        @type conn: Connection
+        '''
+        harness.Harness.__init__(self, cfg, (conn, conn))
+        # Seconds a single replay can run before it is declared hung
+        self.limit = cfg.getint('fuzzer', 'timeout')
+        # The target library, loaded once the server is running
+        self.target = None
+        # The trace that patches are applied to
+        self.base = None
+        # The checkpoint process cases are forked from, if any
+        self.checkpoint = cfg.getboolean('fuzzer', 'checkpoint')
+        self.ckpt_pid = None
+        self.ckpt_conn = None
+        self.ckpt_rfd = None
+        self.ckpt_index = 0
+        self.ckpt_time = 0.0
+
+    def run(self):
+        '''
+        Loads the target library and serves replay requests until the
+        connection is closed or a I{None} request is received.
+        '''
+        log_setup.setupLogging(self.cfg, __name__)
+        self.log = logging.getLogger(__name__)
+        self.log.info("Fork server is running...")
+
+        self.target = self._loadTarget()
+        # Children inherit the classes built here
+        self._warmTypes()
+        self.log.info("Library loaded, waiting for traces")
+
+        # Take down stdout for the shared library once, children inherit it
+        self._kill_output()
+        while True :
+            try :
+                request = self.inpipe.recv()
+            except EOFError :
+                break
+            if request is None :
+                break
+            (kind, data) = request
+            if kind == "base" :
+                self.log.info("Received new base trace")
+                self.dropCheckpoint()
+                self.base = pickle.loads(data)
+                # Children inherit the pointer patch plans
+                for s in self.base.snapshots :
+                    s.mem.getPlan()
+                continue
+            elif kind == "case" :
+                (patches, stop) = data
+                result = self.replayCase(patches, stop)
+            else :
+                result = self.replay(data) + (0.0,)
+            self.log.info("Replay finished: %s", str(result))
+            self.outpipe.send(result)
+
+        self.log.info("Fork server shutting down")
+        self.dropCheckpoint()
+        self.inpipe.close()
+
+    def replay(self, trace, patches=None, stop=None):
+        '''
+        Forks a child to replay the given L{Trace} and waits for it to
+        exit, killing it if it runs longer than the time limit.
+
+        @param trace: The trace to replay
+        @type trace: L{Trace} object
+
+        @param patches: Patches for the child to apply before replaying
+        @type patches: (integer, integer, byte string) tuple list
+
+        @param stop: The number of L{Snapshot}s to replay, or I{None} for all
+        @type stop: integer
+
+        @return: A (status, detail, started) tuple as described above
+        @rtype: (string, integer, integer) tuple
+        '''
+        (rfd, wfd) = os.pipe()
+        pid = os.fork()
+        if pid == 0 :
+            os.close(rfd)
+            self._child(trace, patches, wfd, stop=stop)
+        os.close(wfd)
+
+        # Count progress bytes until the child closes its end of the pipe
+        (started, hung) = self._watch(rfd, time.time() + self.limit)
+        if hung :
+            os.kill(pid, signal.SIGKILL)
+        os.close(rfd)
+        (_, status) = os.waitpid(pid, 0)
+        return self._outcome(status, hung, started)
+
+    def replayCase(self, patches, stop):
+        '''
+        Replays the base L{Trace} with the given patches applied, from a
+        checkpoint if they leave a prefix of the L{Trace} unchanged.
+
+        @param patches: The patches that make up this case
+        @type patches: (integer, integer, byte string) tuple list
+
+        @param stop: The number of L{Snapshot}s to replay
+        @type stop: integer
+
+        @return: A (status, detail, started, saved) tuple as described above
+        @rtype: (string, integer, integer, float) tuple
+        '''
+        start = min([index for (index, _, _) in patches] or [0])
+        if not self.checkpoint or start == 0 :
+            return self.replay(self.base, patches, stop) + (0.0,)
+
+        saved = self.ckpt_time
+        if self.ckpt_pid == None or self.ckpt_index != start :
+            self.dropCheckpoint()
+            result = self.makeCheckpoint(start)
+            if result != None :
+                # The unfuzzed calls failed on their own
+                return result + (0.0,)
+            # This case paid for the prefix
+            saved = 0.0
+
+        self.ckpt_conn.send((patches, stop))
+        (started, hung) = self._watch(self.ckpt_rfd, time.time() + self.limit, \
+                                      self.ckpt_conn)
+        started += self.ckpt_index
+        if not hung :
+            try :
+                return self._outcome(self.ckpt_conn.recv(), False, started) + (saved,)
+            except EOFError :
+                self.log.error("Checkpoint exited unexpectedly")
+        # The checkpoint is stuck or gone - take it down along with the case
+        status = self.dropCheckpoint(kill=hung)
+        return self._outcome(status, hung, started) + (saved,)
+
+    def makeCheckpoint(self, start):
+        '''
+        Forks a checkpoint process that replays the unfuzzed base L{Trace}
+        up to (but not including) the given L{Snapshot} and then waits for
+        cases to fork from that point.
+
+        @param start: The index of the first L{Snapshot} cases will replay
+        @type start: integer
+
+        @return: I{None} if the checkpoint is ready, or a (status, detail,
+                 started) tuple if replaying the prefix failed
+        @rtype: (string, integer, integer) tuple
+        '''
+        self.log.info("Creating checkpoint before snapshot %d", start)
+        (conn, theirs) = multiprocessing.Pipe()
+        (rfd, wfd) = os.pipe()
+        deadline = time.time() + self.limit
+        pid = os.fork()
+        if pid == 0 :
+            conn.close()
+            os.close(rfd)
+            self._checkpoint(start, theirs, wfd)
+        theirs.close()
+        os.close(wfd)
+        # Own process group, so a hung case can be killed with its checkpoint
+        try :
+            os.setpgid(pid, pid)
+        except OSError :
+            pass
+        (self.ckpt_pid, self.ckpt_conn, self.ckpt_rfd) = (pid, conn, rfd)
+        self.ckpt_index = start
+
+        (started, hung) = self._watch(rfd, deadline, conn)
+        if not hung :
+            try :
+                self.ckpt_time = conn.recv()
+                self.log.debug("Checkpoint ready after %f seconds", self.ckpt_time)
+                return None
+            except EOFError :
+                pass
+        self.log.warning("Replaying the calls before snapshot %d failed", start)
+        status = self.dropCheckpoint(kill=hung)
+        return self._outcome(status, hung, started)
+
+    def dropCheckpoint(self, kill=False):
+        '''
+        Shuts down the checkpoint process, if there is one. Safe to call
+        at any time.
+
+        @param kill: Whether to kill the checkpoint and any case it is
+                     running instead of asking it to exit
+        @type kill: boolean
+
+        @return: The checkpoint's exit status, or I{None} if there wasn't one
+        @rtype: integer
+        '''
+        if self.ckpt_pid == None :
+            return None
+        if kill :
+            try :
+                os.killpg(self.ckpt_pid, signal.SIGKILL)
+            except OSError :
+                pass
+        else :
+            try :
+                self.ckpt_conn.send(None)
+            except :
+                pass
+        (_, status) = os.waitpid(self.ckpt_pid, 0)
+        self.ckpt_conn.close()
+        os.close(self.ckpt_rfd)
+        (self.ckpt_pid, self.ckpt_conn, self.ckpt_rfd) = (None, None, None)
+        return status
+
+    def _watch(self, rfd, deadline, conn=None):
+        '''
+        Counts progress bytes arriving on rfd until the pipe is closed,
+        an answer is ready on conn (if given), or the deadline passes.
+
+        @param rfd: The read end of a progress pipe
+        @type rfd: integer
+
+        @param deadline: The time at which to give up, as from I{time.time}
+        @type deadline: float
+
+        @param conn: A connection whose answer also ends the wait
+        @type conn: Connection
+
+        @return: The number of progress bytes read, and whether the
+                 deadline passed
+        @rtype: (integer, boolean) tuple
+        '''
+        started = 0
+        fds = [rfd]
+        if conn != None :
+            fds.append(conn)
+        while True :
+            remaining = deadline - time.time()
+            if remaining <= 0 :
+                return (started, True)
+            try :
+                (ready, _, _) = select.select(fds, [], [], remaining)
+            except select.error, e :
+                if e.args[0] == errno.EINTR :
+                    continue
+                raise
+            if rfd in ready :
+                data = os.read(rfd, 4096)
+                if not data :
+                    return (started, False)
+                started += len(data)
+            elif ready :
+                # Progress always comes before the answer, so check once more
+                (more, _, _) = select.select([rfd], [], [], 0)
+                if not more :
+                    return (started, False)
+
+    def _outcome(self, status, hung, started):
+        '''
+        Turns a child's exit status into a (status, detail, started) tuple
+
+        @param status: The exit status as returned by I{os.waitpid}
+        @type status: integer
+
+        @param hung: Whether the child was killed for running too long
+        @type hung: boolean
+
+        @param started: The number of L{Snapshot}s that began replaying
+        @type started: integer
+
+        @return: A (status, detail, started) tuple as described above
+        @rtype: (string, integer, integer) tuple
+        '''
+        if hung :
+            return ("hang", 0, started)
+        if os.WIFSIGNALED(status) :
+            return ("crash", os.WTERMSIG(status), started)
+        if os.WEXITSTATUS(status) != 0 :
+            return ("error", os.WEXITSTATUS(status), started)
+        return ("pass", 0, started)
+
+    def _checkpoint(self, start, conn, wfd):
+        '''
+        Body of a checkpoint process - replays the base L{Trace} up to
+        the given L{Snapshot}, then forks a child for each (patches, stop)
+        case received on conn and sends back its exit status, until told
+        to stop. Exits without returning to the caller.
+
+        @param start: The index of the first L{Snapshot} not to replay
+        @type start: integer
+
+        @param conn: The checkpoint's end of its connection to the server
+        @type conn: Connection
+
+        @param wfd: The write end of the progress pipe
+        @type wfd: integer
+        '''
+        code = 0
+        try :
+            os.setpgid(0, 0)
+            calls = self.base.replay()
+            begin = time.time()
+            for _ in range(start) :
+                (name, args) = calls.next()
+                os.write(wfd, "\x01")
+                func = getattr(self.target, name)
+                func(*args)
+            # Tell the server how long the calls took
+            conn.send(time.time() - begin)
+            while True :
+                try :
+                    case = conn.recv()
+                except EOFError :
+                    break
+                if case is None :
+                    break
+                (patches, stop) = case
+                pid = os.fork()
+                if pid == 0 :
+                    conn.close()
+                    self._child(self.base, patches, wfd, calls, start, stop)
+                (_, status) = os.waitpid(pid, 0)
+                conn.send(status)
+        except :
+            self.log.exception("Error in checkpoint process")
+            code = 1
+        sys.stdout.flush()
+        os._exit(code)
+
+    def _child(self, trace, patches, wfd, calls=None, first=0, stop=None):
+        '''
+        Body of a forked child - applies any patches, then replays each
+        L{Snapshot} in order, writing a progress byte to wfd before each
+        call, then exits without returning to the caller.
+
+        @param trace: The trace to replay
+        @type trace: L{Trace} object
+
+        @param patches: Patches to apply first, or I{None}
+        @type patches: (integer, integer, byte string) tuple list
+
+        @param wfd: The write end of the progress pipe
+        @type wfd: integer
+
+        @param calls: The trace's replay iterator, if a checkpoint has
+                      already replayed the start of it
+        @type calls: iterator
+
+        @param first: The index of the next L{Snapshot} calls will give
+        @type first: integer
+
+        @param stop: The number of L{Snapshot}s after which to stop, or
+                     I{None} to replay the whole trace
+        @type stop: integer
+        '''
+        code = 0
+        try :
+            if patches :
+                trace.applyPatches(patches)
+            if calls == None :
+                calls = trace.replay()
+            if stop != None :
+                calls = itertools.islice(calls, stop - first)
+            for (name, args) in calls :
+                os.write(wfd, "\x01")
+                func = getattr(self.target, name)
+                func(*args)
+        except :
+            self.log.exception("Error replaying trace in forked child")
+            code = 1
+        # Skip interpreter teardown - it belongs to the server
+        sys.stdout.flush()
+        os._exit(code)
@@ -7,19 +7,21 @@ Contains the L{Fuzzer} class for controlling Morpher fuzzing phase
 @since: October 28, 2011     
 '''
 import os
-import pickle
 import monitor
+import dispatcher
 import generator
 import logging
 from morpher.misc import parallel_reporter
+from morpher.trace import trace_store
+from morpher.trace import overlay
 
 class Fuzzer(object):
     '''
     Top-level class in charge of reading in stored L{Trace}s, fuzzing their
     contents, replaying them back and recording the results.
     
-    Most of this class's functionality is reading in L{Trace} files from
-    the appropriate directory, then iterating through each L{Tag} for each
+    Most of this class's functionality is reading in L{Trace}s from the
+    L{TraceStore} in the appropriate directory, then iterating through each L{Tag} for each
     L{Trace}. An internal L{Generator} object is used to get a list of
     fuzzed value for each L{Tag}, and each fuzzed value is used to
     overwrite the original value in turn. Each changed version of the
@@ -27,6 +29,17 @@ class Fuzzer(object):
     versions have been replayed the original value is restored and the
     entire process is repeated for the next tag.
     
+    The loaded L{Trace} itself is never written to. Fuzzed values are
+    written into an L{Overlay} over it instead, and each fuzzed version is
+    handed to the L{Monitor} as a copy of that L{Overlay} - a short list
+    of changes against the original L{Trace}, which is handed over only
+    once per batch. Restoring a tag just drops its patch.
+    
+    Each L{Tag} is identified to the L{Generator} by its trace number,
+    snapshot index and tag index, which its random values are derived 
+    from, so a run can be reproduced from the campaign seed and the
+    trace number in its dump file name.
+    
     @todo: Possibly expand fuzzing to multiple tags at once
     @todo: Possibly generate L{Trace} for functions we didn't 
            actually collect any data for.
@@ -39,12 +52,15 @@ class Fuzzer(object):
     @ivar pr: The L{ParallelReporter} object used to indicate progress
     @ivar tracenum: The number identifying the current L{Trace}
     @ivar generator: The L{Generator} object used for fuzzing L{Trace} values
-    @ivar monitor: The L{Monitor} object used for replaying L{Trace}s.
+    @ivar monitor: The L{Monitor} object used for replaying L{Trace}s, or
+                   a L{Dispatcher} sharing them out between several workers
     @ivar fuzz_pointers: Boolean indicating if pointers should be fuzzed
     @ivar snapshot_mode: String indicating if snapshots should have their tags fuzzed
                          one by one ("sequential") or all at once ("simultaneous")
     @ivar trace_mode: String indicating if traces should have their snapshots fuzzed
                       one by one ("sequential") or all at once ("simultaneous")
+    @ivar overlay: The L{Overlay} holding the fuzzed values currently in use
+    @ivar arena: Boolean indicating if loaded traces are switched to arena mode
     '''
 
     def __init__(self, cfg):
@@ -75,6 +91,10 @@ class Fuzzer(object):
         # String indicating if traces should have their snapshots fuzzed
         # one by one ("sequential") or all at once ("simultaneous")
         self.trace_mode = None
+        # The fuzzed values currently laid over the trace
+        self.overlay = None
+        # Boolean indicating if snapshot memory is kept in one buffer
+        self.arena = False
         
     def fuzz(self):
         '''
@@ -82,17 +102,19 @@ class Fuzzer(object):
         
         If fuzzing is disabled according to the configuration object,
         this function prints a message saying so and returns.
-        Otherwise the data\traces directory is searched for L{Trace}
-        files, and each one is read into memory.
+        Otherwise the index of the L{TraceStore} in the data\traces
+        directory is read to size the progress bar (importing separate
+        L{Trace} files left by older versions if the store is empty), and
+        each trace is then read into memory in turn.
         
         For each L{Snapshot} in each L{Trace}, the list of L{Tag}s is
         extracted. For each L{Tag}, the original value is saved and
         used to create a list of fuzzed values from the L{Generator}.
-        For each fuzzed value, the fuzzed value is used to overwrite the
-        original value, and the modified L{Trace} is fed to the 
+        For each fuzzed value, the fuzzed value is laid over the
+        original value, and the resulting L{Overlay} is fed to the 
         L{Monitor} for replay. After every fuzzed version has been run,
-        the original value is restored and fuzzing moves on to the next
-        tag.The above process describes "sequential" mode for traces and
+        the original value is uncovered and fuzzing moves on to the next
+        tag. The above process describes "sequential" mode for traces and
         snapshots; "simultaneous" mode performs the above steps for all
         tags in a snapshot and/or all snapshots in a trace at the same time.
         
@@ -110,68 +132,95 @@ class Fuzzer(object):
         
         # Set up the monitor here since it cleans directories
         self.monitor = monitor.Monitor(self.cfg)
+        # With more than one worker, replay is handed off to a dispatcher
+        workers = self.cfg.getint('fuzzer', 'workers')
+        if workers > 1 :
+            self.monitor = dispatcher.Dispatcher(self.cfg, workers)
         
         self.fuzz_pointers = self.cfg.getboolean('fuzzer', 'fuzz_pointers')
         self.snapshot_mode = self.cfg.get('fuzzer', 'snapshot_mode')
         self.trace_mode = self.cfg.get('fuzzer', 'trace_mode')
+        self.arena = self.cfg.getboolean('fuzzer', 'arena')
         
         # Get the stored traces
         datadir = self.cfg.get('directories', 'data')
         tracedir = os.path.join(datadir, "traces")
         
-        self.log.info("Checking trace directory for files: %s", tracedir)
-        flist = os.listdir(tracedir)
+        # The store's index counts the tags, so the reporter knows how
+        # much work there is without loading every trace
+        self.log.info("Opening trace store in directory: %s", tracedir)
+        store = trace_store.TraceStore(tracedir)
+        if len(store) == 0 :
+            # Traces collected as separate files by older versions
+            store.importFiles(tracedir)
+        numtags = store.countTags()
         
-        # Sort out which files are traces and add up the number of tags
-        # This stage is repeated later and is not good for performance -
-        # it's done mainly for the SectionReporter, which needs an idea
-        # of how much work needs to be done.
-        numtags = 0;
-        filelist = []
-        for tracefile in flist :
-            # Check that this is a trace file
-            path = os.path.join(tracedir, tracefile)
-            if os.path.isfile(path) and path.endswith(".pkl"):
-                # Add to file list
-                filelist.append(path)
-                f = open(path)
-                trace = pickle.load(f)
-                f.close()
-                for snap in trace.snapshots :
-                    numtags += len(snap.tags)
-                    
         self.log.info("Counted %s total fuzz targets across all traces", numtags)
         self.pr = parallel_reporter.ParallelReporter(numtags)
         self.pr.start("  Fuzzer is running...")
-        for tracefile in filelist :
-            # Unpickle the trace
-            self.log.info("Loading new trace: %s", tracefile)
-            f = open(tracefile)
-            trace = pickle.load(f)
-            f.close()
-            # Increment the tracenum
-            self.log.info("Trace number set to %d", self.tracenum)
-            self.monitor.setTraceNum(self.tracenum)
-            self.tracenum += 1
-            # Main fuzzing loop
-            for _ in self.fuzzTrace(trace) :
-                self.log.info("Sending next trace")
-                self.monitor.run(trace)
-           
-            self.log.info("Trace fuzzing complete")
+        try :
+            for traceid in range(len(store)) :
+                self.log.info("Loading new trace: %d", traceid)
+                trace = store.loadTrace(traceid)
+                if self.arena :
+                    trace.toArena()
+                self.log.info("Trace number set to %d", self.tracenum)
+                self.monitor.setTraceNum(self.tracenum)
+                # Hand over the unfuzzed trace, runs are sent as overlays
+                self.monitor.setBase(trace)
+                self.overlay = overlay.Overlay(trace)
+                # Main fuzzing loop
+                for variant in self.fuzzTrace(trace) :
+                    self.log.info("Sending next trace")
+                    self.monitor.run(trace, variant)
+               
+                self.log.info("Trace fuzzing complete")
+                # Increment the tracenum
+                self.tracenum += 1
+        finally :
+            # Wait for outstanding runs and shut down any helper processes
+            self.monitor.close()
+            store.close()
         self.pr.done()
+        
+        stats = self.monitor.stats
+        runs = sum(stats.values())
+        self.log.info("Fuzzing results: %d runs, %d crashes, %d hangs, %d errors", \
+                      runs, stats["crash"], stats["hang"], stats["error"])
+        print "\n  Fuzzer found %d crashes and %d hangs in %d runs" % \
+              (stats["crash"], stats["hang"], runs)
+        # Report the replay time checkpoints saved
+        saved = self.monitor.saved
+        for (tracenum, seconds) in sorted(saved.items()) :
+            self.log.info("Trace %d: checkpoints saved %.3f seconds of replay", \
+                          tracenum, seconds)
+        if sum(saved.values()) > 0 :
+            print "  Checkpoints saved %.1f seconds of replay" % sum(saved.values())
+        # Report the calls the suffix limit left out
+        skipped = self.monitor.skipped
+        self.log.info("Suffix limit skipped %d calls", skipped)
+        if skipped > 0 :
+            print "  Suffix limit skipped %d calls" % skipped
+        # Report what's needed to repeat the random cases
+        if self.generator.random :
+            backend = ""
+            if self.generator.vectorizer != None :
+                backend = " with NumPy"
+            print "  Random values used seed %d (shard %d of %d)%s" % \
+                  (self.generator.seed, self.generator.shard, \
+                   self.generator.shards, backend)
         self.log.info("All traces fuzzed. Fuzzer shutting down")
-            
+        
     def fuzzTrace(self, trace):
         '''
         Takes a L{Trace} to fuzz and returns an iterator object. Each iteration
-        modifies the original trace in some way and then returns a reference
-        to that trace. The L{Trace} is not restored to its original state after
-        the fuzzing is completed.
+        changes L{overlay} in some way and then returns a copy of it, so the
+        fuzzed versions stay valid however long they are kept. The L{Trace}
+        itself is never modified.
         
         If trace mode is set to "sequential", each snapshot is fuzzed one at a
-        time in the trace, that is, an iterator is obtained using L{fuzzSnapshot}
-        for the first snapshot, and the L{Trace} is updated for each fuzzed value
+        time in the trace, that is, an iterator is obtained using L{fuzzSnap}
+        for the first snapshot, and an L{Overlay} is returned for each fuzzed value
         given by the iterator until the iterator is exhausted. Then the process
         moves to the next L{Snapshot} and so on. In "simultaneous" mode is set,
         the iterators are exercised for all the L{Snapshot}s in the L{Trace}
@@ -180,23 +229,23 @@ class Fuzzer(object):
         @param trace: The original L{Trace} object to fuzz
         @type trace: L{Trace} object
         
-        @return: iterator generating fuzzed L{Trace} objects
+        @return: iterator generating L{Overlay}s describing fuzzed L{Trace}s
         @rtype: Iterator object
         '''
         if self.trace_mode.lower() == "sequential" :
             # Fuzz snapshots one at a time
             self.log.info("Fuzzing snapshots sequentially")
-            for snap in trace.snapshots :
+            for (index, snap) in enumerate(trace.snapshots) :
                 self.log.debug("Fuzzing next snapshot...")
-                for _ in self.fuzzSnap(snap) :
-                    yield trace
+                for _ in self.fuzzSnap(snap, index) :
+                    yield self.overlay.copy()
         else :
             # Fuzz all the snapshots at once
             self.log.info("Fuzzing snapshots simultaneously")
             remaining = []
             # Get the iterators
-            for snap in trace.snapshots :
-                remaining.append(self.fuzzSnap(snap))
+            for (index, snap) in enumerate(trace.snapshots) :
+                remaining.append(self.fuzzSnap(snap, index))
             # Run through all iterators until completed
             while len(remaining) > 0 :
                 # Fuzz every snapshot
@@ -207,25 +256,25 @@ class Fuzzer(object):
                         fuzzer.next()
                     except StopIteration :
                         remaining.remove(fuzzer)
-                # Return trace - check that at least one iterator
+                # Return the overlay - check that at least one iterator
                 # yielded a new value (otherwise all would be removed)
                 if len(remaining) > 0 :
-                    yield trace
+                    yield self.overlay.copy()
                 else :
                     self.log.debug("Snapshot has been totally fuzzed")
                 
     
-    def fuzzSnap(self, snap):
+    def fuzzSnap(self, snap, index):
         '''
         Takes a L{Snapshot} to fuzz and returns an iterator object. Each iteration
-        modifies the original snapshot in some way and then returns a reference
-        to that snapshot. Once the iterator is exhausted the L{Snapshot} is 
-        returned to its original state.
+        lays new fuzzed values over the snapshot in L{overlay} and then returns
+        L{overlay}. Once the iterator is exhausted the snapshot's patches are
+        removed again; the L{Snapshot} itself is never modified.
         
         If snapshot mode is set to "sequential", only one tag is fuzzed at a time
         - all the tags but one will retain their original value. If the mode is
         "simultaneous" the fuzzing mode is applied to all the tags at once, i.e. a
-        fuzzed value is generated for each tag and the snapshot is returned, and the
+        fuzzed value is generated for each tag and the overlay is returned, and the
         process repeats until all the tags have run out of fuzzed value. If a tag 
         finishes fuzzing before the remaining tags have finished, it retains the
         last fuzzed value it was given until the remaining tags are completed.
@@ -233,13 +282,17 @@ class Fuzzer(object):
         @param snap: The original L{Snapshot} object to fuzz
         @type snap: L{Snapshot} object
         
-        @return: iterator generating fuzzed L{Snapshots} objects
+        @param index: The position of the L{Snapshot} in its L{Trace}, used
+                      to record the fuzzed values as patches
+        @type index: integer
+        
+        @return: iterator generating the updated L{Overlay}
         @rtype: Iterator object
         '''
         if self.snapshot_mode.lower() == "sequential"  :
             # Fuzz one tag at a time
             self.log.info("Fuzzing tags one at a time")
-            for tag in snap.tags :
+            for (tagindex, tag) in enumerate(snap.tags) :
                 # Check if this a pointer and if we're fuzzing them
                 if not self.fuzz_pointers and tag.fmt == "P" :
                     self.log.debug("Skipping pointer tag for fuzzing")
@@ -247,27 +300,28 @@ class Fuzzer(object):
                     self.pr.endChunk(mychunk)
                 else :
                     self.log.debug("Fuzzing next tag in memory image")
-                    # Store original value for this tag
+                    # The original value the fuzzed values are based on
                     (old,) = snap.mem.read(tag.addr, fmt=tag.fmt)
-                    fuzzed_values = self.generator.generate(tag.fmt, old)
+                    key = (self.tracenum, index, tagindex)
+                    (count, fuzzed_values) = self.generator.cases(tag.fmt, old, key)
                     # Fuzz this tag
-                    mychunk = self.pr.getChunk(len(fuzzed_values))
-                    for v in fuzzed_values :
-                        # Write the fuzzed value
-                        snap.mem.write(tag.addr, (v,), fmt=tag.fmt)
-                        yield snap
+                    mychunk = self.pr.getChunk(max(1, count))
+                    for (_, packed) in fuzzed_values :
+                        # Lay the fuzzed value over the tag, already packed
+                        self.overlay.set(index, tag.addr, packed)
+                        yield self.overlay
                         self.pr.pulseChunk(mychunk)
-                    # Restore tag value
+                    # Uncover the original value
                     self.log.debug("Tag fuzzing complete, restoring value")
-                    snap.mem.write(tag.addr, (old,), fmt=tag.fmt)
+                    self.overlay.remove(index, tag.addr)
                     self.pr.endChunk(mychunk)
         else :
             # Fuzz all the tags at once
             self.log.info("Fuzzing all tags simultaneously")
             remaining = {}
-            orig = {}
+            pending = {}
             chunks = {}
-            for tag in snap.tags :
+            for (tagindex, tag) in enumerate(snap.tags) :
                 # Check if this a pointer and if we're fuzzing them
                 if not self.fuzz_pointers and tag.fmt == "P" :
                     self.log.debug("Skipping pointer tag for fuzzing")
@@ -277,11 +331,15 @@ class Fuzzer(object):
                     self.log.debug("Getting fuzzed values for tag")
                     # Get fuzzed values for this tag
                     (old,) = snap.mem.read(tag.addr, fmt=tag.fmt)
-                    # Store the old value so it can be restored later
-                    fuzzed_values = self.generator.generate(tag.fmt, old)
-                    orig[tag] = old
-                    remaining[tag] = fuzzed_values
-                    chunks[tag] = self.pr.getChunk(len(fuzzed_values))
+                    key = (self.tracenum, index, tagindex)
+                    (count, fuzzed_values) = self.generator.cases(tag.fmt, old, key)
+                    chunks[tag] = self.pr.getChunk(max(1, count))
+                    # Values are fetched one ahead to spot the last one
+                    try :
+                        pending[tag] = fuzzed_values.next()
+                        remaining[tag] = fuzzed_values
+                    except StopIteration :
+                        self.pr.endChunk(chunks[tag])
                     
 
             # Iterate through every fuzzed value of every tag
@@ -291,20 +349,20 @@ class Fuzzer(object):
                 current = list(remaining.items())
                 for (tag, values) in current :
                     # Get next fuzzed value
-                    v = values.pop()
+                    (_, packed) = pending[tag]
                     self.pr.pulseChunk(chunks[tag])
                     # If that was the last value, remove the tag from list
-                    if len(values) == 0 :
+                    try :
+                        pending[tag] = values.next()
+                    except StopIteration :
                         remaining.pop(tag)
                         self.pr.endChunk(chunks[tag])
-                    else :
-                        remaining[tag] = values
-                    # Write the fuzzed value
-                    snap.mem.write(tag.addr, (v,), fmt=tag.fmt)
-                # Return the fuzzed snapshot
-                yield snap
+                    # Lay the fuzzed value over the tag, already packed
+                    self.overlay.set(index, tag.addr, packed)
+                # Return the updated overlay
+                yield self.overlay
 
-            # Done fuzzing, restore the snapshot
+            # Done fuzzing, uncover the original values
             self.log.debug("All tags fuzzed, restoring snapshot")
-            for (tag, value) in orig.items() :
-                snap.mem.write(tag.addr, (value,), fmt=tag.fmt)
\ No newline at end of file
+            for tag in chunks :
+                self.overlay.remove(index, tag.addr)
\ No newline at end of file
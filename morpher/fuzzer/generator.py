@@ -7,9 +7,14 @@ Contains the L{Generator} class for building collections of fuzzed values
 @since: October 30, 2011
 '''
 
+import math
 import random
 import struct
+import hashlib
 import logging
+import itertools
+import vector_generator
+from morpher.misc import bloom_filter
 
 class Generator(object):
     '''
@@ -21,12 +26,42 @@ class Generator(object):
     and an original value. A map is used to match the format string type
     to the appropriate generator function - for example, unsigned integer
     types of all sizes are fuzzed using the L{_getUints} function. The 
-    individual generator functions return the values as a set, ensuring
-    that no value is repeated, which is turned into a list and returned
-    to the caller. Values are generated according to methods specified
-    in the configuration.
+    individual generator functions return the mutational values as a set,
+    ensuring that no value is repeated. Heuristic values don't depend on 
+    the original value, so they come from a second map of functions, such
+    as L{_heuristicUints}, which are only called once per format for the
+    life of the process - the resulting table is shared by every 
+    L{Generator}, and holds each value along with its packed bytes. Random
+    values are drawn one at a time from a third map of functions, such as
+    L{_randUint}. Values are generated according to methods specified in
+    the configuration.
+    
+    L{generate} returns every value as a list. L{cases} can also stream
+    the values instead (fuzzer->streaming), producing random values only
+    as they are used, so even millions of random cases per tag take 
+    little memory. Random values that were already produced are skipped
+    using a L{BloomFilter}, which very occasionally skips a new value
+    too, and the number of values is estimated rather than counted.
+    L{cases} gives each value along with its packed bytes, so the caller
+    can write them to memory directly.
+    
+    Random values are reproducible. Every campaign has a seed 
+    (fuzzer->seed, chosen at random if not given), and the random values
+    for each tag are drawn from their own L{random.Random} stream, seeded
+    from the campaign seed and the tag's coordinates - the trace number,
+    snapshot index and tag index passed to L{cases}. Any random case can 
+    be regenerated from the seed and its coordinates alone, no matter
+    which tags were fuzzed before it. The same sequence lets a campaign
+    be split into shards (fuzzer->shard of fuzzer->shards): each tag's
+    cases are numbered in order and every shard takes the ones whose 
+    number matches it modulo the number of shards, so shards run with the
+    same seed and settings never repeat each other's cases.
+    
+    When NumPy is installed and fuzzer->vectorize is on, the values of 
+    numeric types are built in bulk by a L{VectorGenerator} instead
+    (except in streaming mode). Its random values differ from the 
+    pure-Python ones, so a campaign must be repeated with the same backend.
     
-    @todo: Use memoization to increase performance
     @todo: Examine fuzzing algorithms for possible improvement
     
     @ivar cfg: The L{Config} configuration object for this L{Monitor}
@@ -38,8 +73,27 @@ class Generator(object):
     @ivar heuristic: Boolean indicating if heuristic values should be used
     @ivar random: Boolean indicating if random values should be used
     @ivar randcases: Number of values chosen at random to produce
+    @ivar streaming: Boolean indicating if L{cases} should stream values
+    @ivar seed: The campaign seed random values are derived from
+    @ivar rng: The L{random.Random} stream used for values without coordinates
+    @ivar shard: The number of the shard of cases this L{Generator} gives out
+    @ivar shards: The number of shards the cases are split into
+    @ivar vectorizer: The L{VectorGenerator} used for numeric types, or 
+                      I{None} if values are only built in pure Python
     @ivar generators: Map of format strings to appropriate generator function
+    @ivar heuristics: Map of format strings to the function listing their
+                      heuristic values
+    @ivar randomizers: Map of format strings to the function drawing a
+                       single random value, for types fuzzed with random values
+    @cvar tables: Map of format strings to their heuristic values, as a list
+                  of (value, packed bytes) pairs
+    @cvar packers: Map of format strings to compiled L{struct.Struct}s
     '''
+    
+    # Heuristic tables and packers are the same for every Generator, so
+    # they are built on first use and shared
+    tables = {}
+    packers = {}
 
     def __init__(self, cfg):
         '''
@@ -63,6 +117,31 @@ class Generator(object):
         self.random = cfg.getboolean('fuzzer', 'random')
         # Number of random values to return
         self.randcases = cfg.getint('fuzzer', 'random_cases')
+        # Boolean indicating values are produced lazily
+        self.streaming = cfg.getboolean('fuzzer', 'streaming')
+        # The campaign seed - pick one if not given, and record it so the
+        # campaign can be repeated
+        self.seed = cfg.getint('fuzzer', 'seed')
+        if self.seed < 0 :
+            self.seed = random.SystemRandom().randint(0, 2**32 - 1)
+            cfg.set('fuzzer', 'seed', str(self.seed))
+        self.log.info("Random fuzzing seed is %d", self.seed)
+        self.rng = random.Random(self.seed)
+        # The slice of the cases we're responsible for
+        self.shard = cfg.getint('fuzzer', 'shard')
+        self.shards = cfg.getint('fuzzer', 'shards')
+        if self.shards < 1 or self.shard < 0 or self.shard >= self.shards :
+            msg = "Shard %d of %d is not a valid shard" % (self.shard, self.shards)
+            self.log.error(msg)
+            raise Exception(msg)
+        # The NumPy backend for numeric types, if it can be used
+        self.vectorizer = None
+        if cfg.getboolean('fuzzer', 'vectorize') and not self.streaming :
+            if vector_generator.available() :
+                self.log.info("Generating numeric values with NumPy")
+                self.vectorizer = vector_generator.VectorGenerator(self)
+            else :
+                self.log.info("NumPy is not installed, generating values in Python")
         # Each format string type is mapped to a particular
         self.generators = {
                             "c": self._getChars,
@@ -80,8 +159,42 @@ class Generator(object):
                             "d": self._getFloats,
                             "P": self._getPointers
                            }
+        # Each format string type is mapped to its heuristic values
+        self.heuristics = {
+                            "c": self._heuristicChars,
+                            "b": self._heuristicInts,
+                            "B": self._heuristicUints,
+                            "h": self._heuristicInts,
+                            "H": self._heuristicUints,
+                            "i": self._heuristicInts,
+                            "I": self._heuristicUints,
+                            "l": self._heuristicInts,
+                            "L": self._heuristicUints,
+                            "q": self._heuristicInts,
+                            "Q": self._heuristicUints,
+                            "f": self._heuristicFloats,
+                            "d": self._heuristicFloats,
+                            "P": self._heuristicPointers
+                           }
+        # Each format string type that takes random values is mapped to
+        # the function drawing one of them
+        self.randomizers = {
+                            "c": self._randChar,
+                            "b": self._randInt,
+                            "B": self._randUint,
+                            "h": self._randInt,
+                            "H": self._randUint,
+                            "i": self._randInt,
+                            "I": self._randUint,
+                            "l": self._randInt,
+                            "L": self._randUint,
+                            "q": self._randInt,
+                            "Q": self._randUint,
+                            "f": self._randFloat,
+                            "d": self._randFloat
+                           }
     
-    def generate(self, fmt, orig):
+    def generate(self, fmt, orig, key=None):
         '''
         Takes a type and a value and returns a list of fuzzed values,
         which is created using some or all of the methods listed:
@@ -101,30 +214,242 @@ class Generator(object):
           3. Random: several values are chosen at random from the
              set of legal values for this type.
         
+        The list holds every case, regardless of sharding.
+        
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
         
         @param orig: The original value of the object we are fuzzing
         @type orig: basic Python value (string, integer, etc)
         
+        @param key: The coordinates the random values are derived from,
+                    such as (trace number, snapshot index, tag index)
+        @type key: integer tuple
+        
         @return: List of fuzzed values
         @rtype: basic Python value (string, integer, etc) list
         '''
+        (values, fixed) = self._fixed(fmt, orig)
+        result = [v for (v, _) in fixed]
+        if self.random and fmt in self.randomizers :
+            rng = self._rng(key)
+            draw = self.randomizers[fmt]
+            for _ in range(0, self.randcases) :
+                v = draw(fmt, rng)
+                if v not in values :
+                    values.add(v)
+                    result.append(v)
+        return result
+    
+    def cases(self, fmt, orig, key=None):
+        '''
+        Like L{generate}, but returns the fuzzed values as an iterator
+        along with the number of values it will produce. Each value comes
+        with its bytes packed in the native L{struct} format, which can be
+        written to memory as-is.
+        
+        In streaming mode the random values are drawn only as the iterator
+        is used, and the count is an estimate; otherwise the values are 
+        all generated up front and the count is exact. Only the cases in 
+        this L{Generator}'s shard are given. Streaming drops repeated 
+        random values slightly differently, so every shard of a campaign
+        must use the same mode.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param orig: The original value of the object we are fuzzing
+        @type orig: basic Python value (string, integer, etc)
+        
+        @param key: The coordinates the random values are derived from,
+                    such as (trace number, snapshot index, tag index)
+        @type key: integer tuple
+        
+        @return: The (estimated) number of values, and an iterator over
+                 (value, packed bytes) pairs
+        @rtype: (integer, iterator) tuple
+        '''
+        if self.vectorizer != None and self.vectorizer.handles(fmt) :
+            return self.vectorizer.cases(fmt, orig, key)
+        if not self.streaming :
+            pack = self._packer(fmt).pack
+            values = self.generate(fmt, orig, key)[self.shard::self.shards]
+            values = [(v, pack(v)) for v in values]
+            return (len(values), iter(values))
+        (values, fixed) = self._fixed(fmt, orig)
+        count = len(fixed)
+        if self.random and fmt in self.randomizers :
+            count += self._expectedDistinct(self.randcases, self._domainSize(fmt), count)
+        # Our share of the positions 0 to count - 1
+        count = max(0, count - self.shard + self.shards - 1) // self.shards
+        cases = self._stream(fmt, values, fixed, self._rng(key))
+        return (count, itertools.islice(cases, self.shard, None, self.shards))
+    
+    def _rng(self, key):
+        '''
+        Gives the random stream for a set of coordinates, derived from the
+        campaign seed and the coordinates alone.
+        
+        @param key: The coordinates, or I{None} to use the campaign-wide
+                    stream L{rng}
+        @type key: integer tuple
+        
+        @return: The random stream
+        @rtype: L{random.Random} object
+        '''
+        if key == None :
+            return self.rng
+        name = ":".join([str(self.seed)] + [str(k) for k in key])
+        return random.Random(long(hashlib.sha1(name).hexdigest(), 16))
+    
+    def _fixed(self, fmt, orig):
+        '''
+        Combines the mutational values for the original value with the
+        heuristic table for its type, dropping heuristic values that 
+        mutation already produced.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param orig: The original value of the object we are fuzzing
+        @type orig: basic Python value (string, integer, etc)
+        
+        @return: The set of values, and the list of (value, packed bytes)
+                 pairs holding the same values
+        @rtype: (set, list) tuple
+        '''
         # Hand off to the appropriate generator function
-        return list(self.generators[fmt](fmt, orig))
+        values = self.generators[fmt](fmt, orig)
+        pack = self._packer(fmt).pack
+        fixed = [(v, pack(v)) for v in values]
+        if self.heuristic :
+            for (v, packed) in self._heuristicTable(fmt) :
+                if v not in values :
+                    values.add(v)
+                    fixed.append((v, packed))
+        return (values, fixed)
+    
+    def _stream(self, fmt, values, fixed, rng):
+        '''
+        Yields the given mutational and heuristic values, then draws the
+        configured number of random values, skipping any already produced.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param values: The mutational and heuristic values
+        @type values: basic Python value set
+        
+        @param fixed: The same values, as (value, packed bytes) pairs
+        @type fixed: list
+        
+        @param rng: The random stream to draw from
+        @type rng: L{random.Random} object
+        
+        @return: Iterator over (value, packed bytes) pairs
+        @rtype: iterator
+        '''
+        for case in fixed :
+            yield case
+        if not self.random or fmt not in self.randomizers :
+            return
+        draw = self.randomizers[fmt]
+        pack = self._packer(fmt).pack
+        seen = bloom_filter.BloomFilter(self.randcases)
+        for _ in xrange(self.randcases) :
+            v = draw(fmt, rng)
+            if v not in values and seen.add(v) :
+                yield (v, pack(v))
+    
+    def _heuristicTable(self, fmt):
+        '''
+        Gives the heuristic values for a type along with their packed 
+        bytes, building the table the first time the type is seen.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: The heuristic values as (value, packed bytes) pairs
+        @rtype: list
+        '''
+        table = Generator.tables.get(fmt)
+        if table == None :
+            self.log.debug("Building heuristic table for format %s", fmt)
+            pack = self._packer(fmt).pack
+            table = [(v, pack(v)) for v in self.heuristics[fmt](fmt)]
+            Generator.tables[fmt] = table
+        return table
+    
+    def _packer(self, fmt):
+        '''
+        Gives the compiled L{struct.Struct} for a format, creating it the
+        first time the format is seen.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: The compiled format
+        @rtype: L{struct.Struct} object
+        '''
+        packer = Generator.packers.get(fmt)
+        if packer == None :
+            packer = struct.Struct(fmt)
+            Generator.packers[fmt] = packer
+        return packer
+            
+    def _domainSize(self, fmt):
+        '''
+        Gives the number of different values random draws for a type can
+        produce, or I{None} if it's too large to matter (floats).
+        
+        @param fmt: The format string of the type
+        @type fmt: string
+        
+        @return: The number of possible random values
+        @rtype: integer
+        '''
+        if fmt == "c" :
+            return 128
+        if fmt in "fd" :
+            return None
+        return 2**(struct.calcsize(fmt)*8)
+    
+    def _expectedDistinct(self, draws, domain, taken=0):
+        '''
+        Estimates how many different values are produced by drawing
+        uniformly at random from a domain of the given size, not counting
+        values that were already produced.
+        
+        @param draws: The number of random draws
+        @type draws: integer
+        
+        @param domain: The number of possible values, or I{None} if
+                       repeats are negligible
+        @type domain: integer
+        
+        @param taken: The number of values in the domain already produced
+        @type taken: integer
+        
+        @return: The expected number of distinct values
+        @rtype: integer
+        '''
+        if domain == None :
+            return draws
+        # (domain - taken) * (1 - (1 - 1/domain)^draws), computed without
+        # cancelling
+        free = max(0, domain - taken)
+        return int(round(-free * math.expm1(draws * math.log1p(-1.0 / domain))))
     
     def _getChars(self, fmt, orig):
         '''
-        Generates a fuzzed value list for character types
+        Generates a mutational fuzzed value list for character types
         
         Mutational values are created by checking if the character is
         a digit or a letter, and using values of the opposite types, 
         as well as lowercase versions of letters if they are given.
         
-        Heuristic values used are drawn from a list of path seperators, 
-        delimiters, and other characters that often have special meaning,
-        as well as unprintable characters and characters outside of the
-        legal ASCII values.
+        Heuristic values are listed by L{_heuristicChars}, and random 
+        values are drawn by L{_randChar}.
         
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
@@ -135,9 +460,6 @@ class Generator(object):
         @return: Set of characters
         @rtype: single-character string set
         '''
-        # Get the minimum and maximum possible integer value
-        min_val = 0
-        max_val = 127
         values = set()
         if self.mutational :
             if orig.isdigit() :
@@ -147,49 +469,58 @@ class Generator(object):
                 values.add("0")
                 values.add("9")
                 values.add(orig.swapcase())
-        if self.heuristic :
-            values.add("\0") 
-            values.add("\r")
-            values.add("\n")
-            values.add("\b")
-            values.add("\t")
-            values.add(" ")
-            values.add("@")
-            values.add("%")
-            values.add(":")
-            values.add("\\")
-            values.add("/")
-            values.add("|")
-            values.add("=")
-            values.add(",")
-            values.add(";")
-            values.add(")")
-            values.add("(")
-            values.add("\"")
-            values.add(".")
-            values.add(chr(255))
-        if self.random :
-            random.seed()
-            for _ in range(0, self.randcases) :
-                values.add(chr(random.randint(min_val, max_val)))
+        return values
+    
+    def _heuristicChars(self, fmt):
+        '''
+        Lists the heuristic values for character types
+        
+        Heuristic values used are drawn from a list of path seperators, 
+        delimiters, and other characters that often have special meaning,
+        as well as unprintable characters and characters outside of the
+        legal ASCII values.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: Set of characters
+        @rtype: single-character string set
+        '''
+        values = set()
+        values.add("\0")
+        values.add("\r")
+        values.add("\n")
+        values.add("\b")
+        values.add("\t")
+        values.add(" ")
+        values.add("@")
+        values.add("%")
+        values.add(":")
+        values.add("\\")
+        values.add("/")
+        values.add("|")
+        values.add("=")
+        values.add(",")
+        values.add(";")
+        values.add(")")
+        values.add("(")
+        values.add("\"")
+        values.add(".")
+        values.add(chr(255))
         return values
     
     def _getInts(self, fmt, orig):
         '''
-        Generates a fuzzed value list for signed integer types.
+        Generates a mutational fuzzed value list for signed integer types.
         
         Mutational values are created by adding and subtracting up
         to (self.mutaterange) from the original value, and multiplying/
         dividing it by the integers 2 and 4 (and their negative 
         counterparts).
         
-        Heuristic values are generated by adding and subtracting up
-        to 5 from the maximum and minimum legal signed integer values 
-        for this type and zero, as well as the max and min values
-        divided and multiplied respectively by 2 and 4.
-        
         Illegal values (those that can't be expressed by this type) are 
-        discarded.
+        discarded. Heuristic values are listed by L{_heuristicInts}, and
+        random values are drawn by L{_randInt}.
         
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
@@ -219,41 +550,53 @@ class Generator(object):
             for item in mut:
                 if item <= max_int and item >= min_int:
                     values.add(item)
-        if self.heuristic :
-            for x in range(5) :
-                values.add(min_int + x)
-                values.add(max_int - x)
-                values.add(min_int/2 + x)
-                values.add(min_int/2 - x)
-                values.add(max_int/2 + x)
-                values.add(max_int/2 - x)
-                values.add(min_int/4 + x)
-                values.add(min_int/4 - x)
-                values.add(max_int/4 + x)
-                values.add(max_int/4 - x)
-                values.add(0 + x)
-                values.add(0 - x)
-        if self.random :
-            random.seed()
-            for _ in range(0, self.randcases) :
-                values.add(random.randint(min_int, max_int))
+        return values
+    
+    def _heuristicInts(self, fmt):
+        '''
+        Lists the heuristic values for signed integer types.
+        
+        Heuristic values are generated by adding and subtracting up
+        to 5 from the maximum and minimum legal signed integer values 
+        for this type and zero, as well as the max and min values
+        divided and multiplied respectively by 2 and 4.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: Set of integers
+        @rtype: integer set
+        '''
+        # Get the minimum and maximum possible integer value
+        min_int = -(2**(struct.calcsize(fmt)*8 - 1))
+        max_int = (2**(struct.calcsize(fmt)*8 - 1)) -1
+        values = set()
+        for x in range(5) :
+            values.add(min_int + x)
+            values.add(max_int - x)
+            values.add(min_int/2 + x)
+            values.add(min_int/2 - x)
+            values.add(max_int/2 + x)
+            values.add(max_int/2 - x)
+            values.add(min_int/4 + x)
+            values.add(min_int/4 - x)
+            values.add(max_int/4 + x)
+            values.add(max_int/4 - x)
+            values.add(0 + x)
+            values.add(0 - x)
         return values
     
     def _getUints(self, fmt, orig):
         '''
-        Generates a fuzzed value list for unsigned integer types.
+        Generates a mutational fuzzed value list for unsigned integer types.
         
         Mutational values are created by adding and subtracting up
         to (self.mutaterange) from the original value, and multiplying/
         dividing it by the integers 2 and 4.
         
-        Heuristic values are generated by adding and subtracting up
-        to 5 from the maximum and minimum legal unsigned integer values 
-        for this type, as well as the max and min values divided and
-        multiplied respectively by 2 and 4.
-        
         Illegal values (those that can't be expressed by this type) are 
-        discarded.
+        discarded. Heuristic values are listed by L{_heuristicUints}, and
+        random values are drawn by L{_randUint}.
         
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
@@ -281,33 +624,47 @@ class Generator(object):
             for item in mut:
                 if item <= max_int and item >= min_int:
                     values.add(item)
-        if self.heuristic :
-            for x in range(5) :
-                values.add(min_int + x)
-                values.add(max_int - x)
-                values.add(max_int/2 + x)
-                values.add(max_int/2 - x)
-                values.add(max_int/4 + x)
-                values.add(max_int/4 - x)
-        if self.random :
-            random.seed()
-            for _ in range(0, self.randcases) :
-                values.add(random.randint(min_int, max_int))
+        return values
+    
+    def _heuristicUints(self, fmt):
+        '''
+        Lists the heuristic values for unsigned integer types.
+        
+        Heuristic values are generated by adding and subtracting up
+        to 5 from the maximum and minimum legal unsigned integer values 
+        for this type, as well as the max and min values divided and
+        multiplied respectively by 2 and 4.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: Set of positive integers
+        @rtype: integer set
+        '''
+        # Get the minimum and maximum possible integer value
+        min_int = 0
+        max_int = (2**(struct.calcsize(fmt)*8)) -1
+        values = set()
+        for x in range(5) :
+            values.add(min_int + x)
+            values.add(max_int - x)
+            values.add(max_int/2 + x)
+            values.add(max_int/2 - x)
+            values.add(max_int/4 + x)
+            values.add(max_int/4 - x)
         return values
     
     def _getFloats(self, fmt, orig):
         '''
-        Generates fuzzed value list for floating point types.
+        Generates a mutational fuzzed value list for floating point types.
         
         Mutational values are created by adding and subtracting up
         to (self.mutaterange) from the original value, and multiplying/
         dividing it by the integers 2,3, and 4. Both positive and negative
         versions of these values are added.
         
-        Heuristic values are based off the minimum and maximum magnitudes
-        expressable as a float, multiplied and divided by 2 through 4, as 
-        both positive and negative values. Additional special values that
-        are unique to floats are also included (NaN, +0, -0, +Inf, -Inf)
+        Heuristic values are listed by L{_heuristicFloats}, and random 
+        values are drawn by L{_randFloat}.
         
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
@@ -342,49 +699,130 @@ class Generator(object):
             for item in mut:
                 if item <= max_float and item >= min_float:
                     values.add(item)
-        if self.heuristic :
-            values.add(float('nan'))
-            values.add(float('inf'))
-            values.add(float('-inf'))
-            values.add(-0.0)
-            values.add(0.0)
-            values.add(max_float)
-            values.add(min_float)
-            values.add(max_float/2)
-            values.add(max_float/3)
-            values.add(max_float/4)
-            values.add(min_float*2)
-            values.add(min_float*3)
-            values.add(min_float*4)
-            values.add(-min_float)
-            values.add(-max_float)
-            values.add(-min_float*2)
-            values.add(-min_float*3)
-            values.add(-min_float*4)
-            values.add(-max_float/2)
-            values.add(-max_float/3)
-            values.add(-max_float/4)     
-        if self.random :
-            random.seed()
-            for _ in range(0, self.randcases) :
-                sign = random.choice([-1,1])
-                values.add(random.random() * 3.4e38 * sign)
         return values
     
+    def _heuristicFloats(self, fmt):
+        '''
+        Lists the heuristic values for floating point types.
+        
+        Heuristic values are based off the minimum and maximum magnitudes
+        expressable as a float, multiplied and divided by 2 through 4, as 
+        both positive and negative values. Additional special values that
+        are unique to floats are also included (NaN, +0, -0, +Inf, -Inf).
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: Set of floating point values
+        @rtype: float set
+        '''
+        # Get the rough minimum and maximum positive float values
+        if struct.calcsize(fmt) == 8:
+            # IEEE double values
+            min_float = 10e-323
+            max_float = 10e308
+        else :
+            # IEEE single values
+            min_float = 10e-44
+            max_float = 10e38
+        values = set()
+        values.add(float('nan'))
+        values.add(float('inf'))
+        values.add(float('-inf'))
+        values.add(-0.0)
+        values.add(0.0)
+        values.add(max_float)
+        values.add(min_float)
+        values.add(max_float/2)
+        values.add(max_float/3)
+        values.add(max_float/4)
+        values.add(min_float*2)
+        values.add(min_float*3)
+        values.add(min_float*4)
+        values.add(-min_float)
+        values.add(-max_float)
+        values.add(-min_float*2)
+        values.add(-min_float*3)
+        values.add(-min_float*4)
+        values.add(-max_float/2)
+        values.add(-max_float/3)
+        values.add(-max_float/4)
+        return values
+    
+    def _randChar(self, fmt, rng):
+        '''
+        Draws a random legal ASCII character
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param rng: The random stream to draw from
+        @type rng: L{random.Random} object
+        
+        @return: A random character
+        @rtype: single-character string
+        '''
+        return chr(rng.randint(0, 127))
+    
+    def _randInt(self, fmt, rng):
+        '''
+        Draws a random signed integer that fits the given type
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param rng: The random stream to draw from
+        @type rng: L{random.Random} object
+        
+        @return: A random integer
+        @rtype: integer
+        '''
+        bits = struct.calcsize(fmt)*8
+        return rng.randint(-(2**(bits - 1)), (2**(bits - 1)) - 1)
+    
+    def _randUint(self, fmt, rng):
+        '''
+        Draws a random unsigned integer that fits the given type
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param rng: The random stream to draw from
+        @type rng: L{random.Random} object
+        
+        @return: A random positive integer
+        @rtype: integer
+        '''
+        return rng.randint(0, (2**(struct.calcsize(fmt)*8)) - 1)
+    
+    def _randFloat(self, fmt, rng):
+        '''
+        Draws a random float of either sign, with magnitude up to the 
+        largest single precision value
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @param rng: The random stream to draw from
+        @type rng: L{random.Random} object
+        
+        @return: A random float
+        @rtype: float
+        '''
+        sign = rng.choice([-1,1])
+        return rng.random() * 3.4e38 * sign
+    
     def _getPointers(self, fmt, orig):
         '''
-        Generates a list of pointers. Mutational fuzzing is
-        not performed on pointers since there is a high chance
-        that altering a pointer's value will cause it to point
+        Generates a mutational list of pointers, which is always empty.
+        Mutational fuzzing is not performed on pointers since there is a
+        high chance that altering a pointer's value will cause it to point
         outside of valid ctypes data and into Python's structures,
         and writing to such an area will likely cause Python to 
         crash even if a C program would not have.
         
-        Random values are not used for the same reason.
-        
-        Heuristic values are just NULL values and a value chosen
-        to fall into kernel memory, which will pass checks for
-        NULL but cause a segfault upon any read or write.
+        Random values are not used for the same reason. Heuristic values
+        are listed by L{_heuristicPointers}.
         
         @param fmt: The format string of the type we are fuzzing
         @type fmt: string
@@ -395,19 +833,30 @@ class Generator(object):
         @return: Set of pointer values
         @rtype: integer set
         '''
-        values = set()
         # Can't do mutational because pointer will not be to
         # valid memory, it'll point outside valid ctype and crash
         # python - not really a case we want.
         
-        # Heuristic values
-        if self.heuristic :
-            values.add(0)
-            values.add(-1)
-            values.add(0x80000000)
-            
         # Can't do random for the same reason as mutational
         
+        return set()
+    
+    def _heuristicPointers(self, fmt):
+        '''
+        Lists the heuristic values for pointers, which are just NULL
+        values and a value chosen to fall into kernel memory, which will
+        pass checks for NULL but cause a segfault upon any read or write.
+        
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+        
+        @return: Set of pointer values
+        @rtype: integer set
+        '''
+        values = set()
+        values.add(0)
+        values.add(-1)
+        values.add(0x80000000)
         return values
     
     
\ No newline at end of file
@@ -9,11 +9,13 @@ L{Trace} object in a controlled environment.
 '''
 
 import multiprocessing
+import xml.dom.minidom as xml
 import ctypes
 import sys
 import os
 import logging
 from morpher.misc import log_setup
+from morpher.trace import typemanager
 
 class Harness(multiprocessing.Process):
     '''
@@ -35,6 +37,10 @@ class Harness(multiprocessing.Process):
     
     @note: L{_kill_output} is used to suppress any output to standard output
            or standard error streams by the DLL during replay.
+           
+    @note: The user-defined types in model.xml are built as soon as the
+           process starts (see L{TypeManager.warm}), so L{Trace}s received
+           later find their classes already made.
     
     @ivar cfg: The configuration object
     @ivar outpipe: The connection used to send "pings" back to the parent
@@ -84,15 +90,8 @@ class Harness(multiprocessing.Process):
         self.log = logging.getLogger(__name__)
         self.log.info("Harness is running...")
 
-        dlltype = self.cfg.get('fuzzer', 'dll_type')
-        path = self.cfg.get('fuzzer', 'target')
-        
-        # Load the target DLL
-        if dlltype == "cdecl" :
-            dll = ctypes.cdll
-        else :
-            dll = ctypes.windll
-        target = dll.LoadLibrary(path)
+        target = self._loadTarget()
+        self._warmTypes()
         
         self.log.info("DLL loaded, waiting for trace")
         
@@ -130,10 +129,49 @@ class Harness(multiprocessing.Process):
         self.log.info("Harness run complete, shutting down")
         self.outpipe.close()
 
+    def _loadTarget(self):
+        '''
+        Loads the target DLL (or shared object) named in the L{Config}
+        using the calling convention given by fuzzer->dll_type.
+        
+        @return: The loaded library
+        @rtype: L{ctypes} library object
+        '''
+        dlltype = self.cfg.get('fuzzer', 'dll_type')
+        path = self.cfg.get('fuzzer', 'target')
+        
+        # Load the target DLL
+        if dlltype == "cdecl" :
+            dll = ctypes.cdll
+        else :
+            dll = ctypes.windll
+        return dll.LoadLibrary(path)
+
+    def _warmTypes(self):
+        '''
+        Builds the classes for the user-defined types in the data 
+        directory's model.xml, if there is one, so every L{Trace} of that
+        model replayed by this process shares them.
+        '''
+        modelpath = os.path.join(self.cfg.get('directories', 'data'), 'model.xml')
+        if not os.path.isfile(modelpath) :
+            self.log.info("No model file at %s, types are built as needed", modelpath)
+            return
+        try :
+            f = open(modelpath)
+            model = xml.parse(f).getElementsByTagName("dll")[0]
+            f.close()
+        except :
+            self.log.exception("Could not read model file %s", modelpath)
+            return
+        usertypes = typemanager.readUsertypes(model)
+        typemanager.TypeManager(usertypes).warm()
+        self.log.info("Built classes for %d user types", len(usertypes))
+
     def _kill_output(self):
         '''
         Disables stdout and stderr for the DLL by redirecting those 
-        descriptors to a NUL (fake) file, but restores the Python 
+        descriptors to the null device, but restores the Python 
         interpreter's connection to stdout and stderr intact
         '''
         sys.stdout.flush() 
@@ -142,7 +180,7 @@ class Harness(multiprocessing.Process):
         saved_out = os.dup(1)
         saved_err = os.dup(2)
         # Set stdout/err to fake device
-        devnull = os.open('NUL', os.O_WRONLY)
+        devnull = os.open(os.devnull, os.O_WRONLY)
         os.dup2(devnull, 1)
         os.dup2(devnull, 2)
         os.close(devnull)
@@ -151,4 +189,4 @@ class Harness(multiprocessing.Process):
         sys.stderr = os.fdopen(saved_err, 'w')
         
        
-        
\ No newline at end of file
+        
\ No newline at end of file
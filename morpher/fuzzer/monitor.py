@@ -10,13 +10,19 @@ Contains the L{Monitor} class for launching and monitoring L{Harness} tasks
 import multiprocessing
 import threading
 import harness
-from morpher.pydbg import pydbg
-from morpher.pydbg import defines
-from morpher.utils import crash_binning
+import fork_server
 import os
+import sys
 import pickle
 import shutil
+import signal
 import logging
+from morpher.trace import trace_file
+# The debugger is only needed (and only loads) on Windows
+if sys.platform == "win32" :
+    from morpher.pydbg import pydbg
+    from morpher.pydbg import defines
+    from morpher.utils import crash_binning
 
 class Monitor(object):
     '''
@@ -31,6 +37,19 @@ class Monitor(object):
     detected - segmentation faults (access protection violation) and
     hangs over a certain time limit.
     
+    In persistent mode (fuzzer->persistent) a single L{ForkServer} is kept
+    running instead, and each L{Trace} is replayed in a child forked from
+    it. Crashes are detected from the signal that killed the child rather
+    than through a debugger, and are binned by signal instead of by
+    address. The server is only respawned if it stops responding.
+    
+    Fuzzed runs are described by an L{Overlay} over the unfuzzed L{Trace}
+    of their batch. When that L{Trace} is registered with L{setBase}, the
+    server is sent it once, and each later run only sends the overlay's
+    patches - a few dozen bytes instead of the whole L{Trace} with all its
+    memory blocks. The fuzzed L{Trace} itself is only built (see
+    L{Overlay.materialize}) when it has to be logged or dumped.
+    
     @ivar cfg: The L{Config} configuration object for this L{Monitor}
     @ivar log: The L{logging} object for this L{Monitor}
     @ivar limit: Number of seconds to wait for L{Harness} completion 
@@ -42,18 +61,40 @@ class Monitor(object):
     @ivar last_trace: The last L{Trace} object sent to a L{Harness}
     @ivar save_traces: Whether or not to save crashing and hanging
                       traces in replayable pickle format
+    @ivar persistent: Whether L{Trace}s are replayed by a L{ForkServer}
+    @ivar server: The running L{ForkServer}, if any
+    @ivar conn: The L{Monitor}'s end of the connection to the server
+    @ivar base: The pickled unfuzzed L{Trace} of the current batch, if any
+    @ivar sent_base: Whether the running server already has L{base}
+    @ivar stats: Map of run outcome ("pass", "crash", "hang", "error") to
+                 the number of runs that ended that way
+    @ivar result: The outcome of the run in progress
+    @ivar saving: Seconds of replay the last run skipped by starting
+                  from a L{ForkServer} checkpoint
+    @ivar saved: Map of trace number to the total seconds of replay
+                 skipped thanks to checkpoints
+    @ivar suffix_limit: Number of L{Snapshot}s replayed after the first
+                        fuzzed one, or -1 to replay every L{Snapshot}
+    @ivar skipping: Number of calls the last run left out because of
+                    the suffix limit
+    @ivar skipped: Total number of calls left out because of the suffix limit
     '''
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, clean=True):
         '''
         Takes a config object and sets up Monitor. If data/crashers doesn't
         exist, the directory is created, otherwise all directories inside that 
         start with "address-" are erased. If data/hangers doesn't exist, 
         the directory is created, otherwise all file entries that start with 
-        "trace-" and end with ".txt" or ".pkl" are erased.
+        "trace-" and end with ".txt", ".trc" or ".pkl" are erased.
         
         @param cfg: The configuration object
         @type cfg: L{Config} object
+        
+        @param clean: Whether to clear out old dumps, default is I{True}.
+                      Parallel workers share the directories, so only 
+                      the first L{Monitor} should clean them.
+        @type clean: boolean
         '''
         # The config object we use for information
         self.cfg = cfg
@@ -69,26 +110,48 @@ class Monitor(object):
         self.hangpath = os.path.join(datadir, "hangers")
         self.crashpath = os.path.join(datadir, "crashers")
         # Clear out the hangers directories
-        if os.path.isdir(self.hangpath) :
+        if not os.path.isdir(self.hangpath) :
+            os.mkdir(self.hangpath)
+        elif clean :
             for filename in os.listdir(self.hangpath) :
                 path = os.path.join(self.hangpath, filename)
                 if os.path.isfile(path) and filename.startswith('trace-') and \
-                    (filename.endswith('.txt') or filename.endswith('.pkl')):
+                    os.path.splitext(filename)[1] in ('.txt', '.trc', '.pkl'):
                     os.remove(path)
-        else :
-            os.mkdir(self.hangpath)
         # Clear out the crasher directory 
-        if os.path.isdir(self.crashpath) :
+        if not os.path.isdir(self.crashpath) :
+            os.mkdir(self.crashpath)
+        elif clean :
             for dirname in os.listdir(self.crashpath) :
                 path = os.path.join(self.crashpath, dirname)
-                if os.path.isdir(path) and dirname.startswith('address-'):
+                if os.path.isdir(path) and (dirname.startswith('address-') or \
+                                            dirname.startswith('signal-')):
                     shutil.rmtree(path)
-        else :
-            os.mkdir(self.crashpath)
         # Check if crashs/hangs should be stored in replayable format
         self.save_traces = self.cfg.getboolean('fuzzer', 'save_traces')
         # Stores the trace we just sent so we can dump it if needed
         self.last_trace = None
+        # Check if traces should be replayed by a persistent fork server
+        self.persistent = self.cfg.getboolean('fuzzer', 'persistent')
+        if self.persistent and not hasattr(os, "fork") :
+            self.log.warning("Persistent mode needs os.fork, using one harness per run")
+            self.persistent = False
+        # The fork server and our end of its connection
+        self.server = None
+        self.conn = None
+        # The unfuzzed trace runs are patched from, and if the server has it
+        self.base = None
+        self.sent_base = False
+        # Outcome counts across all runs, and the outcome of the current run
+        self.stats = {"pass": 0, "crash": 0, "hang": 0, "error": 0}
+        self.result = None
+        # Replay time skipped by checkpoints, for the last run and per trace
+        self.saving = 0.0
+        self.saved = {}
+        # How far past the fuzzed snapshot to replay, and the calls left out
+        self.suffix_limit = self.cfg.getint('fuzzer', 'suffix_limit')
+        self.skipping = 0
+        self.skipped = 0
         
     def setTraceNum(self, tracenum):
         '''
@@ -101,7 +164,32 @@ class Monitor(object):
         self.tracenum = tracenum
         self.iter = 0
         
-    def run(self, trace):
+    def setRunNum(self, runnum):
+        '''
+        Change the iteration number used for naming the next dump file. 
+        Used when runs of a batch are numbered by someone else, such as a
+        L{Dispatcher} handing runs out to several L{Monitor}s.
+        
+        @param runnum: The number identifying the next run in this batch
+        @type runnum: integer
+        '''
+        self.iter = runnum
+        
+    def setBase(self, trace):
+        '''
+        Registers the unfuzzed L{Trace} of the current batch, so later runs
+        can be described by L{Overlay}s over it. Only persistent mode makes
+        use of it; the L{Trace} is serialized right away so it can be sent
+        to each new server.
+        
+        @param trace: The original, unfuzzed L{Trace}
+        @type trace: L{Trace} object
+        '''
+        if self.persistent :
+            self.base = pickle.dumps(trace, pickle.HIGHEST_PROTOCOL)
+            self.sent_base = False
+        
+    def run(self, trace, overlay=None):
         '''
         Takes the L{Trace} and runs it in a L{Harness}, monitoring for crashes.
         
@@ -121,11 +209,38 @@ class Monitor(object):
         values in it to create multiple fuzzed versions - so a batch is all
         traces that were generated by fuzzing the same base trace.
         
-        @param trace: The trace to run and monitor
+        If a suffix limit is set (fuzzer->suffix_limit), only the L{Snapshot}s
+        up to that many past the first patched one are replayed, since a
+        problem caused by the fuzzed value almost always shows up within a
+        few calls. The L{Trace} is cut short before it is sent, so the
+        crash and hang handlers, and the dumped L{Trace}, only ever see the
+        L{Snapshot}s that were actually replayed.
+        
+        @param trace: The trace to run and monitor, or the base of the
+                      overlay if one is given
         @type trace: L{Trace} object
+        
+        @param overlay: The fuzzed variant of the L{Trace} to run instead,
+                        over the L{Trace} given to L{setBase}
+        @type overlay: L{Overlay} object
+        
+        @return: The outcome of the run - "pass", "crash", "hang" or "error"
+        @rtype: string
         '''
+        stop = self._replayLength(trace, overlay)
+        self.skipping = len(trace.snapshots) - stop
+        self.skipped += self.skipping
+        if self.persistent :
+            return self.runPersistent(trace, overlay, stop)
+        
+        if overlay != None :
+            trace = overlay.materialize()
+        trace = trace.truncated(stop)
+        
         self.log.info("Monitor is running. Creating pipe and harness")
         self.last_trace = trace
+        self.result = "pass"
+        self.saving = 0.0
         
         # Spawn a new test harness and connect to it
         (inpipe, outpipe) = multiprocessing.Pipe()
@@ -177,8 +292,137 @@ class Monitor(object):
         outpipe.close()
         self.inpipe.close()
         
+        self.stats[self.result] += 1
         self.iter += 1
         self.log.info("Monitor exiting")
+        return self.result
+        
+    def runPersistent(self, trace, overlay=None, stop=None):
+        '''
+        Replays the L{Trace} using the persistent L{ForkServer}, starting
+        the server first if it isn't already running.
+        
+        The trace is sent to the server, which forks a child to replay it
+        and answers with the outcome once the child exits. If an overlay
+        is given and a base L{Trace} was registered, only the overlay's 
+        patches are sent and the child applies them to its copy of the
+        base. If the child was
+        killed by a signal the run is logged as a crash, binned by signal
+        under the "crashers" directory; if it was killed for running over
+        the time limit it is logged as a hang. If the server itself doesn't
+        answer in time it is terminated and a fresh one is started for 
+        the next run.
+        
+        @param trace: The trace to run and monitor, or the base of the
+                      overlay if one is given
+        @type trace: L{Trace} object
+        
+        @param overlay: The fuzzed variant of the L{Trace} to run instead
+        @type overlay: L{Overlay} object
+        
+        @param stop: The number of L{Snapshot}s to replay, or I{None} for all
+        @type stop: integer
+        
+        @return: The outcome of the run - "pass", "crash", "hang" or "error"
+        @rtype: string
+        '''
+        if stop == None :
+            stop = len(trace.snapshots)
+        # The fuzzed trace is only built if something needs to see it
+        self.last_trace = None
+        if overlay == None :
+            self.last_trace = trace.truncated(stop)
+        if self.server == None or not self.server.is_alive() :
+            self.startServer()
+        
+        if self.log.isEnabledFor(logging.DEBUG) :
+            tracestr = self._lastTrace(overlay, stop).toString()
+            self.log.debug("Trace %d run %d contents:\n\n%s\n", \
+                           self.tracenum, self.iter, tracestr)
+        
+        self.log.info("Sending trace %d run %d to fork server", self.tracenum, self.iter)
+        try :
+            if overlay == None :
+                self.conn.send(("trace", self.last_trace))
+            elif self.base == None :
+                self.conn.send(("trace", self._lastTrace(overlay, stop)))
+            else :
+                if not self.sent_base :
+                    self.log.debug("Sending base trace to fork server")
+                    self.conn.send(("base", self.base))
+                    self.sent_base = True
+                self.conn.send(("case", (overlay.getPatches(), stop)))
+        except :
+            msg = "Error sending trace over pipe to fork server"
+            self.log.exception(msg)
+            raise Exception(msg)
+        
+        # The server enforces the time limit itself, give it some slack
+        if self.conn.poll(self.limit + 5) :
+            (status, detail, started, self.saving) = self.conn.recv()
+        else :
+            self.log.error("Fork server stopped responding, respawning it")
+            self.stopServer()
+            (status, detail, started, self.saving) = ("hang", 0, 0, 0.0)
+        self.saved[self.tracenum] = self.saved.get(self.tracenum, 0.0) + self.saving
+            
+        if status in ("crash", "hang") :
+            snaps = self._lastTrace(overlay, stop).snapshots[:started]
+        if status == "crash" :
+            name = self._signalName(detail)
+            self.log.info("!!! Harness child killed by %s !!!", name)
+            dirpath = os.path.join(self.crashpath, "signal-" + name)
+            synopsis = "Harness terminated by signal %s (%d)\n\n" % (name, detail)
+            self._dump(dirpath, synopsis, snaps)
+        elif status == "hang" :
+            self.log.info("!!! Harness timed out !!!")
+            self._dump(self.hangpath, "", snaps)
+        elif status == "error" :
+            self.log.warning("Harness child exited with code %d", detail)
+        
+        self.stats[status] += 1
+        self.iter += 1
+        return status
+        
+    def startServer(self):
+        '''
+        Starts a new L{ForkServer} process, stopping any previous one.
+        '''
+        self.stopServer()
+        self.log.info("Starting fork server")
+        (self.conn, theirs) = multiprocessing.Pipe()
+        self.server = fork_server.ForkServer(self.cfg, theirs)
+        self.server.start()
+        theirs.close()
+        self.sent_base = False
+        
+    def close(self):
+        '''
+        Releases anything kept running between runs. Called once fuzzing
+        is complete.
+        '''
+        self.stopServer()
+        
+    def stopServer(self):
+        '''
+        Shuts down the running L{ForkServer}, if there is one. Safe to
+        call at any time.
+        '''
+        if self.server == None :
+            return
+        self.log.info("Stopping fork server")
+        try :
+            self.conn.send(None)
+        except :
+            pass
+        self.server.join(1)
+        if self.server.is_alive() :
+            self.server.terminate()
+            self.server.join()
+        self.conn.close()
+        self.server = None
+        self.conn = None
+        self.sent_base = False
         
     def timeout(self):
         '''
@@ -200,10 +444,9 @@ class Monitor(object):
         "hangers" directory.
         
         Two files are created: a text (.txt) file with the human-readable
-        contents of the L{Snapshot}s that lead to the hang, and a pickle 
-        (.pkl) file with the same name that contains a pickled version of 
-        the hanging L{Trace}, which can be replayed in order to reproduce 
-        the hang.
+        contents of the L{Snapshot}s that lead to the hang, and a trace
+        (.trc) file with the same name that contains the hanging L{Trace},
+        which can be replayed in order to reproduce the hang.
         
         @param dbg: The debug object this was called from
         @type dbg: L{pydbg} object
@@ -217,20 +460,9 @@ class Monitor(object):
                 else :
                     break
 
-            # Dump  trace string to file
-            filename = "trace-%d-run-%d.txt" % (self.tracenum, self.iter)
-            dumpfile = os.path.join(self.hangpath, filename)
-            f = open(dumpfile, "w")
-            for s in snaps :
-                f.write(s.toString() + "\n")
-            f.close()
-            # Dump the trace
-            if self.save_traces :
-                filename = "trace-%d-run-%d.pkl" % (self.tracenum, self.iter)
-                dumpfile = os.path.join(self.hangpath, filename)
-                f = open(dumpfile, "wb")
-                pickle.dump(self.last_trace, f)
-                f.close()
+            # Dump the trace string and trace to file
+            self._dump(self.hangpath, "", snaps)
+            self.result = "hang"
             
             # Terminate the process
             self.log.info("!!! Harness timed out !!!")
@@ -252,9 +484,9 @@ class Monitor(object):
         
         Two files are created: a text (.txt) file with the human-readable
         crash information and contents of the L{Snapshot}s that lead to
-        the crash, and a pickle (.pkl) file with the same name that contains
-        a pickled version of the crashing L{Trace}, which can be replayed
-        in order to reproduce the crash.
+        the crash, and a trace (.trc) file with the same name that contains
+        the crashing L{Trace}, which can be replayed in order to reproduce
+        the crash.
         
         @param dbg: The debug object this was called from
         @type dbg: L{pydbg} object
@@ -269,11 +501,9 @@ class Monitor(object):
         crashstr = crashbin.crash_synopsis()
         self.log.debug("\n" + crashstr)
         
-        # Create the directory for this bin if not existing
+        # The directory for this bin
         addr = crashbin.last_crash.exception_address
         dirpath = os.path.join(self.crashpath, "address-" + hex(addr))
-        if not os.path.isdir(dirpath):
-            os.mkdir(dirpath)
             
         # Reduce trace to only calls that were made before the crash
         snaps = []
@@ -283,24 +513,103 @@ class Monitor(object):
             else :
                 break
         
-        # Dump crash synopsis and trace string to file
-        dumpfile = os.path.join(dirpath, "trace-%d-run-%d.txt" % (self.tracenum, self.iter))
-        f = open(dumpfile, "w")
-        f.write(crashstr)
+        # Dump crash synopsis, trace string and trace to file
+        self._dump(dirpath, crashstr, snaps)
+        self.result = "crash"
+                
+        # Done reporting, terminate the harness
+        self.log.info("Terminating the test harness")
+        dbg.terminate_process()
+        return defines.DBG_EXCEPTION_NOT_HANDLED
+    
+    def _dump(self, dirpath, synopsis, snaps):
+        '''
+        Writes the dump files for a crashing or hanging L{Trace}, creating
+        the directory if needed.
+        
+        A text (.txt) file is written with the synopsis followed by the 
+        human-readable contents of the given L{Snapshot}s, and if traces
+        are being saved, a trace (.trc) file with the same name holding
+        the last L{Trace} sent, which can be replayed to reproduce the
+        problem.
+        
+        @param dirpath: The directory to write the files to
+        @type dirpath: string
+        
+        @param synopsis: Text written before the L{Snapshot} contents
+        @type synopsis: string
+        
+        @param snaps: The L{Snapshot}s that were called before the problem
+        @type snaps: L{Snapshot} list
+        '''
+        if not os.path.isdir(dirpath):
+            try :
+                os.mkdir(dirpath)
+            except OSError :
+                # Another worker may have just created the same bin
+                if not os.path.isdir(dirpath) :
+                    raise
+        name = "trace-%d-run-%d" % (self.tracenum, self.iter)
         
-        # Write out the trace information
+        f = open(os.path.join(dirpath, name + ".txt"), "w")
+        f.write(synopsis)
         for s in snaps :
             f.write(s.toString() + "\n")
         f.close()
         
-        # Dump the trace in pickle format
         if self.save_traces :
-            dumpfile = os.path.join(dirpath, "trace-%d-run-%d.pkl" % (self.tracenum, self.iter))
-            f = open(dumpfile, "wb")
-            pickle.dump(self.last_trace, f)
-            f.close()
-                
-        # Done reporting, terminate the harness
-        self.log.info("Terminating the test harness")
-        dbg.terminate_process()
-        return defines.DBG_EXCEPTION_NOT_HANDLED
\ No newline at end of file
+            trace_file.save(self.last_trace, os.path.join(dirpath, name + ".trc"))
+            
+    def _lastTrace(self, overlay, stop):
+        '''
+        Gives the L{Trace} being replayed, building it from the overlay
+        the first time it is needed in a run.
+        
+        @param overlay: The fuzzed variant being replayed
+        @type overlay: L{Overlay} object
+        
+        @param stop: The number of L{Snapshot}s being replayed
+        @type stop: integer
+        
+        @return: The trace
+        @rtype: L{Trace} object
+        '''
+        if self.last_trace == None :
+            self.last_trace = overlay.materialize().truncated(stop)
+        return self.last_trace
+            
+    def _replayLength(self, trace, overlay):
+        '''
+        Works out how many L{Snapshot}s of a fuzzed L{Trace} to replay,
+        according to the suffix limit.
+        
+        @param trace: The trace to run
+        @type trace: L{Trace} object
+        
+        @param overlay: The fuzzed variant that makes up this run, if known
+        @type overlay: L{Overlay} object
+        
+        @return: The number of L{Snapshot}s from the start to replay
+        @rtype: integer
+        '''
+        length = len(trace.snapshots)
+        if self.suffix_limit < 0 or not overlay :
+            return length
+        start = overlay.firstSnapshot()
+        return min(length, start + self.suffix_limit + 1)
+            
+    def _signalName(self, signum):
+        '''
+        Translates a signal number to its name, such as "SIGSEGV"
+        
+        @param signum: The signal number
+        @type signum: integer
+        
+        @return: The signal's name, or its number if it has no name
+        @rtype: string
+        '''
+        for name in dir(signal) :
+            if name.startswith("SIG") and not name.startswith("SIG_") and \
+               getattr(signal, name) == signum :
+                return name
+        return str(signum)
@@ -0,0 +1,275 @@
+'''
+Contains the L{VectorGenerator} class for building the fuzzed values of
+numeric types in bulk with NumPy
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 16, 2011
+'''
+
+import struct
+import hashlib
+import logging
+
+# NumPy is optional - without it the Generator works in pure Python
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+def available():
+    '''
+    Checks whether NumPy could be imported, so a L{VectorGenerator} can
+    be used.
+
+    @return: I{True} if NumPy is installed
+    @rtype: boolean
+    '''
+    return numpy != None
+
+class VectorGenerator(object):
+    '''
+    Builds every fuzzed value of a numeric L{Tag} at once as a typed NumPy
+    array, for use by a L{Generator} in place of its pure-Python functions.
+
+    The mutational, heuristic and random candidates are built as arrays,
+    values outside the type's range are dropped by masking, and repeats
+    are dropped keeping the first copy of each value, so the cases come
+    out in the same order the L{Generator} would use: mutational, then
+    heuristic, then random values. The surviving values are converted to
+    the type's little-endian layout in a single buffer, and each case's
+    packed bytes are a slice of it.
+
+    Mutational and heuristic values are the same as the L{Generator}'s.
+    Random values are drawn from a L{numpy.random.RandomState} seeded
+    from the same campaign seed and coordinates as the L{Generator}'s
+    streams, so they are just as reproducible, but they are not the same
+    values - every shard of a campaign must use the same backend.
+
+    Only integer and floating point formats are handled; 64-bit integer
+    types build their mutational values in Python, since the arithmetic
+    can overflow NumPy's 64-bit integers.
+
+    @ivar log: The L{logging} object
+    @ivar generator: The L{Generator} whose settings are used
+    @ivar rs: The random state used for values without coordinates
+    @cvar arrays: Map of format strings to their heuristic values as an array
+    '''
+
+    # Heuristic values are shared like the Generator's tables
+    arrays = {}
+
+    # The formats handled, and the NumPy kind of each
+    kinds = {
+             "b": "i", "h": "i", "i": "i", "l": "i", "q": "i",
+             "B": "u", "H": "u", "I": "u", "L": "u", "Q": "u",
+             "f": "f", "d": "f"
+            }
+
+    def __init__(self, generator):
+        '''
+        Stores the L{Generator} whose settings, seed and heuristic tables
+        are used.
+
+        @param generator: The L{Generator} this backend works for
+        @type generator: L{Generator} object
+        '''
+        self.log = logging.getLogger(__name__)
+        self.generator = generator
+        self.rs = numpy.random.RandomState(generator.seed)
+
+    def handles(self, fmt):
+        '''
+        Checks if values for a format can be built by this backend
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @return: I{True} for numeric formats
+        @rtype: boolean
+        '''
+        return fmt in self.kinds
+
+    def cases(self, fmt, orig, key=None):
+        '''
+        Builds the fuzzed values of this L{Generator}'s shard, as in
+        L{Generator.cases}.
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @param orig: The original value of the number we are fuzzing
+        @type orig: integer or float
+
+        @param key: The coordinates the random values are derived from,
+                    such as (trace number, snapshot index, tag index)
+        @type key: integer tuple
+
+        @return: The number of values, and an iterator over
+                 (value, packed bytes) pairs
+        @rtype: (integer, iterator) tuple
+        '''
+        gen = self.generator
+        dtype = self._dtype(fmt)
+        parts = [numpy.zeros(0, dtype)]
+        # Large floats become infinity in single precision, as with struct
+        with numpy.errstate(over='ignore') :
+            if gen.mutational :
+                parts.append(self._mutate(fmt, orig, dtype))
+            if gen.heuristic :
+                parts.append(self._heuristics(fmt, dtype))
+            if gen.random :
+                parts.append(self._random(fmt, dtype, key))
+            values = numpy.concatenate([p.astype(dtype) for p in parts])
+        # Keep the first copy of each value, in order
+        (_, first) = numpy.unique(values, return_index=True)
+        values = values[numpy.sort(first)][gen.shard::gen.shards]
+        return (len(values), self._slices(values, dtype.itemsize))
+
+    def _slices(self, values, size):
+        '''
+        Packs an array of values into one buffer, and yields each value
+        along with its slice of the buffer.
+
+        @param values: The values
+        @type values: L{numpy.ndarray}
+
+        @param size: The size of each value in bytes
+        @type size: integer
+
+        @return: Iterator over (value, packed bytes) pairs
+        @rtype: iterator
+        '''
+        buf = values.tostring()
+        for (i, v) in enumerate(values.tolist()) :
+            yield (v, buf[i*size:(i+1)*size])
+
+    def _dtype(self, fmt):
+        '''
+        Gives the little-endian NumPy type matching a format
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @return: The NumPy type
+        @rtype: L{numpy.dtype}
+        '''
+        return numpy.dtype("<%s%d" % (self.kinds[fmt], struct.calcsize(fmt)))
+
+    def _limits(self, fmt, dtype):
+        '''
+        Gives the range of legal values for mutational values of a format,
+        as checked by the L{Generator}'s functions
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @param dtype: The NumPy type for the format
+        @type dtype: L{numpy.dtype}
+
+        @return: The minimum and maximum values
+        @rtype: (value, value) tuple
+        '''
+        bits = dtype.itemsize*8
+        if dtype.kind == "i" :
+            return (-(2**(bits - 1)), (2**(bits - 1)) - 1)
+        if dtype.kind == "u" :
+            return (0, (2**bits) - 1)
+        # The rough minimum and maximum positive floats, as in _getFloats
+        if dtype.itemsize == 8 :
+            return (10e-323, 10e308)
+        return (10e-44, 10e38)
+
+    def _mutate(self, fmt, orig, dtype):
+        '''
+        Builds the mutational values for a number, as in L{Generator._getInts},
+        L{Generator._getUints} and L{Generator._getFloats}
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @param orig: The original value of the number we are fuzzing
+        @type orig: integer or float
+
+        @param dtype: The NumPy type for the format
+        @type dtype: L{numpy.dtype}
+
+        @return: The mutational values
+        @rtype: L{numpy.ndarray}
+        '''
+        gen = self.generator
+        if dtype.kind != "f" and dtype.itemsize == 8 :
+            # orig * 4 may not fit in 64 bits
+            return numpy.array(list(gen.generators[fmt](fmt, orig)), dtype)
+        if dtype.kind == "f" :
+            o = numpy.float64(orig)
+            scale = [o/2, o/3, o/4, o*2, o*3, o*4]
+        else :
+            o = numpy.int64(orig)
+            scale = [o//2, o//4, o*2, o*4]
+        offsets = numpy.arange(1, gen.mutaterange + 1).astype(o.dtype)
+        scale = numpy.array(scale, o.dtype)
+        parts = [o + offsets, o - offsets, scale]
+        # Negatives of the scaled values, and of the original for ints
+        if dtype.kind != "u" :
+            parts.append(-scale)
+        if dtype.kind == "i" :
+            parts.append(numpy.array([-o]))
+        values = numpy.concatenate(parts)
+        (low, high) = self._limits(fmt, dtype)
+        # Drop the illegal values
+        return values[(values >= low) & (values <= high)]
+
+    def _heuristics(self, fmt, dtype):
+        '''
+        Gives the L{Generator}'s heuristic values for a format as an array,
+        converting them the first time the format is seen.
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @param dtype: The NumPy type for the format
+        @type dtype: L{numpy.dtype}
+
+        @return: The heuristic values
+        @rtype: L{numpy.ndarray}
+        '''
+        values = VectorGenerator.arrays.get(fmt)
+        if values is None :
+            table = self.generator._heuristicTable(fmt)
+            values = numpy.array([v for (v, _) in table], dtype)
+            VectorGenerator.arrays[fmt] = values
+        return values
+
+    def _random(self, fmt, dtype, key):
+        '''
+        Draws the random values for a format, from the random state for
+        the given coordinates.
+
+        @param fmt: The format string of the type we are fuzzing
+        @type fmt: string
+
+        @param dtype: The NumPy type for the format
+        @type dtype: L{numpy.dtype}
+
+        @param key: The coordinates the values are derived from, or
+                    I{None} to use L{rs}
+        @type key: integer tuple
+
+        @return: The random values
+        @rtype: L{numpy.ndarray}
+        '''
+        gen = self.generator
+        if key == None :
+            rs = self.rs
+        else :
+            name = ":".join([str(gen.seed)] + [str(k) for k in key])
+            words = numpy.frombuffer(hashlib.sha1(name).digest(), "<u4")
+            rs = numpy.random.RandomState(words)
+        if dtype.kind == "f" :
+            # Either sign, with magnitude up to the largest single float
+            signs = rs.choice([-1.0, 1.0], gen.randcases)
+            return rs.random_sample(gen.randcases) * 3.4e38 * signs
+        (low, high) = self._limits(fmt, dtype)
+        return rs.randint(low, high + 1, size=gen.randcases, dtype=dtype)
@@ -10,7 +10,8 @@ contains a simple method that initializes the project-wide logging
 system; L{StatusReporter}, which contains a class for tracking
 and displaying progress in the form of a status bar; and 
 L{SectionReporter}, which builds off of L{StatusReporter} to
-report the progress of a multi-part program.
+report the progress of a multi-part program; and L{BloomFilter}, a
+compact set used to skip values that have already been seen.
 
 @author: Rob Waaser
 @contact: robwaaser@gmail.com
@@ -24,5 +25,6 @@ __all__ = \
     "log_setup",
     "status_reporter",
     "section_reporter",
-    "parallel_reporter"
+    "parallel_reporter",
+    "bloom_filter"
 ]
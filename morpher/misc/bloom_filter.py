@@ -0,0 +1,115 @@
+'''
+Contains the L{BloomFilter} class, a compact set for remembering which
+values have already been seen
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 15, 2011
+'''
+import math
+
+class BloomFilter(object):
+    '''
+    A probabilistic set that only answers whether a value has (probably)
+    been added before, using a fixed-size bit array.
+
+    Each value is hashed to several positions in the bit array, and
+    adding it sets those bits. A value is reported as present if all its
+    bits are set, which can happen by chance for a value that was never
+    added (a false positive) but never misses a value that was. The
+    array is sized when the filter is created so that, with the expected
+    number of values added, false positives stay around the given rate.
+    Only a few bits are set per value, since each one costs a pass through
+    the interpreter; at 1% and 3 bits per value the array takes about 12
+    bits per value, a small fraction of what a I{set} of the same values
+    would take.
+
+    Values are hashed with Python's own I{hash}, mixed so that nearby
+    integers land far apart, so any hashable value can be added and an 
+    I{int} and I{long} of the same value are the same key.
+    Since I{hash} isn't stable between runs or platforms, a filter's bits
+    should not be saved and reused.
+
+    @ivar size: The number of bits in the array
+    @ivar numhashes: The number of bits set per value
+    @ivar bits: The bit array
+    '''
+
+    def __init__(self, capacity, error_rate=0.01, numhashes=3):
+        '''
+        Creates an empty filter sized for the given number of values
+
+        @param capacity: The number of values expected to be added
+        @type capacity: integer
+
+        @param error_rate: The acceptable chance of a false positive once
+                           capacity values have been added
+        @type error_rate: float
+        
+        @param numhashes: The number of bits set per value
+        @type numhashes: integer
+        '''
+        capacity = max(1, capacity)
+        # The fraction of bits set once full, from
+        # error_rate = (1 - e^(-numhashes * capacity / size))^numhashes
+        fill = error_rate ** (1.0 / numhashes)
+        bits = -numhashes * capacity / math.log(1 - fill)
+        self.size = max(64, int(math.ceil(bits)))
+        self.numhashes = numhashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, value):
+        '''
+        Adds a value to the filter, reporting whether it was already there.
+        This checks and adds in one pass, so it is cheaper than testing
+        with I{in} first.
+
+        @param value: The value to add
+        @type value: basic Python value (string, integer, etc)
+
+        @return: I{True} if the value was new, I{False} if it probably 
+                 had been added before
+        @rtype: boolean
+        '''
+        bits = self.bits
+        new = False
+        for pos in self._positions(value) :
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask :
+                bits[pos >> 3] |= mask
+                new = True
+        return new
+
+    def __contains__(self, value):
+        '''
+        Checks whether a value has probably been added to the filter
+
+        @param value: The value to check for
+        @type value: basic Python value (string, integer, etc)
+
+        @return: I{False} if the value was never added, I{True} if it
+                 probably was
+        @rtype: boolean
+        '''
+        for pos in self._positions(value) :
+            if not self.bits[pos >> 3] & (1 << (pos & 7)) :
+                return False
+        return True
+
+    def _positions(self, value):
+        '''
+        Works out the bit positions for a value by double hashing
+
+        @param value: The value to hash
+        @type value: basic Python value (string, integer, etc)
+
+        @return: The bit positions
+        @rtype: integer list
+        '''
+        # Small integers hash to themselves, so scramble the hash by
+        # Fibonacci hashing and split it into two 32-bit hashes
+        h = (hash(value) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h1 = h >> 32
+        h2 = (h & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.size for i in xrange(self.numhashes)]
@@ -13,7 +13,7 @@ import atexit
 import sys
 import os
 
-def setupLogging(cfg, root=None):
+def setupLogging(cfg, root=None, logname=None):
     '''
     When called with a Config object, uses the Config object to
     extract configuration information and sets up Python's standard
@@ -33,6 +33,8 @@ def setupLogging(cfg, root=None):
       - Sets up a handler that prints all other logging messages to a log file,
        located in the directory specified in directories->logging
       - Stops propagation of messages above the defined root logger
+      - Replaces any handlers the root logger already had, such as
+       those inherited by a forked worker process
       - Registers an L{atexit} handler that ensures the logging system is 
        properly flushed upon program exit.
        
@@ -45,6 +47,10 @@ def setupLogging(cfg, root=None):
     @type cfg: L{Config} object
     @param root: An optional string specifying the name of the root module
     @type root: string
+    @param logname: An optional name for the log file, default is the root.
+                    Lets several processes log the same hierarchy to
+                    different files.
+    @type logname: string
     '''
     # Figure out the root of the hierarchy
     if root == None :
@@ -74,7 +80,9 @@ def setupLogging(cfg, root=None):
     
     # Figure out log file path and remove it if it already exists
     logdir = cfg.get('directories', 'logs')
-    path = os.path.join(logdir, root + ".log")
+    if logname == None :
+        logname = root
+    path = os.path.join(logdir, logname + ".log")
     if os.path.isfile(path) :
         os.remove(path)
         
@@ -86,6 +94,8 @@ def setupLogging(cfg, root=None):
     logger = logging.getLogger(root)
     logger.propagate = False
     logger.setLevel(level)
+    for handler in list(logger.handlers) :
+        logger.removeHandler(handler)
     logger.addHandler(file_hand)
     logger.addHandler(err_hand)
     
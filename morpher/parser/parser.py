@@ -311,16 +311,17 @@ class Parser(object):
                 val = self.parseXML(c, typex, name, printflag)
                 if val != None:
                     if val != "":
+                        # Arrays are kept as one param with the total number
+                        # of elements, e.g. "c[4096]", flattening dimensions
                         total = 1
                         arrays = val.split("[")
                         if len(arrays) > 1:
                             for i in range(len(arrays) - 1):
                                 total *= int(arrays[i+1][:-1])
-                            val = arrays[0]
-                        for i in range(total):
-                            param = self.doc.createElement("param")
-                            param.setAttribute("type", val)
-                            typex.appendChild(param)
+                            val = arrays[0] + "[" + str(total) + "]"
+                        param = self.doc.createElement("param")
+                        param.setAttribute("type", val)
+                        typex.appendChild(param)
                         changed = 1
             
             # If the current struct isn't supposed to be printed, add it to the
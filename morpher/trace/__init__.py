@@ -20,8 +20,9 @@ deserialization.
 
 Type information is captured mainly through the use of L{Tag} objects, which
 merely record an address and a format string similar to those used by the
-I{struct} module. A L{TypeManager} object can be used to translate these format
-types into I{ctypes} objects suitable as function arguments for a DLL function.
+I{struct} module, and are kept in bulk as runs in a L{TagTable}. A
+L{TypeManager} object can be used to translate these format types into
+I{ctypes} objects suitable as function arguments for a DLL function.
 One of the most important aspects of these classes is to properly reconstruct 
 I{ctypes} struct and union classes from stored information about user-defined
 types.
@@ -34,9 +35,16 @@ for using all this information to reconstruct I{ctypes} objects respresenting
 the original arguments that can be used in a function call, and in such a way
 that all pointers point to the same data that they did when originally captured.
 
-Finally, L{Trace} serves as a top-level object that pairs a list of 
-L{Snapshot} objects to be replayed in order, along with the L{TypeManager}
-object used by all of those L{Snapshot}s.
+Finally, L{Trace} serves as a top-level object that pairs a list of
+L{Snapshot} objects to be replayed in order, along with the
+L{TypeManager} object used by all of those L{Snapshot}s. L{Trace}s are
+stored in the binary format of the L{trace_file} module, which can load a
+single L{Snapshot} without reading the rest. A L{TraceStore} keeps a
+whole collection of L{Trace}s in one append-only file with an index, so
+they can be counted and found without loading each one, a L{Manifest}
+describes a directory of separate L{Trace} files, and an L{Overlay}
+describes a fuzzed variant of a L{Trace} as a few patches without
+touching the L{Trace} itself.
 
 @author: Rob Waaser
 @contact: robwaaser@gmail.com
@@ -50,5 +58,10 @@ __all__ = \
     "memory",
     "trace",
     "tag",
-    "typemanager"
+    "tag_table",
+    "typemanager",
+    "manifest",
+    "overlay",
+    "trace_file",
+    "trace_store"
 ]
@@ -23,12 +23,22 @@ class Block(object):
     module, and provides a L{translate} method that can take a virtual
     address and return the actual address the bytestring currently occupies.
     
+    While active, reads and writes go straight to the string buffer through
+    a memoryview of it (see L{getView}), using compiled L{struct.Struct}s
+    to unpack and pack values in place, so no temporary buffers are made.
+    
     @ivar size: The length of the stored byte string
     @ivar addr: The virtual address the byte string starts at
     @ivar data: The stored byte string
+    @ivar view: A memoryview of the string buffer while active, else I{None}
+    @ivar real: The real address of the start of the block while active
     @ivar active: Boolean indicating if the byte array is in a serializable 
                   state (I{False}) or not (I{True})
+    @cvar structs: Map of format strings to compiled L{struct.Struct}s
     '''
+    
+    # Compiled formats, shared by every Block
+    structs = {}
 
     def __init__(self, addr, data):
         '''
@@ -48,6 +58,8 @@ class Block(object):
         self.addr = addr
         # When active, a ctypes string buffer; inactive, a bytearray
         self.data = ctypes.create_string_buffer(data)
+        # Writable view and real address of the buffer, which can't be pickled
+        self._bind()
         # Flag indicating if we are active(can be accessed by address)
         # or inactive (in a mode allowing pickling) (pickling will not
         # work on a ctypes pointer object)
@@ -69,9 +81,12 @@ class Block(object):
             return
         if flag == True:
             self.data = ctypes.create_string_buffer(self.data)
+            self._bind()
             self.active = True
         else :
             self.data = self.data.raw[:self.size]
+            self.view = None
+            self.real = None
             self.active = False
             
         
@@ -102,18 +117,12 @@ class Block(object):
         '''
         if not self.active :
             self.setActive(True)
+        offset = addr - self.addr
         if fmt != None :
-            size = struct.calcsize(fmt)
+            return self._getStruct(fmt).unpack_from(self.view, offset)
         elif size == None :
             raise Exception("Need some indicator of number of bytes to read")
-        buf = ctypes.create_string_buffer(size)
-        real_addr = self.translate(addr)
-        ctypes.memmove(buf, real_addr, size)
-        if fmt == None :
-            ret = buf.raw
-        else :
-            ret = struct.unpack(fmt, buf.raw)
-        return ret
+        return self.view[offset:offset + size].tobytes()
     
     def write(self, addr, data, fmt=None):
         '''
@@ -137,12 +146,24 @@ class Block(object):
         '''
         if not self.active :
             self.setActive(True)
+        offset = addr - self.addr
         if fmt != None:
-            data = struct.pack(fmt, *data)
-        buf = ctypes.c_char_p(data)
-        size = len(data)
-        real_addr = self.translate(addr)
-        ctypes.memmove(real_addr, buf, size)
+            self._getStruct(fmt).pack_into(self.view, offset, *data)
+        else :
+            self.view[offset:offset + len(data)] = data
+    
+    def getView(self):
+        '''
+        Gives a writable memoryview of this L{Block}'s live buffer, 
+        activating the L{Block} if needed. The view is only valid until
+        the L{Block} is next deactivated.
+        
+        @return: View of the buffer, indexed from the start of the L{Block}
+        @rtype: memoryview
+        '''
+        if not self.active :
+            self.setActive(True)
+        return self.view
         
     def contains(self, addr, size):
         '''
@@ -179,8 +200,32 @@ class Block(object):
         if addr == 0 :
             return 0
         offset = addr - self.addr
-        return ctypes.addressof(self.data) + offset
+        return self.real + offset
+
+    def _bind(self):
+        '''
+        Sets up L{view} and L{real} for the active string buffer
+        '''
+        self.view = memoryview(self.data)
+        self.real = ctypes.addressof(self.data)
 
+    def _getStruct(self, fmt):
+        '''
+        Gives the compiled L{struct.Struct} for a format, creating it the
+        first time the format is seen.
+        
+        @param fmt: The format string
+        @type fmt: string
+        
+        @return: The compiled format
+        @rtype: L{struct.Struct} object
+        '''
+        s = Block.structs.get(fmt)
+        if s == None :
+            s = struct.Struct(fmt)
+            Block.structs[fmt] = s
+        return s
+    
     def toString(self):
         '''
         Creates a pretty-printed string containing the contents of this
@@ -189,11 +234,163 @@ class Block(object):
         @return: A string representing this object's contents
         @rtype: string
         '''
-        if not self.active :
-            self.setActive(True)
+        raw = self.read(self.addr, self.size)
         blkstr = "Block - Size: %d, Address: 0x%x, Contents: " % (self.size, self.addr)
         for i in range(self.size) :
             if i % 4 == 0 :
                 blkstr += " "
-            blkstr += "\\x%02x" % ord(self.data.raw[i])
-        return blkstr
\ No newline at end of file
+            blkstr += "\\x%02x" % ord(raw[i])
+        return blkstr
+
+class ArenaBlock(Block):
+    '''
+    A L{Block} whose contents live in a buffer shared with other 
+    L{ArenaBlock}s - a L{Memory}'s arena - rather than in a buffer of its
+    own.
+    
+    The L{Memory} owning the arena is responsible for pickling it, so an
+    L{ArenaBlock} is always active and is never pickled by itself.
+    
+    @ivar offset: The offset of the L{Block}'s contents in the arena
+    '''
+
+    def __init__(self, addr, size, arena, offset):
+        '''
+        Describes the part of an arena holding the contents of the memory
+        at the given virtual address.
+        
+        @param addr: The virtual address of the beginning of the data
+        @type addr: integer
+        
+        @param size: The size of this block in bytes
+        @type size: integer
+        
+        @param arena: The shared buffer
+        @type arena: L{ctypes} string buffer
+        
+        @param offset: Where this block's contents start in the arena
+        @type offset: integer
+        '''
+        self.size = size
+        self.addr = addr
+        self.data = arena
+        self.offset = offset
+        self._bind()
+        self.active = True
+        
+    def setActive(self, flag):
+        '''
+        Does nothing, since the arena is pickled by its L{Memory}
+        
+        @param flag: The state the block should be set to
+        @type flag: Boolean
+        '''
+        pass
+    
+    def _bind(self):
+        '''
+        Sets up L{view} and L{real} for this block's part of the arena
+        '''
+        self.view = memoryview(self.data)[self.offset:self.offset + self.size]
+        self.real = ctypes.addressof(self.data) + self.offset
+
+class SharedBlock(Block):
+    '''
+    A L{Block} whose contents are a byte string that may be shared with
+    other L{SharedBlock}s holding the same bytes, until it is first
+    changed.
+    
+    L{Trace}s loaded from a L{TraceStore} or trace file store each
+    distinct block of contents once, so the L{Snapshot}s of a L{Trace} 
+    that captured the same bytes share a single string rather than each
+    holding a buffer of their own. A L{SharedBlock} starts out inactive, 
+    reading through a read-only memoryview of the shared string, and only
+    makes its own private buffer - as any L{Block} does when activated -
+    once it is written to, translated or viewed for replay. Reading never
+    copies the contents.
+    '''
+
+    def __init__(self, addr, data):
+        '''
+        Stores the virtual address of the shared byte string, without
+        copying it.
+        
+        @param addr: The virtual address of the beginning of the data
+        @type addr: integer
+        
+        @param data: The shared byte string
+        @type data: byte string
+        '''
+        self.size = len(data)
+        self.addr = addr
+        self.data = data
+        self.view = memoryview(data)
+        self.real = None
+        self.active = False
+
+    def __getstate__(self):
+        '''
+        The I{pickle} system calls this method when dumping. Drops the
+        memoryview of the string, which can't be pickled.
+        
+        @return: This object's __dict__ attribute, without the view
+        @rtype: dictionary
+        '''
+        state = dict(self.__dict__)
+        state["view"] = None
+        return state
+
+    def __setstate__(self, newdict):
+        '''
+        Pickle calls this method when unpickling. Restores the memoryview
+        of the string if the L{Block} is inactive.
+        
+        @param newdict: The deserialized __dict__ for this object
+        @type newdict: dictionary
+        '''
+        self.__dict__ = newdict
+        if not self.active :
+            self.view = memoryview(self.data)
+
+    def setActive(self, flag):
+        '''
+        Activating makes a private buffer holding the contents, as for any
+        L{Block}; deactivating stores them as a string again, read through
+        a memoryview.
+        
+        @param flag: The state the block should be set to
+        @type flag: Boolean
+        '''
+        Block.setActive(self, flag)
+        if not self.active :
+            self.view = memoryview(self.data)
+
+    def read(self, addr, size = None, fmt = None):
+        '''
+        Reads data as in L{Block.read}, from the shared string if this
+        L{Block} hasn't been activated.
+        
+        @raise Exception: If neither the size nor format is supplied
+        
+        @param addr: The virtual address to read from
+        @type addr: integer
+        
+        @param size: The number of bytes to read
+        @type size: integer
+        
+        @param fmt: The format of the object(s) to read
+        @type fmt: string
+        
+        @return: Raw byte string or tuple of objects
+        @rtype: byte string or tuple
+        '''
+        if self.active :
+            return Block.read(self, addr, size, fmt)
+        offset = addr - self.addr
+        if fmt != None :
+            return self._getStruct(fmt).unpack_from(self.view, offset)
+        elif size == None :
+            raise Exception("Need some indicator of number of bytes to read")
+        if offset == 0 and size == self.size :
+            return self.data
+        return self.view[offset:offset + size].tobytes()
\ No newline at end of file
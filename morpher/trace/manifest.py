@@ -0,0 +1,184 @@
+'''
+Contains the L{Manifest} class for describing a directory of stored
+L{Trace} files without loading them
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 14, 2011
+'''
+import os
+import json
+import hashlib
+import logging
+import trace_file
+
+class Manifest(object):
+    '''
+    An index of the L{Trace} files in a trace directory, stored as a
+    "manifest.json" file next to the traces.
+
+    Each entry describes one trace file - its name, size in bytes and the
+    SHA-1 hash of its contents, plus the number of L{Snapshot}s, the name
+    of the function each L{Snapshot} captured and the number of L{Tag}s
+    in each. That's enough to summarize a collection without loading every
+    trace first. Collections are now kept in a L{TraceStore}, which
+    imports directories of separate trace files left by older versions
+    through their manifest; if it is missing or doesn't match the files
+    in the directory, it can be rebuilt from the traces themselves with
+    L{rebuild}.
+
+    The manifest is a plain JSON object holding a version number and a
+    list of entries, so it can be read by tools outside of Morpher. Trace
+    files are listed in the order they were added.
+
+    @ivar log: The L{logging} object
+    @ivar tracedir: The directory holding the trace files
+    @ivar path: The path to the manifest file
+    @ivar entries: The list of entries, one dictionary per trace file
+    '''
+
+    # Version of the manifest layout, bumped on incompatible changes
+    VERSION = 1
+
+    def __init__(self, tracedir):
+        '''
+        Creates an empty manifest for the given trace directory. Use
+        L{load} to read the existing manifest file, if any.
+
+        @param tracedir: The directory holding the trace files
+        @type tracedir: string
+        '''
+        self.log = logging.getLogger(__name__)
+        self.tracedir = tracedir
+        self.path = os.path.join(tracedir, "manifest.json")
+        self.entries = []
+
+    def load(self):
+        '''
+        Reads the manifest file and checks it against the trace files in
+        the directory. Only the file names and sizes are checked, so this
+        stays fast no matter how many traces there are; hashes are checked
+        when each trace is actually loaded with L{loadTrace}.
+
+        @return: I{True} if the manifest was read and matches the trace
+                 files, I{False} if it is missing, unreadable or stale
+        @rtype: boolean
+        '''
+        self.entries = []
+        try :
+            f = open(self.path)
+            contents = json.load(f)
+            f.close()
+        except (IOError, ValueError) :
+            self.log.info("No usable trace manifest at %s", self.path)
+            return False
+        if contents.get("version") != self.VERSION :
+            self.log.info("Trace manifest has the wrong version")
+            return False
+        entries = contents.get("traces", [])
+
+        # The manifest must list exactly the trace files that exist
+        if set([e["file"] for e in entries]) != set(self.listTraceFiles()) :
+            self.log.info("Trace manifest doesn't match the trace directory")
+            return False
+        for e in entries :
+            path = os.path.join(self.tracedir, e["file"])
+            if os.path.getsize(path) != e["size"] :
+                self.log.info("Trace file %s changed since the manifest was written", path)
+                return False
+        self.entries = entries
+        return True
+
+    def save(self):
+        '''
+        Writes the manifest file to the trace directory
+        '''
+        self.log.info("Writing trace manifest with %d entries", len(self.entries))
+        f = open(self.path, "w")
+        json.dump({"version" : self.VERSION, "traces" : self.entries}, f, indent=1)
+        f.close()
+
+    def add(self, filename, trace, data):
+        '''
+        Adds an entry for a trace file to the manifest
+
+        @param filename: The name of the trace file in the trace directory
+        @type filename: string
+
+        @param trace: The L{Trace} stored in the file
+        @type trace: L{Trace} object
+
+        @param data: The exact contents of the file
+        @type data: byte string
+        '''
+        entry = {
+                 "file" : filename,
+                 "size" : len(data),
+                 "sha1" : hashlib.sha1(data).hexdigest(),
+                 "snapshots" : len(trace.snapshots),
+                 "functions" : [s.name for s in trace.snapshots],
+                 "tags" : [len(s.tags) for s in trace.snapshots]
+                }
+        self.entries.append(entry)
+
+    def rebuild(self):
+        '''
+        Recreates the manifest by loading every trace file in the
+        directory, then writes it out. Traces pickled by older versions
+        of Morpher (trace-*.pkl) are converted to trace files first.
+        '''
+        self.log.info("Rebuilding trace manifest for %s", self.tracedir)
+        for filename in sorted(os.listdir(self.tracedir)) :
+            if filename.startswith("trace-") and filename.endswith(".pkl") :
+                self.log.info("Converting pickled trace %s", filename)
+                trace_file.convert(os.path.join(self.tracedir, filename))
+        self.entries = []
+        for filename in sorted(self.listTraceFiles()) :
+            f = open(os.path.join(self.tracedir, filename), "rb")
+            data = f.read()
+            f.close()
+            self.add(filename, trace_file.loads(data), data)
+        self.save()
+
+    def listTraceFiles(self):
+        '''
+        Lists the names of the trace files in the trace directory
+
+        @return: The file names
+        @rtype: string list
+        '''
+        names = []
+        for filename in os.listdir(self.tracedir) :
+            if filename.startswith("trace-") and filename.endswith(".trc") and \
+               os.path.isfile(os.path.join(self.tracedir, filename)) :
+                names.append(filename)
+        return names
+
+    def countTags(self):
+        '''
+        Adds up the number of L{Tag}s across every listed trace
+
+        @return: The total number of L{Tag}s
+        @rtype: integer
+        '''
+        return sum([sum(e["tags"]) for e in self.entries])
+
+    def loadTrace(self, entry):
+        '''
+        Loads the L{Trace} described by an entry, warning if the file's
+        contents don't match the hash in the manifest.
+
+        @param entry: An entry from L{entries}
+        @type entry: dictionary
+
+        @return: The stored trace
+        @rtype: L{Trace} object
+        '''
+        path = os.path.join(self.tracedir, entry["file"])
+        f = open(path, "rb")
+        data = f.read()
+        f.close()
+        if hashlib.sha1(data).hexdigest() != entry["sha1"] :
+            self.log.warning("Trace file %s doesn't match its manifest entry", path)
+        return trace_file.loads(data)
@@ -7,6 +7,8 @@ Contains the L{Memory} class for maintaining a collection of L{Block}
 @since: October 26, 2011
 '''
 import struct
+import bisect
+import ctypes
 import block
 
 class Memory(object):
@@ -26,14 +28,44 @@ class Memory(object):
     be fetched, and the virtual target address to be translated to the real
     address that data now occupies using the L{Block} translate method.
     
+    Since the pointers and the L{Block}s they point into are the same from
+    one replay to the next, the work of finding them is done once and kept
+    as a patch plan (see L{getPlan}): one entry per pointer, holding the 
+    L{Block} and offset of the pointer, the virtual address it held, and
+    the L{Block} and offset that address falls in. L{patch} then only
+    needs to compare each pointer against the plan and write the target's
+    real address; only a pointer whose value has changed since, such as a
+    fuzzed one, is looked up again. The plan is dropped whenever the 
+    L{Block}s or the registered pointers change, and isn't pickled.
+    
+    Blocks are found by address through a sorted list of their starting
+    addresses, so each lookup is a binary search rather than a scan of 
+    every L{Block}. The list is kept up to date by L{addBlock}, and is 
+    rebuilt rather than stored when the L{Memory} is pickled.
+    
+    In arena mode (see L{toArena}) the contents of every L{Block} are kept
+    back to back in one contiguous buffer, the arena, with each block an
+    L{ArenaBlock} at a fixed offset. Pickling then copies the arena once
+    instead of converting every L{Block}, and a copy of the arena taken 
+    with L{savePristine} can put back every change made since with a
+    single copy in L{restore}.
+    
     @note: It is assumed that the underlying L{Block} objects contain
            non-overlapping and non-consecutive ranges of memory
            
     @ivar mem: A dictionary mapping addresses to L{Block} objects
+    @ivar starts: The sorted starting addresses of the L{Block}s
     @ivar pointers: A set containing addresses of pointer objects
+    @ivar arena: The buffer holding every L{Block} in arena mode, else I{None}
+    @ivar pristine: Saved contents of the arena for L{restore}, or I{None}
+    @ivar plan: The cached patch plan, or I{None} until it is needed
+    @cvar pointer: The compiled L{struct.Struct} for a pointer
     '''
     
-    def __init__(self, blklist):
+    # Pointers are read and written on every replay
+    pointer = struct.Struct("P")
+    
+    def __init__(self, blklist, arena=False):
         '''
         Takes a list of (address, data) tuples, where address is a virtual
         address and data is a byte string representing the memory contents
@@ -46,13 +78,25 @@ class Memory(object):
         @param blklist: The contents of this L{Memory} as a list of
                         (address, data) pairs
         @type blklist: (integer, byte string) tuple list
+        
+        @param arena: I{True} to keep the blocks in a single arena
+        @type arena: boolean
         '''
         # Dictionary of address -> char[] 
         self.mem = {}
+        # Sorted block addresses, for finding the block holding an address
+        self.starts = []
+        # The shared buffer in arena mode, and its saved contents
+        self.arena = None
+        self.pristine = None
+        # The patch plan, built when first needed
+        self.plan = None
         # Populate the memory with blocks
-        for (addr, data) in blklist :
-            b = block.Block(addr, data)
-            self.mem[b.addr] = b
+        if arena :
+            self._buildArena(blklist)
+        else :
+            for (addr, data) in blklist :
+                self.addBlock(addr, data)
         # Set of addresses of pointers
         self.pointers = set()
         
@@ -67,23 +111,49 @@ class Memory(object):
                otherwise L{setActive} can force them all to 
                reactivate right then
                
-        @return: This object's __dict__ attribute
+        In arena mode the L{Block}s aren't stored at all - just the arena's
+        contents and the (address, offset, size) of each L{Block} in it.
+        
+        @return: This object's __dict__ attribute, without the index
         @rtype: dictionary
         '''
+        state = dict(self.__dict__)
+        del state["starts"]
+        state["plan"] = None
+        if self.arena != None :
+            del state["mem"]
+            state["layout"] = [(b.addr, b.offset, b.size) for b in self.mem.values()]
+            # Without the NUL create_string_buffer added after the blocks
+            state["arena"] = self.arena.raw[:sum([b.size for b in self.mem.values()])]
+            state["pristine"] = None
+            return state
         for b in self.mem.values() :
             b.setActive(False)
-        return self.__dict__
+        return state
     
     def __setstate__(self, newdict):
         '''
         Pickle calls this method when unpickling. Restores this object's
         __dict__ from the unserialized version given, then reactivates
-        all of the constituent L{Block} objects.
+        all of the constituent L{Block} objects and rebuilds the index of
+        their addresses.
         
         @param newdict: The deserialized __dict__ for this object
         @type newdict: dictionary
         '''
         self.__dict__ = newdict
+        if "layout" in newdict :
+            # Arena mode - recreate the blocks over the arena
+            self.arena = ctypes.create_string_buffer(self.arena, len(self.arena))
+            self.mem = {}
+            for (addr, offset, size) in newdict.pop("layout") :
+                self.mem[addr] = block.ArenaBlock(addr, size, self.arena, offset)
+        elif not hasattr(self, "arena") :
+            # Stored before arena mode existed
+            self.arena = None
+            self.pristine = None
+        self.starts = sorted(self.mem.keys())
+        self.plan = None
         for b in self.mem.values() :
             b.setActive(True)
             
@@ -94,6 +164,112 @@ class Memory(object):
         for b in self.mem.values() :
             b.setActive(True)
             
+    def addBlock(self, addr, data, shared=False):
+        '''
+        Adds a new L{Block} holding the given data at the given address.
+        
+        @requires: The block must not overlap any existing L{Block}
+        
+        @param addr: The virtual address of the beginning of the data
+        @type addr: integer
+        
+        @param data: The byte string to store
+        @type data: byte string
+        
+        @param shared: I{True} to add a L{SharedBlock} using the string
+                       itself until it is changed, rather than a copy
+        @type shared: boolean
+        '''
+        if self.arena != None :
+            raise Exception("Can't add blocks to a Memory in arena mode")
+        if shared :
+            b = block.SharedBlock(addr, data)
+        else :
+            b = block.Block(addr, data)
+        self.plan = None
+        if b.addr not in self.mem :
+            bisect.insort(self.starts, b.addr)
+        self.mem[b.addr] = b
+        
+    def toArena(self):
+        '''
+        Switches this L{Memory} to arena mode, moving the contents of every
+        L{Block} into a single new arena. Does nothing if it is already in
+        arena mode.
+        '''
+        if self.arena != None :
+            return
+        blklist = [(a, self.mem[a].read(a, self.mem[a].size)) for a in self.starts]
+        self.mem = {}
+        self.starts = []
+        self.plan = None
+        self._buildArena(blklist)
+    
+    def savePristine(self):
+        '''
+        Saves a copy of the arena, to be put back by L{restore}.
+        
+        @raise Exception: If this L{Memory} is not in arena mode
+        '''
+        if self.arena == None :
+            raise Exception("Memory is not in arena mode")
+        self.pristine = self.arena.raw
+    
+    def restore(self):
+        '''
+        Puts back the contents of the arena saved by L{savePristine}, 
+        undoing every write since.
+        
+        @raise Exception: If no copy of the arena was saved
+        '''
+        if self.pristine == None :
+            raise Exception("No saved copy of the arena to restore")
+        ctypes.memmove(self.arena, self.pristine, len(self.pristine))
+        
+    def withPatches(self, patches):
+        '''
+        Creates a copy of this L{Memory} with the given bytes written to
+        it, leaving this one unchanged.
+        
+        Only the L{Block}s that are written to are copied; the copy shares
+        every other L{Block} with this L{Memory}. In arena mode the whole
+        arena is copied instead, since its L{Block}s all live in it.
+        
+        @raise Exception: If a patch is not contained in one L{Block}
+        
+        @param patches: The changes to make
+        @type patches: (integer, byte string) tuple list
+        
+        @return: The patched copy
+        @rtype: L{Memory} object
+        '''
+        # Copied directly rather than through copy.copy, which would go
+        # through __getstate__ and reactivate every Block of this Memory
+        other = object.__new__(Memory)
+        other.__dict__ = dict(self.__dict__)
+        other.pointers = set(self.pointers)
+        other.starts = list(self.starts)
+        other.pristine = None
+        other.plan = None
+        if self.arena != None :
+            other.arena = ctypes.create_string_buffer(len(self.arena))
+            ctypes.memmove(other.arena, self.arena, len(self.arena))
+            other.mem = {}
+            for b in self.mem.values() :
+                other.mem[b.addr] = block.ArenaBlock(b.addr, b.size, other.arena, b.offset)
+        else :
+            other.mem = dict(self.mem)
+            for (addr, data) in patches :
+                blk = self._findBlock(addr, len(data))
+                if blk == None :
+                    raise Exception("Address %x size %d not a valid address range" \
+                                    % (addr, len(data)))
+                if other.mem[blk.addr] is blk :
+                    other.mem[blk.addr] = block.Block(blk.addr, blk.read(blk.addr, blk.size))
+        for (addr, data) in patches :
+            other.write(addr, data)
+        return other
+    
     def registerPointer(self, addr):
         '''
         Stores the given address in a set of addresses pointing to 
@@ -110,6 +286,7 @@ class Memory(object):
         if not self.containsAddress(addr, size):
             raise Exception("Pointer address is not valid")
         self.pointers.add(addr)
+        self.plan = None
         
     def unregisterPointer(self, addr):
         '''
@@ -120,6 +297,7 @@ class Memory(object):
         @type addr: integer
         '''
         self.pointers.discard(addr)
+        self.plan = None
             
     def read(self, addr, size = None, fmt = None):
         '''
@@ -194,17 +372,67 @@ class Memory(object):
         For each pointer in this L{Memory} whose address is registered,
         this method updates the pointer's value to reflect the ACTUAL address
         of the object it originally pointed to.
+        
+        The pointers are found through the patch plan, so only pointers
+        holding a different value than when the plan was built are looked
+        up again.
         '''
-        for addr in self.pointers :
-            blk = self._findBlock(addr, struct.calcsize("P"))
-            p = blk.read(addr, fmt="P")[0]
-            tgtblk = self._findBlock(p, 1)
+        plan = self.getPlan()
+        # Make sure every view and real address is current
+        self.setActive()
+        unpack = self.pointer.unpack_from
+        pack = self.pointer.pack_into
+        for (blk, offset, value, tgtblk, tgtoffset) in plan :
+            (p,) = unpack(blk.view, offset)
+            if p != value :
+                # Changed since the plan was built, look it up again
+                (tgtblk, tgtoffset) = self._resolve(p)
             # Don't try to translate pointers to memory we don't control
             # EG pointers to kernel memory, NULL pointers
             if tgtblk == None :
                 continue
-            p = tgtblk.translate(p)
-            blk.write(addr, (p,), fmt="P")
+            pack(blk.view, offset, tgtblk.real + tgtoffset)
+            
+    def getPlan(self):
+        '''
+        Gives the patch plan used by L{patch}, building it from the 
+        registered pointers' current values if there isn't one yet. 
+        Building it ahead of time lets copies of this L{Memory} made by
+        I{os.fork} share it.
+        
+        @return: A (pointer L{Block}, offset, value, target L{Block}, target
+                 offset) entry for each pointer, where the target L{Block}
+                 is I{None} if the value doesn't point into this L{Memory}
+        @rtype: (L{Block}, integer, integer, L{Block}, integer) tuple list
+        '''
+        if self.plan != None :
+            return self.plan
+        plan = []
+        for addr in sorted(self.pointers) :
+            blk = self._findBlock(addr, self.pointer.size)
+            (p,) = blk.read(addr, fmt="P")
+            (tgtblk, tgtoffset) = self._resolve(p)
+            plan.append((blk, addr - blk.addr, p, tgtblk, tgtoffset))
+        self.plan = plan
+        return plan
+    
+    def _resolve(self, p):
+        '''
+        Finds the L{Block} a pointer value points into
+        
+        @param p: The virtual address held by the pointer
+        @type p: integer
+        
+        @return: The L{Block} and the offset of the address in it, or 
+                 (I{None}, 0) for NULL or an address outside this L{Memory}
+        @rtype: (L{Block}, integer) tuple
+        '''
+        if p == 0 :
+            return (None, 0)
+        tgtblk = self._findBlock(p, 1)
+        if tgtblk == None :
+            return (None, 0)
+        return (tgtblk, p - tgtblk.addr)
             
     def containsAddress(self, addr, size=1):
         '''
@@ -239,6 +467,23 @@ class Memory(object):
             memstr += b.toString() + "\n"
         return memstr
         
+    def _buildArena(self, blklist):
+        '''
+        Creates the arena holding the given blocks back to back, and an
+        L{ArenaBlock} for each of them.
+        
+        @param blklist: The contents of the arena as a list of
+                        (address, data) pairs
+        @type blklist: (integer, byte string) tuple list
+        '''
+        data = "".join([d for (_, d) in blklist])
+        self.arena = ctypes.create_string_buffer(data, len(data))
+        offset = 0
+        for (addr, data) in blklist :
+            self.mem[addr] = block.ArenaBlock(addr, len(data), self.arena, offset)
+            offset += len(data)
+        self.starts = sorted(self.mem.keys())
+        
     def _findBlock(self, addr, size):
         '''
         Given an address and a size, return the appropriate L{Block} or None 
@@ -253,13 +498,11 @@ class Memory(object):
         @return: The containing L{Block} or I{None} if it does not exist
         @rtype: L{Block} object or I{None}
         '''
-        # Do a quick check if a block with address with key exists
-        blk = self.mem.get(addr, None)
-        if blk != None and blk.contains(addr, size):
+        # The only candidate is the last block starting at or before addr
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i < 0 :
+            return None
+        blk = self.mem[self.starts[i]]
+        if blk.contains(addr, size) :
             return blk
-        
-        # Else search for the correct block
-        for blk in self.mem.values() :
-            if blk.contains(addr,size) :
-                return blk
         return None
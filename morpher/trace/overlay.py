@@ -0,0 +1,143 @@
+'''
+Contains the L{Overlay} class for describing a fuzzed variant of a
+L{Trace} without changing the L{Trace} itself
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 17, 2011
+'''
+import copy
+
+class Overlay(object):
+    '''
+    A copy-on-write view of a base L{Trace}, holding only the bytes that
+    differ from it.
+
+    Each patch maps a (snapshot index, address) pair to the raw bytes
+    that replace the base L{Trace}'s memory at that address. The base is
+    never written to, so any number of L{Overlay}s can exist over the
+    same L{Trace} at once - fuzzed cases can be generated ahead of replay
+    or handed to several workers - at a cost proportional to the patches
+    rather than to the captured memory.
+
+    An L{Overlay} is turned into something replayable either by sending
+    its patches (see L{getPatches}) to a process holding its own copy of
+    the base, which applies them with L{Trace.applyPatches}, or by
+    L{materialize}, which builds a separate L{Trace} sharing every
+    L{Block} that isn't patched.
+
+    @note: Pickling an L{Overlay} pickles its base L{Trace} along with
+           it; send L{getPatches} instead where the base is already known
+
+    @ivar base: The unchanged L{Trace} the patches apply to
+    @ivar patches: Map of (snapshot index, address) to the bytes written there
+    '''
+
+    def __init__(self, base, patches=None):
+        '''
+        Creates an L{Overlay} over the given L{Trace}, with no patches or
+        with the patches given.
+
+        @param base: The L{Trace} the patches apply to
+        @type base: L{Trace} object
+
+        @param patches: Initial patches, as returned by L{getPatches}
+        @type patches: (integer, integer, byte string) tuple list
+        '''
+        self.base = base
+        self.patches = {}
+        for (index, addr, data) in patches or [] :
+            self.patches[(index, addr)] = data
+
+    def __len__(self):
+        '''
+        Gives the number of patches in this L{Overlay}
+
+        @return: The number of patches
+        @rtype: integer
+        '''
+        return len(self.patches)
+
+    def set(self, index, addr, data):
+        '''
+        Records that the given bytes replace the base's memory at an
+        address of one of its L{Snapshot}s.
+
+        @param index: The position of the L{Snapshot} in the base L{Trace}
+        @type index: integer
+
+        @param addr: The virtual address the bytes are written at
+        @type addr: integer
+
+        @param data: The bytes to write
+        @type data: byte string
+        '''
+        self.patches[(index, addr)] = data
+
+    def remove(self, index, addr):
+        '''
+        Drops the patch at an address, so the base's original bytes show
+        through again. Does nothing if there is no such patch.
+
+        @param index: The position of the L{Snapshot} in the base L{Trace}
+        @type index: integer
+
+        @param addr: The virtual address of the patch
+        @type addr: integer
+        '''
+        self.patches.pop((index, addr), None)
+
+    def copy(self):
+        '''
+        Creates an independent L{Overlay} over the same base, with the same
+        patches. Only the patch map is copied.
+
+        @return: The copy
+        @rtype: L{Overlay} object
+        '''
+        other = Overlay(self.base)
+        other.patches = dict(self.patches)
+        return other
+
+    def getPatches(self):
+        '''
+        Lists the patches in a form suitable for L{Trace.applyPatches},
+        ordered by L{Snapshot} and address.
+
+        @return: (snapshot index, address, bytes) patches
+        @rtype: (integer, integer, byte string) tuple list
+        '''
+        return [key + (data,) for (key, data) in sorted(self.patches.items())]
+
+    def firstSnapshot(self):
+        '''
+        Finds the first L{Snapshot} this L{Overlay} changes
+
+        @return: The index of the L{Snapshot}, or I{None} with no patches
+        @rtype: integer
+        '''
+        if not self.patches :
+            return None
+        return min([index for (index, _) in self.patches])
+
+    def materialize(self):
+        '''
+        Builds the fuzzed L{Trace} this L{Overlay} describes, leaving the
+        base unchanged. L{Snapshot}s without patches are shared with the
+        base; patched ones get a L{Memory} from L{Memory.withPatches},
+        which only copies the L{Block}s that are written to.
+
+        @return: The patched trace
+        @rtype: L{Trace} object
+        '''
+        bysnap = {}
+        for ((index, addr), data) in self.patches.items() :
+            bysnap.setdefault(index, []).append((addr, data))
+        variant = copy.copy(self.base)
+        variant.snapshots = list(self.base.snapshots)
+        for (index, patches) in bysnap.items() :
+            snap = copy.copy(variant.snapshots[index])
+            snap.mem = snap.mem.withPatches(patches)
+            variant.snapshots[index] = snap
+        return variant
@@ -8,7 +8,7 @@ Contains the L{Snapshot} class for storing and replaying a function call
 '''
 import memory
 import struct
-import ctypes
+import tag_table
 from morpher.trace import typemanager
 
 class Snapshot(object):
@@ -16,7 +16,7 @@ class Snapshot(object):
     Contains enough information to replay a captured function call in its
     entirety. 
     
-    A L{Memory} object is combined with a set of L{Tag} objects and a 
+    A L{Memory} object is combined with a L{TagTable} of L{Tag}s and a 
     L{TypeManager} object to act as snapshot of a function call. The 
     L{Memory} is used to store the actual argument values observed on the 
     stack and the values they point to, while the L{Tag} objects assign
@@ -29,7 +29,8 @@ class Snapshot(object):
     @todo: Add the capability to record and replay global variables
     
     @ivar mem: Internal L{Memory} object for storing data
-    @ivar tags: Set of L{Tag} objects associating types with data
+    @ivar tags: L{TagTable} of L{Tag}s associating types with data, in the
+                order they were added
     @ivar name: The name of the function call that was captured
     @ivar args: Ordered list of L{Tag} objects describing function arguments
     @ivar type_manager: Used to temporarily store a L{TypeManager} used 
@@ -41,7 +42,7 @@ class Snapshot(object):
         Stores the given function information and the contents of memory
         described as a list of (address, data) tuples, where address is 
         a virtual address and data is a byte string to store at that 
-        address. Initially the tag set and argument list are empty.
+        address. Initially the tag table and argument list are empty.
         
         @requires: blklist must consist of disjoint memory ranges
         
@@ -54,8 +55,8 @@ class Snapshot(object):
         '''
         # Our internal memory snapshot
         self.mem = memory.Memory(blklist)
-        # Set of object tags in our memory
-        self.tags = set()
+        # Table of object tags in our memory
+        self.tags = tag_table.TagTable()
         # Ordinal of the function we recorded
         self.name = name
         # Ordered list of argument tags
@@ -63,6 +64,21 @@ class Snapshot(object):
         # Type Manager
         self.type_manager = None
 
+    def __setstate__(self, newdict):
+        '''
+        Pickle calls this method when unpickling. Converts the set of
+        L{Tag}s stored by older versions to a L{TagTable}, ordered by
+        address. The state is copied into this object's own __dict__,
+        since I{copy.copy} passes the original's __dict__ itself.
+        
+        @param newdict: The deserialized __dict__ for this object
+        @type newdict: dictionary
+        '''
+        self.__dict__.update(newdict)
+        if isinstance(self.tags, set) :
+            tags = sorted(self.tags, key=lambda t: (t.addr, t.fmt))
+            self.tags = tag_table.TagTable(tags)
+        
     def setArgs(self, args):
         '''
         Saves an ordered list of argument tags for this function call.
@@ -75,28 +91,56 @@ class Snapshot(object):
         
     def addTag(self, tag):
         '''
-        Adds the given L{Tag} object to the internal tag set
+        Adds the given L{Tag} object to the internal tag table, unless it
+        is already there
         
         @raise Exception: If the tag's address is not valid for this object
         
         @param tag: The tag object to register
         @type tag: L{Tag} object
         '''
-        size = struct.calcsize(tag.fmt)
-        if not self.mem.containsAddress(tag.addr, size) : 
-            raise Exception("Address %x size %d not a valid address range" % (tag.addr, size))
-        self.tags.add(tag)
-        if tag.fmt == "P" :
-            self.mem.registerPointer(tag.addr)
+        self.addRange(tag.addr, tag.fmt, 1)
+        
+    def addRange(self, addr, fmt, count):
+        '''
+        Tags a run of consecutive objects of the same type, such as the
+        elements of a buffer, as a single entry in the tag table. Objects
+        that are already tagged are skipped.
+        
+        @raise Exception: If the range is not valid for this object
+        
+        @param addr: The address of the first object
+        @type addr: integer
+        
+        @param fmt: The format string of the objects
+        @type fmt: string
+        
+        @param count: The number of objects
+        @type count: integer
+        '''
+        size = struct.calcsize(fmt)
+        if not self.mem.containsAddress(addr, size*count) : 
+            raise Exception("Address %x size %d not a valid address range" % (addr, size*count))
+        if not self.tags.overlaps(addr, fmt, count) :
+            self.tags.add(addr, fmt, count)
+        else :
+            for i in xrange(count) :
+                if not self.tags.contains(addr + i*size, fmt) :
+                    self.tags.add(addr + i*size, fmt)
+        if fmt == "P" :
+            for i in xrange(count) :
+                self.mem.registerPointer(addr + i*size)
         
     def removeTag(self, tag):
         '''
         Removes a L{Tag} object previously given to L{addTag}
         
+        @raise KeyError: If the tag isn't in the tag table
+        
         @param tag: The tag object to remove
         @type tag: L{Tag} object
         '''
-        self.tags.remove(tag)
+        self.tags.remove(tag.addr, tag.fmt)
         if tag.fmt == "P" :
             self.mem.unregisterPointer(tag.addr)
         
@@ -163,14 +207,14 @@ class Snapshot(object):
         snapstr += "\n" + self.mem.toString()
         return snapstr
         
-    def _loadObject(self, addr, fmt, objclass=None):
+    def _loadObject(self, addr, fmt):
         '''
-        Recursive function used to load contents of memory contained
-        in this L{Snapshot} into an instance of a corresponding 
-        L{ctypes} class. Uses the classes and information returned by 
-        the stored L{TypeManager} object type_manager to reconstruct
-        user types such as Structures and Unions and properly populate
-        their fields, even in the case of recursive structures.
+        Loads contents of memory contained in this L{Snapshot} into an
+        instance of a corresponding L{ctypes} class. Uses the loader
+        compiled for the type by the stored L{TypeManager} object
+        type_manager, which knows the layout of user types such as
+        Structures and Unions and properly populates their fields, even
+        in the case of recursive structures.
         
         @param addr: The address of the object to load
         @type addr: integer
@@ -178,57 +222,8 @@ class Snapshot(object):
         @param fmt: The format string corresponding to the type to load
         @type fmt: string
         
-        @param objclass: The corresponding L{ctypes} class for the fmt
-                         string as provided by the L{TypeManager}, if
-                         available
-        @type objclass: L{ctypes} class
-        
         @return: Instance of fmt's corresponding class loaded with value
                  from the specified memory address
         @rtype: L{ctypes} object
         '''
-        # Need the object class, so if its not given look it up
-        if objclass == None :
-            objclass = self.type_manager.getClass(fmt)
-        if issubclass(objclass, ctypes.Structure) :
-            # This is a structure, recursively populate each field
-            offset = 0
-            myinst = objclass()
-            for (fieldname, fieldclass) in objclass._fields_ :
-                # Get size and alignment information
-                fieldfmt = self.type_manager.getFormat(fieldclass)
-                (size, alignment) = self.type_manager.getInfo(fieldfmt)
-                # Move to correctly aligned address
-                offset = self.type_manager.align(offset, alignment)
-                # Load the object for this field
-                obj = self._loadObject(addr + offset, fieldfmt, fieldclass)
-                # Store the object as this field's value
-                setattr(myinst, fieldname, obj)
-                offset += size
-            return myinst
-        elif issubclass(objclass, ctypes.Union) :
-            # This is a Union, just load the largest field
-            myinst = objclass()
-            maxsize = 0
-            maxfieldname = None
-            maxfieldclass = None
-            maxfieldfmt = None
-            for (fieldname, fieldclass) in objclass._fields_ :
-                # Get the size information for this field's type
-                fieldfmt = self.type_manager.getFormat(fieldclass)
-                (size, _) = self.type_manager.getInfo(fieldfmt)
-                # Update the maximum-sized field entry
-                if size > maxsize :
-                    maxsize = size
-                    maxfieldname = fieldname
-                    maxfieldclass = fieldclass
-                    maxfieldfmt = fieldfmt
-            # Load the largest field's object
-            obj = self._loadObject(addr, maxfieldfmt, maxfieldclass)
-            # Store the object as that field's value
-            setattr(myinst, maxfieldname, obj)
-            return myinst
-        else :
-            # This is a standard ctype format, read the object directly
-            v = self.mem.read(addr, fmt=fmt)[0] 
-            return objclass(v)
+        return self.type_manager.getLoader(fmt)(self.mem, addr)
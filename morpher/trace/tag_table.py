@@ -0,0 +1,454 @@
+'''
+Contains the L{TagTable} class for storing a large number of L{Tag}s
+compactly
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 19, 2011
+'''
+import array
+import bisect
+import struct
+import tag
+
+class TagTable(object):
+    '''
+    Holds the L{Tag}s of a L{Snapshot} in a few arrays of numbers instead
+    of as one L{Tag} object each.
+
+    Tags are kept as runs: a start address, a format code and a count of
+    consecutive objects of that format starting at the address. The
+    format code indexes a small table of the format strings used, so
+    each distinct format is stored once. Adding a L{Tag} for the object
+    just after the end of the last run, with the same format, extends
+    that run instead of starting a new one, so a buffer tagged one byte
+    at a time - or added with L{add} and a count - takes a single run
+    rather than a L{Tag} per byte. User-defined formats have no size of
+    their own here, so their runs always hold one object.
+
+    Runs are kept in the order they were added, which is the order
+    iteration yields L{Tag}s in, so it stays the same from one run of
+    Morpher to the next and when the table is stored and reloaded.
+    Membership is checked by a binary search of a separate index for
+    each format, listing its runs sorted by start address along with the
+    furthest address reached by any run up to that point. A lookup only
+    looks back while that reach covers the address, so it touches the
+    run that could hold the address and no others - however long the
+    runs of this or any other format are.
+
+    Iterating creates a L{Tag} for each tagged object as it is needed;
+    L{runs} gives the runs themselves.
+
+    @note: Addresses are stored as unsigned longs, which are 32 bits on
+           Windows - enough for the 32-bit processes Morpher records
+
+    @ivar addrs: The start address of each run
+    @ivar codes: The format code of each run
+    @ivar counts: The number of objects in each run
+    @ivar fmts: The format strings, indexed by format code
+    @ivar sizes: The size of each format in bytes, or 0 for user types
+    @ivar lookup: Map of format strings to format codes
+    @ivar sortedaddrs: For each format code, the start addresses of its
+                       runs, sorted
+    @ivar sortedruns: For each format code, the position of each run in
+                      L{sortedaddrs}' order
+    @ivar reach: For each format code, the highest end address of the
+                 runs up to each position in L{sortedaddrs}' order
+    @ivar total: The number of tagged objects
+    '''
+
+    def __init__(self, tags=None):
+        '''
+        Creates a table holding the given L{Tag}s, if any
+
+        @param tags: L{Tag}s to add, in order
+        @type tags: L{Tag} object list
+        '''
+        self._clear()
+        for t in tags or [] :
+            self.add(t.addr, t.fmt)
+
+    def __getstate__(self):
+        '''
+        The I{pickle} system calls this method when dumping. Stores the
+        arrays as strings and drops the sorted index, which is rebuilt.
+
+        @return: The state to pickle
+        @rtype: dictionary
+        '''
+        return {"addrs" : self.addrs.tostring(), "codes" : self.codes.tostring(),
+                "counts" : self.counts.tostring(), "fmts" : self.fmts}
+
+    def __setstate__(self, state):
+        '''
+        Pickle calls this method when unpickling. Restores the arrays and
+        rebuilds everything derived from them.
+
+        @param state: The state returned by L{__getstate__}
+        @type state: dictionary
+        '''
+        self._clear()
+        for fmt in state["fmts"] :
+            self._code(fmt)
+        self.addrs.fromstring(state["addrs"])
+        self.codes.fromstring(state["codes"])
+        self.counts.fromstring(state["counts"])
+        self._reindex()
+
+    def __len__(self):
+        '''
+        Gives the number of tagged objects, counting each object in a run
+
+        @return: The number of objects
+        @rtype: integer
+        '''
+        return self.total
+
+    def __iter__(self):
+        '''
+        Yields a L{Tag} for every tagged object, in the order they were
+        added
+
+        @return: Iterator over the tags
+        @rtype: iterator
+        '''
+        for i in xrange(len(self.addrs)) :
+            (addr, code) = (self.addrs[i], self.codes[i])
+            (fmt, size) = (self.fmts[code], self.sizes[code])
+            for j in xrange(self.counts[i]) :
+                yield tag.Tag(addr + j*size, fmt)
+
+    def __contains__(self, t):
+        '''
+        Checks whether a L{Tag} is in the table
+
+        @param t: The tag to look for
+        @type t: L{Tag} object
+
+        @return: I{True} if the tag's object is tagged with its format
+        @rtype: boolean
+        '''
+        return self.contains(t.addr, t.fmt)
+
+    def __eq__(self, other):
+        '''
+        Compares this table to another, including the order of the runs
+
+        @param other: The table to compare to
+        @type other: L{TagTable} object
+
+        @return: I{True} if both hold the same runs in the same order
+        @rtype: boolean
+        '''
+        return isinstance(other, TagTable) and list(self.runs()) == list(other.runs())
+
+    def __ne__(self, other):
+        '''
+        Compares this table to another, as in L{__eq__}
+
+        @param other: The table to compare to
+        @type other: L{TagTable} object
+
+        @return: I{True} if the tables differ
+        @rtype: boolean
+        '''
+        return not self.__eq__(other)
+
+    def runs(self):
+        '''
+        Yields the runs of the table, in the order they were added
+
+        @return: Iterator over (start address, format, count) tuples
+        @rtype: iterator
+        '''
+        fmts = self.fmts
+        for i in xrange(len(self.addrs)) :
+            yield (self.addrs[i], fmts[self.codes[i]], self.counts[i])
+
+    def numRuns(self):
+        '''
+        Gives the number of runs in the table
+
+        @return: The number of runs
+        @rtype: integer
+        '''
+        return len(self.addrs)
+
+    def add(self, addr, fmt, count=1):
+        '''
+        Tags count consecutive objects of a format, starting at an address.
+        The objects must not already be tagged with the format.
+
+        @raise Exception: If a count is given for a user-defined format
+
+        @param addr: The address of the first object
+        @type addr: integer
+
+        @param fmt: The format string of the objects
+        @type fmt: string
+
+        @param count: The number of objects
+        @type count: integer
+        '''
+        code = self._code(fmt)
+        size = self.sizes[code]
+        if size == 0 :
+            # User types are tagged one at a time
+            if count != 1 :
+                raise Exception("Can't tag a run of user type %s" % fmt)
+            self._append(addr, code, 1)
+            return
+        last = len(self.addrs) - 1
+        if last >= 0 and self.codes[last] == code and \
+           self.addrs[last] + self.counts[last]*size == addr :
+            # Extend the last run
+            self.counts[last] += count
+            self.total += count
+            if self.sortedruns[code][-1] == last :
+                # Usually the highest run of its format - nothing follows
+                reach = self.reach[code]
+                reach[-1] = max(reach[-1], self.addrs[last] + self.counts[last]*size)
+            else :
+                self._extendReach(code, last)
+        else :
+            self._append(addr, code, count)
+
+    def contains(self, addr, fmt):
+        '''
+        Checks whether the object at an address is tagged with a format
+
+        @param addr: The address of the object
+        @type addr: integer
+
+        @param fmt: The format string of the object
+        @type fmt: string
+
+        @return: I{True} if the object is tagged
+        @rtype: boolean
+        '''
+        return self._find(addr, fmt) != None
+
+    def overlaps(self, addr, fmt, count):
+        '''
+        Checks whether any run of a format covers part of the bytes of
+        count consecutive objects of it starting at an address
+
+        @param addr: The address of the first object
+        @type addr: integer
+
+        @param fmt: The format string of the objects
+        @type fmt: string
+
+        @param count: The number of objects
+        @type count: integer
+
+        @return: I{True} if any of the bytes are covered
+        @rtype: boolean
+        '''
+        code = self.lookup.get(fmt)
+        if code == None :
+            return False
+        end = addr + count*(self.sizes[code] or 1)
+        # Any run starting before the end that reaches past the start
+        pos = bisect.bisect_left(self.sortedaddrs[code], end) - 1
+        return pos >= 0 and self.reach[code][pos] > addr
+
+    def remove(self, addr, fmt):
+        '''
+        Removes the tag of the object at an address, splitting its run if
+        the object is in the middle of one.
+
+        @raise KeyError: If the object isn't tagged with the format
+
+        @param addr: The address of the object
+        @type addr: integer
+
+        @param fmt: The format string of the object
+        @type fmt: string
+        '''
+        run = self._find(addr, fmt)
+        if run == None :
+            raise KeyError((addr, fmt))
+        start = self.addrs[run]
+        count = self.counts[run]
+        size = self.sizes[self.codes[run]] or 1
+        before = (addr - start) // size
+        after = count - before - 1
+        if after > 0 :
+            # The objects after the removed one become a run of their own
+            self.addrs.insert(run + 1, addr + size)
+            self.codes.insert(run + 1, self.codes[run])
+            self.counts.insert(run + 1, after)
+        if before > 0 :
+            self.counts[run] = before
+        else :
+            del self.addrs[run]
+            del self.codes[run]
+            del self.counts[run]
+        self.total -= 1
+        self._reindex()
+
+    def _clear(self):
+        '''
+        Empties the table
+        '''
+        self.addrs = array.array("L")
+        self.codes = array.array("H")
+        self.counts = array.array("L")
+        self.fmts = []
+        self.sizes = []
+        self.lookup = {}
+        self.sortedaddrs = []
+        self.sortedruns = []
+        self.reach = []
+        self.total = 0
+
+    def _code(self, fmt):
+        '''
+        Gives the code for a format, adding it to the format table the
+        first time it is seen
+
+        @param fmt: The format string
+        @type fmt: string
+
+        @return: The format code
+        @rtype: integer
+        '''
+        code = self.lookup.get(fmt)
+        if code == None :
+            fmt = intern(str(fmt))
+            code = len(self.fmts)
+            self.fmts.append(fmt)
+            self.sizes.append(0 if fmt.isdigit() else struct.calcsize(fmt))
+            self.lookup[fmt] = code
+            self.sortedaddrs.append(array.array("L"))
+            self.sortedruns.append(array.array("L"))
+            self.reach.append(array.array("L"))
+        return code
+
+    def _append(self, addr, code, count):
+        '''
+        Adds a new run at the end of the table
+
+        @param addr: The address of the first object
+        @type addr: integer
+
+        @param code: The format code of the objects
+        @type code: integer
+
+        @param count: The number of objects
+        @type count: integer
+        '''
+        run = len(self.addrs)
+        self.addrs.append(addr)
+        self.codes.append(code)
+        self.counts.append(count)
+        pos = bisect.bisect_right(self.sortedaddrs[code], addr)
+        self.sortedaddrs[code].insert(pos, addr)
+        self.sortedruns[code].insert(pos, run)
+        self.reach[code].insert(pos, 0)
+        self.total += count
+        self._updateReach(code, pos)
+
+    def _reindex(self):
+        '''
+        Rebuilds the sorted index of runs and the counts derived from them
+        '''
+        order = sorted(xrange(len(self.addrs)), key=self.addrs.__getitem__)
+        for code in xrange(len(self.fmts)) :
+            self.sortedaddrs[code] = array.array("L")
+            self.sortedruns[code] = array.array("L")
+            self.reach[code] = array.array("L")
+        for run in order :
+            code = self.codes[run]
+            self.sortedaddrs[code].append(self.addrs[run])
+            self.sortedruns[code].append(run)
+            self.reach[code].append(0)
+        for code in xrange(len(self.fmts)) :
+            for pos in xrange(len(self.reach[code])) :
+                self.reach[code][pos] = max(self._end(self.sortedruns[code][pos]),
+                                            self.reach[code][pos - 1] if pos else 0)
+        self.total = sum(self.counts)
+
+    def _end(self, run):
+        '''
+        Gives the address just past the last object of a run
+
+        @param run: The position of the run
+        @type run: integer
+
+        @return: The end address of the run
+        @rtype: integer
+        '''
+        return self.addrs[run] + self.counts[run]*(self.sizes[self.codes[run]] or 1)
+
+    def _updateReach(self, code, pos):
+        '''
+        Recomputes the reach of a format's index from a position onwards,
+        after the run at that position was added or grew, stopping as
+        soon as a reach is unchanged
+
+        @param code: The format code
+        @type code: integer
+
+        @param pos: The position in the format's sorted index
+        @type pos: integer
+        '''
+        reach = self.reach[code]
+        runs = self.sortedruns[code]
+        prev = reach[pos - 1] if pos else 0
+        reach[pos] = max(prev, self._end(runs[pos]))
+        for i in xrange(pos + 1, len(reach)) :
+            new = max(reach[i - 1], self._end(runs[i]))
+            if new == reach[i] :
+                break
+            reach[i] = new
+
+    def _extendReach(self, code, run):
+        '''
+        Updates the reach of a format's index after a run grew
+
+        @param code: The format code of the run
+        @type code: integer
+
+        @param run: The position of the run
+        @type run: integer
+        '''
+        runs = self.sortedruns[code]
+        pos = bisect.bisect_left(self.sortedaddrs[code], self.addrs[run])
+        while runs[pos] != run :
+            pos += 1
+        self._updateReach(code, pos)
+
+    def _find(self, addr, fmt):
+        '''
+        Finds the run holding the tag of the object at an address
+
+        @param addr: The address of the object
+        @type addr: integer
+
+        @param fmt: The format string of the object
+        @type fmt: string
+
+        @return: The position of the run, or I{None} if it isn't tagged
+        @rtype: integer
+        '''
+        code = self.lookup.get(fmt)
+        if code == None :
+            return None
+        size = self.sizes[code]
+        sortedaddrs = self.sortedaddrs[code]
+        reach = self.reach[code]
+        pos = bisect.bisect_right(sortedaddrs, addr) - 1
+        # No run before the first one not reaching addr can hold it
+        while pos >= 0 and reach[pos] > addr :
+            run = self.sortedruns[code][pos]
+            start = sortedaddrs[pos]
+            if start == addr :
+                return run
+            if size and addr < start + self.counts[run]*size and \
+               (addr - start) % size == 0 :
+                return run
+            pos -= 1
+        return None
@@ -7,6 +7,7 @@ Contains the L{Trace} class definition for storing a list of L{Snapshot}s
 @since: November 13, 2011
 '''
 from morpher.trace import typemanager
+import copy
 
 class Trace(object):
     '''
@@ -57,6 +58,60 @@ class Trace(object):
         for s in self.snapshots:
             yield (s.name, s.replay(self.type_manager))
             
+    def toArena(self):
+        '''
+        Switches the L{Memory} of every L{Snapshot} to arena mode, so each
+        L{Snapshot}'s captured memory is held in one contiguous buffer.
+        '''
+        for s in self.snapshots :
+            s.mem.toArena()
+            
+    def truncated(self, count):
+        '''
+        Returns a L{Trace} holding only the first count L{Snapshot}s of 
+        this one, or this L{Trace} itself if it is no longer than that.
+        The L{Snapshot}s and L{TypeManager} are shared, not copied.
+        
+        @param count: The number of L{Snapshot}s to keep
+        @type count: integer
+        
+        @return: The shortened trace
+        @rtype: L{Trace} object
+        '''
+        if count >= len(self.snapshots) :
+            return self
+        short = copy.copy(self)
+        short.snapshots = self.snapshots[:count]
+        return short
+            
+    def applyPatches(self, patches):
+        '''
+        Overwrites bytes in this L{Trace}'s L{Snapshot}s according to a 
+        list of patches, and returns a list of patches that undoes the 
+        change.
+        
+        Each patch is a (snapshot index, address, bytes) tuple, meaning 
+        the given bytes are written at the given address of the indexed
+        L{Snapshot}'s memory. This is how a fuzzed variant of a L{Trace}
+        (see L{Overlay}) is applied to a copy of it in another process.
+        The returned undo list is in the same form, so passing it back to
+        L{applyPatches} restores the original bytes.
+        
+        @param patches: The changes to make
+        @type patches: (integer, integer, byte string) tuple list
+        
+        @return: Patches that restore the bytes that were overwritten
+        @rtype: (integer, integer, byte string) tuple list
+        '''
+        undo = []
+        for (index, addr, data) in patches :
+            mem = self.snapshots[index].mem
+            undo.append((index, addr, mem.read(addr, len(data))))
+            mem.write(addr, data)
+        # Undo in reverse order in case two patches overlap
+        undo.reverse()
+        return undo
+            
     def toString(self):
         '''
         Creates a pretty-printed string containing the contents of this
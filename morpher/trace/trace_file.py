@@ -0,0 +1,449 @@
+'''
+Contains the L{TraceFile} class and helper functions for storing L{Trace}s
+in Morpher's binary trace file format
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 17, 2011
+'''
+import os
+import mmap
+import json
+import pickle
+import struct
+import hashlib
+import trace
+import snapshot
+import tag
+
+# Identifies a trace file, and the version of the layout it uses
+MAGIC = "MTRC"
+VERSION = 3
+
+# Header flag: block offsets are into a separate buffer, such as a store
+FLAG_EXTERNAL = 1
+
+# magic, version, flags, snapshot count, usertypes offset and length
+HEADER = struct.Struct("<4sHHIQI")
+# offset and length of a snapshot's record, one per snapshot
+INDEX = struct.Struct("<QQ")
+# name length, format table length, tag run, argument, pointer and block counts
+SNAPHEAD = struct.Struct("<IIIIII")
+# address and format number of an argument, or of a tag before version 3
+TAGENTRY = struct.Struct("<QI")
+# start address, format number and object count of a run of tags
+RUNENTRY = struct.Struct("<QII")
+# address of a registered pointer
+POINTER = struct.Struct("<Q")
+# address, size and file offset of a block's contents
+BLOCKENTRY = struct.Struct("<QQQ")
+
+class TraceFile(object):
+    '''
+    Reads L{Trace}s stored in the binary trace file format, one
+    L{Snapshot} at a time if need be.
+
+    A trace file starts with a fixed header and an index giving the
+    offset and length of each L{Snapshot}'s record, followed by the
+    usertypes of the L{Trace}'s L{TypeManager} as JSON. Each record
+    holds the L{Snapshot}'s function name, a table of the format strings
+    it uses, the runs of its L{TagTable} as (address, format number,
+    count) entries, its argument L{Tag}s as (address, format number)
+    entries, its registered pointers, and the address, size and file
+    offset of each of its memory blocks; the raw contents of the blocks
+    follow the record at those offsets. All numbers are little-endian.
+
+    Blocks are stored by content: a block with the same bytes as one
+    stored earlier in the file points at the earlier copy instead of
+    adding its own, and when loading, every block at the same offset
+    shares one string as a L{SharedBlock}, only copied once it is
+    written to. A trace file with the L{FLAG_EXTERNAL} flag keeps no
+    block contents at all - its offsets are into a separate buffer
+    holding blocks shared between many L{Trace}s, given when it is
+    opened (see L{TraceStore}).
+
+    Since everything is found through the index, a L{TraceFile} over a
+    memory-mapped file (see L{mapFile}) only reads the parts of the file
+    it needs, and loading a L{Snapshot} doesn't touch the others. Unlike
+    a pickled L{Trace}, reading a trace file never runs code stored in it.
+    Files written by the old pickle-based format can be converted with
+    L{convert}.
+
+    @ivar data: The contents of the file, as a string or memory map
+    @ivar blockdata: The buffer holding the contents of the blocks
+    @ivar cache: Map of block offsets to the strings already loaded
+    @ivar version: The version of the layout the file uses
+    @ivar count: The number of L{Snapshot}s in the file
+    @ivar usertypes: The usertypes of the stored L{Trace}
+    '''
+
+    def __init__(self, data, blockdata=None, cache=None):
+        '''
+        Reads the header and usertypes of a trace file's contents.
+
+        @raise Exception: If the data isn't a trace file this version can
+                          read, or its blocks are external and no buffer
+                          is given
+
+        @param data: The contents of the file
+        @type data: string or L{mmap}
+
+        @param blockdata: The buffer holding the blocks of a file with the
+                          L{FLAG_EXTERNAL} flag
+        @type blockdata: string or L{mmap}
+
+        @param cache: Map of block offsets to loaded strings to share
+                      with other L{TraceFile}s over the same blocks
+        @type cache: dictionary
+        '''
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC :
+            raise Exception("Not a Morpher trace file")
+        (_, version, flags, count, typesoffset, typeslength) = HEADER.unpack_from(data, 0)
+        if version > VERSION :
+            raise Exception("Unsupported trace file version %d" % version)
+        if flags & FLAG_EXTERNAL :
+            if blockdata == None :
+                raise Exception("Trace file's blocks are stored separately")
+        else :
+            blockdata = data
+        self.data = data
+        self.version = version
+        self.blockdata = blockdata
+        self.cache = {} if cache == None else cache
+        self.count = count
+        self.usertypes = {}
+        types = json.loads(data[typesoffset:typesoffset + typeslength])
+        for (fmt, (usertype, userparams)) in types.items() :
+            self.usertypes[fmt] = (usertype, userparams)
+
+    def __len__(self):
+        '''
+        Gives the number of L{Snapshot}s in the file
+
+        @return: The number of L{Snapshot}s
+        @rtype: integer
+        '''
+        return self.count
+
+    def loadSnapshot(self, index):
+        '''
+        Loads a single L{Snapshot} from the file
+
+        @raise Exception: If there is no such L{Snapshot}
+
+        @param index: The position of the L{Snapshot} in the L{Trace}
+        @type index: integer
+
+        @return: The stored snapshot
+        @rtype: L{Snapshot} object
+        '''
+        (name, runs, args, pointers, blocks) = self._readRecord(index)
+        snap = snapshot.Snapshot(name, [])
+        cache = self.cache
+        for (addr, size, offset) in blocks :
+            data = cache.get(offset)
+            if data == None or len(data) != size :
+                data = self.blockdata[offset:offset + size]
+                cache[offset] = data
+            snap.mem.addBlock(addr, data, shared=True)
+        # The tags were checked when they were first added
+        for (addr, fmt, count) in runs :
+            snap.tags.add(addr, fmt, count)
+        snap.setArgs(args)
+        snap.mem.pointers = set(pointers)
+        return snap
+
+    def listBlocks(self, index):
+        '''
+        Lists where the blocks of a L{Snapshot} are stored, without loading
+        them
+
+        @raise Exception: If there is no such L{Snapshot}
+
+        @param index: The position of the L{Snapshot} in the L{Trace}
+        @type index: integer
+
+        @return: (address, size, offset) of each block
+        @rtype: (integer, integer, integer) tuple list
+        '''
+        return self._readRecord(index)[4]
+
+    def _readRecord(self, index):
+        '''
+        Reads the record for a L{Snapshot}
+
+        @raise Exception: If there is no such L{Snapshot}
+
+        @param index: The position of the L{Snapshot} in the L{Trace}
+        @type index: integer
+
+        @return: The function name, (address, format, count) tag runs,
+                 argument L{Tag}s, pointer addresses and (address, size, 
+                 offset) of each block
+        @rtype: tuple
+        '''
+        if index < 0 or index >= self.count :
+            raise Exception("Trace file has no snapshot %d" % index)
+        data = self.data
+        (offset, _) = INDEX.unpack_from(data, HEADER.size + index * INDEX.size)
+        (namelen, fmtslen, numtags, numargs, numpointers, numblocks) = \
+            SNAPHEAD.unpack_from(data, offset)
+        offset += SNAPHEAD.size
+        name = data[offset:offset + namelen]
+        offset += namelen
+        fmts = data[offset:offset + fmtslen].split("\0")
+        offset += fmtslen
+
+        runs = []
+        for _ in xrange(numtags) :
+            if self.version < 3 :
+                (addr, fmt) = TAGENTRY.unpack_from(data, offset)
+                runs.append((addr, fmts[fmt], 1))
+                offset += TAGENTRY.size
+            else :
+                (addr, fmt, count) = RUNENTRY.unpack_from(data, offset)
+                runs.append((addr, fmts[fmt], count))
+                offset += RUNENTRY.size
+        args = []
+        for _ in xrange(numargs) :
+            (addr, fmt) = TAGENTRY.unpack_from(data, offset)
+            args.append(tag.Tag(addr, fmts[fmt]))
+            offset += TAGENTRY.size
+        pointers = []
+        for _ in xrange(numpointers) :
+            pointers.append(POINTER.unpack_from(data, offset)[0])
+            offset += POINTER.size
+        blocks = []
+        for _ in xrange(numblocks) :
+            blocks.append(BLOCKENTRY.unpack_from(data, offset))
+            offset += BLOCKENTRY.size
+        return (name, runs, args, pointers, blocks)
+
+    def loadTrace(self):
+        '''
+        Loads the whole L{Trace} stored in the file
+
+        @return: The stored trace
+        @rtype: L{Trace} object
+        '''
+        snaps = [self.loadSnapshot(i) for i in xrange(self.count)]
+        return trace.Trace(snaps, self.usertypes)
+
+    def close(self):
+        '''
+        Releases the file's contents, closing the memory map if there is one
+        '''
+        if isinstance(self.data, mmap.mmap) :
+            self.data.close()
+        self.data = None
+        self.blockdata = None
+        self.cache = {}
+
+def dumps(mytrace, addBlock=None):
+    '''
+    Stores a L{Trace} in the binary trace file format
+
+    @param mytrace: The trace to store
+    @type mytrace: L{Trace} object
+
+    @param addBlock: Stores the contents of a block elsewhere and gives
+                     its offset there, to write a file with the
+                     L{FLAG_EXTERNAL} flag; by default the blocks are kept
+                     in the file
+    @type addBlock: function taking a string and returning an integer
+
+    @return: The contents of the trace file
+    @rtype: string
+    '''
+    types = json.dumps(mytrace.type_manager.usertypes, sort_keys=True)
+    count = len(mytrace.snapshots)
+    offset = HEADER.size + count * INDEX.size
+    flags = 0 if addBlock == None else FLAG_EXTERNAL
+    parts = [HEADER.pack(MAGIC, VERSION, flags, count, offset, len(types)), None, types]
+    offset += len(types)
+    index = []
+    # Offsets of the blocks already stored, by hash of their contents
+    stored = {}
+    for snap in mytrace.snapshots :
+        record = _dumpSnapshot(snap, offset, addBlock, stored)
+        index.append(INDEX.pack(offset, len(record)))
+        parts.append(record)
+        offset += len(record)
+    parts[1] = "".join(index)
+    return "".join(parts)
+
+def loads(data):
+    '''
+    Loads the L{Trace} stored in the contents of a trace file
+
+    @raise Exception: If the data isn't a trace file
+
+    @param data: The contents of the file
+    @type data: string
+
+    @return: The stored trace
+    @rtype: L{Trace} object
+    '''
+    return TraceFile(data).loadTrace()
+
+def save(mytrace, path):
+    '''
+    Writes a L{Trace} to a trace file
+
+    @param mytrace: The trace to store
+    @type mytrace: L{Trace} object
+
+    @param path: The path of the file to write
+    @type path: string
+    '''
+    f = open(path, "wb")
+    f.write(dumps(mytrace))
+    f.close()
+
+def mapFile(path):
+    '''
+    Opens a trace file as a L{TraceFile} over a read-only memory map of
+    it, so L{Snapshot}s are only read from disk as they are loaded. The
+    L{TraceFile} should be closed once it is no longer needed.
+
+    @raise Exception: If the file isn't a trace file
+
+    @param path: The path of the trace file
+    @type path: string
+
+    @return: The opened file
+    @rtype: L{TraceFile} object
+    '''
+    f = open(path, "rb")
+    try :
+        if os.path.getsize(path) < HEADER.size :
+            raise Exception("Not a Morpher trace file: %s" % path)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally :
+        f.close()
+    try :
+        return TraceFile(data)
+    except :
+        data.close()
+        raise
+
+def load(path):
+    '''
+    Loads the whole L{Trace} stored in a trace file
+
+    @raise Exception: If the file isn't a trace file
+
+    @param path: The path of the trace file
+    @type path: string
+
+    @return: The stored trace
+    @rtype: L{Trace} object
+    '''
+    tracefile = mapFile(path)
+    try :
+        return tracefile.loadTrace()
+    finally :
+        tracefile.close()
+
+def isTraceFile(path):
+    '''
+    Checks whether a file starts like a trace file
+
+    @param path: The path of the file
+    @type path: string
+
+    @return: I{True} if the file is in the binary trace file format
+    @rtype: boolean
+    '''
+    f = open(path, "rb")
+    start = f.read(len(MAGIC))
+    f.close()
+    return start == MAGIC
+
+def convert(path):
+    '''
+    Converts a L{Trace} pickled by older versions of Morpher (a .pkl file)
+    to a trace file with the same name ending in .trc, and removes the
+    pickle.
+
+    @warning: Unpickling runs code stored in the file - only convert
+              files from a trusted source
+
+    @param path: The path of the pickled trace
+    @type path: string
+
+    @return: The path of the new trace file
+    @rtype: string
+    '''
+    f = open(path, "rb")
+    mytrace = pickle.load(f)
+    f.close()
+    newpath = os.path.splitext(path)[0] + ".trc"
+    save(mytrace, newpath)
+    os.remove(path)
+    return newpath
+
+def _dumpSnapshot(snap, offset, addBlock, stored):
+    '''
+    Builds the record for a L{Snapshot}, followed by the contents of its
+    blocks that aren't stored yet
+
+    @param snap: The snapshot to store
+    @type snap: L{Snapshot} object
+
+    @param offset: The position of the record in the file
+    @type offset: integer
+
+    @param addBlock: Stores a block's contents elsewhere, or I{None}
+    @type addBlock: function
+
+    @param stored: Offsets of the blocks already in the file, by hash
+    @type stored: dictionary
+
+    @return: The record
+    @rtype: string
+    '''
+    mem = snap.mem
+    runs = list(snap.tags.runs())
+    # Every distinct format string is stored once
+    fmts = []
+    numbers = {}
+    for fmt in [fmt for (_, fmt, _) in runs] + [t.fmt for t in snap.args] :
+        if fmt not in numbers :
+            numbers[fmt] = len(fmts)
+            fmts.append(str(fmt))
+    name = str(snap.name)
+    fmtstr = "\0".join(fmts)
+    pointers = sorted(mem.pointers)
+    blocks = [mem.mem[addr] for addr in mem.starts]
+
+    # The block contents start after the record, 8-byte aligned
+    size = SNAPHEAD.size + len(name) + len(fmtstr) + len(runs) * RUNENTRY.size + \
+           len(snap.args) * TAGENTRY.size + len(pointers) * POINTER.size + \
+           len(blocks) * BLOCKENTRY.size
+    padding = -(offset + size) % 8
+    dataoffset = offset + size + padding
+
+    parts = [SNAPHEAD.pack(len(name), len(fmtstr), len(runs), len(snap.args), \
+                           len(pointers), len(blocks)), name, fmtstr]
+    for (addr, fmt, count) in runs :
+        parts.append(RUNENTRY.pack(addr, numbers[fmt], count))
+    for t in snap.args :
+        parts.append(TAGENTRY.pack(t.addr, numbers[t.fmt]))
+    for addr in pointers :
+        parts.append(POINTER.pack(addr))
+    contents = []
+    for b in blocks :
+        data = b.read(b.addr, b.size)
+        if addBlock != None :
+            parts.append(BLOCKENTRY.pack(b.addr, b.size, addBlock(data)))
+            continue
+        digest = hashlib.sha1(data).digest()
+        if digest not in stored :
+            stored[digest] = dataoffset
+            contents.append(data)
+            dataoffset += b.size
+        parts.append(BLOCKENTRY.pack(b.addr, b.size, stored[digest]))
+    parts.append("\0" * padding)
+    return "".join(parts + contents)
@@ -0,0 +1,469 @@
+'''
+Contains the L{TraceStore} class for keeping a whole collection of
+L{Trace}s in a single append-only file
+
+@author: Rob Waaser
+@contact: robwaaser@gmail.com
+@organization: Carnegie Mellon University
+@since: December 18, 2011
+'''
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+import logging
+import manifest
+import trace_file
+
+# magic, CRC-32 of the contents and their length, before each record
+RECORD = struct.Struct("<4sIQ")
+# Magic numbers for trace file and block records
+RECORD_MAGIC = "MREC"
+BLOCK_MAGIC = "MBLK"
+# data offset, length and CRC-32 of a trace file, its snapshots and tags
+ENTRY = struct.Struct("<QQIII")
+# SHA-1 hash, data offset and length of a block's contents
+BLOCKENTRY = struct.Struct("<20sQQ")
+
+class TraceStore(object):
+    '''
+    A collection of L{Trace}s kept in one data file and two index files,
+    which are only ever appended to.
+
+    The data file ("traces.dat") holds each L{Trace} in the format of the
+    L{trace_file} module, preceded by a short record header with a magic
+    number, its length and its CRC-32. The contents of the L{Trace}s'
+    memory blocks are stored separately in the same file, in block
+    records, once for each distinct set of bytes: blocks are found by the
+    SHA-1 hash of their contents through the block index ("blocks.idx"),
+    and a block already in the store is referred to rather than stored
+    again, whether it was captured by another L{Snapshot} of the same
+    L{Trace} or by another L{Trace}. When a L{Trace} is loaded, its blocks
+    are L{SharedBlock}s over one string per stored block, only copied
+    once they are written to. L{getStats} reports how much this saves.
+
+    The trace index file ("traces.idx") has one fixed-size entry per
+    L{Trace}, in the order they were added, giving where its trace file
+    starts in the data file, its length and CRC-32, and how many
+    L{Snapshot}s and L{Tag}s it has. A L{Trace}'s id is its position in
+    the index, so any L{Trace} can be found without scanning, and the
+    number of L{Tag}s in the whole collection is known without loading
+    any of them.
+
+    Adding a L{Trace} writes and syncs its new blocks and its record to
+    the data file before their index entries are written and synced, so a
+    L{Trace} is only listed once its contents are safely stored, and a
+    block entry past the last listed L{Trace} is ignored. If a collection
+    is interrupted the worst left behind is a partial record or index
+    entry at the end of a file, which is ignored when the store is read
+    and cut off the next time a L{Trace} is added; the entries before it
+    are never touched. If the index is lost, it is rebuilt from the
+    record headers in the data file (see L{rebuildIndex}).
+
+    L{Trace}s are read through a memory map of the data file, so only
+    the L{Trace}s actually loaded are read from disk.
+
+    @ivar log: The L{logging} object
+    @ivar dirpath: The directory holding the store's files
+    @ivar datapath: The path to the data file
+    @ivar indexpath: The path to the trace index file
+    @ivar blockpath: The path to the block index file
+    @ivar entries: The index, as (offset, length, crc, snapshots, tags) tuples
+    @ivar blocks: Map of block hashes to their (offset, length), or I{None}
+                  until a L{Trace} is added
+    @ivar pending: Block records waiting to be written by L{append}, as
+                   (hash, offset, length, record) tuples
+    @ivar datasize: The length of the data file covered by the index
+    @ivar data: Memory map of the data file, or I{None} until needed
+    '''
+
+    def __init__(self, dirpath):
+        '''
+        Opens the store in the given directory, reading its index. A
+        directory without a store holds an empty one, whose files are
+        created when the first L{Trace} is added.
+
+        @param dirpath: The directory holding the store's files
+        @type dirpath: string
+        '''
+        self.log = logging.getLogger(__name__)
+        self.dirpath = dirpath
+        self.datapath = os.path.join(dirpath, "traces.dat")
+        self.indexpath = os.path.join(dirpath, "traces.idx")
+        self.blockpath = os.path.join(dirpath, "blocks.idx")
+        self.entries = []
+        self.blocks = None
+        self.pending = []
+        self.datasize = 0
+        self.data = None
+        self.readIndex()
+
+    def __len__(self):
+        '''
+        Gives the number of L{Trace}s in the store
+
+        @return: The number of L{Trace}s
+        @rtype: integer
+        '''
+        return len(self.entries)
+
+    def __iter__(self):
+        '''
+        Loads each L{Trace} in the store in turn, in the order they were
+        added.
+
+        @return: Iterator over the stored traces
+        @rtype: iterator
+        '''
+        for i in xrange(len(self.entries)) :
+            yield self.loadTrace(i)
+
+    def readIndex(self):
+        '''
+        Reads the index file, ignoring a partial entry at its end and any
+        entry whose record doesn't fit in the data file. If there is a
+        data file but no index, the index is rebuilt.
+        '''
+        self.close()
+        self.entries = []
+        self.blocks = None
+        self.datasize = 0
+        if not os.path.isfile(self.indexpath) :
+            if os.path.isfile(self.datapath) and os.path.getsize(self.datapath) :
+                self.log.warning("Trace store index %s is missing", self.indexpath)
+                self.rebuildIndex()
+            return
+        f = open(self.indexpath, "rb")
+        index = f.read()
+        f.close()
+        datalen = 0
+        if os.path.isfile(self.datapath) :
+            datalen = os.path.getsize(self.datapath)
+        for pos in xrange(0, len(index) - ENTRY.size + 1, ENTRY.size) :
+            entry = ENTRY.unpack_from(index, pos)
+            (offset, length) = entry[:2]
+            if offset + length > datalen :
+                self.log.warning("Trace store entry %d is past the end of the data file",
+                                 len(self.entries))
+                break
+            self.entries.append(entry)
+            self.datasize = offset + length
+        if len(index) % ENTRY.size :
+            self.log.warning("Ignoring a partial entry at the end of %s", self.indexpath)
+
+    def rebuildIndex(self):
+        '''
+        Recreates the trace and block indexes by reading the record headers
+        in the data file, stopping at the first record that is incomplete
+        or damaged, then writes them out.
+        '''
+        self.log.info("Rebuilding trace store index for %s", self.dirpath)
+        self.close()
+        self.entries = []
+        self.datasize = 0
+        blocks = []
+        if os.path.isfile(self.datapath) and os.path.getsize(self.datapath) :
+            self._map()
+            data = self.data
+            pos = 0
+            while pos + RECORD.size <= len(data) :
+                (magic, crc, length) = RECORD.unpack_from(data, pos)
+                start = pos + RECORD.size
+                if magic not in (RECORD_MAGIC, BLOCK_MAGIC) or start + length > len(data) :
+                    break
+                contents = data[start:start + length]
+                if zlib.crc32(contents) & 0xffffffff != crc :
+                    break
+                if magic == BLOCK_MAGIC :
+                    blocks.append((hashlib.sha1(contents).digest(), start, length))
+                else :
+                    mytrace = trace_file.TraceFile(contents, data).loadTrace()
+                    self.entries.append(self._entry(start, contents, mytrace))
+                    self.datasize = start + length
+                pos = start + length
+            self.close()
+        # Blocks after the last trace belong to an unfinished append
+        blocks = [b for b in blocks if b[1] + b[2] <= self.datasize]
+        self.blocks = dict([(digest, (offset, length)) for (digest, offset, length) in blocks])
+        f = open(self.indexpath, "wb")
+        f.write("".join([ENTRY.pack(*e) for e in self.entries]))
+        f.close()
+        f = open(self.blockpath, "wb")
+        f.write("".join([BLOCKENTRY.pack(*b) for b in blocks]))
+        f.close()
+
+    def clear(self):
+        '''
+        Empties the store, removing its files
+        '''
+        self.close()
+        for path in [self.indexpath, self.blockpath, self.datapath] :
+            if os.path.isfile(path) :
+                os.remove(path)
+        self.entries = []
+        self.blocks = None
+        self.datasize = 0
+
+    def append(self, mytrace):
+        '''
+        Adds a L{Trace} to the end of the store, along with any of its
+        blocks that aren't stored yet. The L{Trace} is safely on disk when
+        this returns.
+
+        @param mytrace: The trace to add
+        @type mytrace: L{Trace} object
+
+        @return: The id of the new L{Trace}
+        @rtype: integer
+        '''
+        self._readBlocks()
+        numblocks = len(self.blocks)
+        self.pending = []
+        try :
+            contents = trace_file.dumps(mytrace, self._addBlock)
+            crc = zlib.crc32(contents) & 0xffffffff
+            # Cut off anything left by an interrupted append
+            mode = "r+b" if os.path.isfile(self.datapath) else "wb"
+            f = open(self.datapath, mode)
+            f.truncate(self.datasize)
+            f.seek(self.datasize)
+            for (_, _, _, record) in self.pending :
+                f.write(record)
+            offset = f.tell() + RECORD.size
+            f.write(RECORD.pack(RECORD_MAGIC, crc, len(contents)))
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+            newblocks = [BLOCKENTRY.pack(digest, blkoffset, length) \
+                         for (digest, blkoffset, length, _) in self.pending]
+            self._appendIndex(self.blockpath, numblocks * BLOCKENTRY.size, newblocks)
+            entry = self._entry(offset, contents, mytrace)
+            self._appendIndex(self.indexpath, len(self.entries) * ENTRY.size, \
+                              [ENTRY.pack(*entry)])
+        except :
+            # The new blocks aren't part of the store until the trace is
+            self.blocks = None
+            raise
+        finally :
+            self.pending = []
+        self.entries.append(entry)
+        self.datasize = offset + len(contents)
+        return len(self.entries) - 1
+
+    def openTrace(self, traceid, cache=None):
+        '''
+        Opens a stored L{Trace} as a L{TraceFile}, so its L{Snapshot}s can
+        be loaded one at a time
+
+        @raise Exception: If there is no such L{Trace} or it is damaged
+
+        @param traceid: The id of the L{Trace}
+        @type traceid: integer
+
+        @param cache: Map of block offsets to loaded strings, to share
+                      blocks with other L{Trace}s loaded with the same map;
+                      by default blocks are only shared within the L{Trace}
+        @type cache: dictionary
+
+        @return: The stored trace file
+        @rtype: L{TraceFile} object
+        '''
+        if traceid < 0 or traceid >= len(self.entries) :
+            raise Exception("Trace store has no trace %d" % traceid)
+        (offset, length, crc, _, _) = self.entries[traceid]
+        if self.data == None or len(self.data) < offset + length :
+            self._map()
+        contents = self.data[offset:offset + length]
+        if zlib.crc32(contents) & 0xffffffff != crc :
+            raise Exception("Trace %d in %s is damaged" % (traceid, self.datapath))
+        return trace_file.TraceFile(contents, self.data, cache)
+
+    def loadTrace(self, traceid, cache=None):
+        '''
+        Loads a stored L{Trace}
+
+        @raise Exception: If there is no such L{Trace} or it is damaged
+
+        @param traceid: The id of the L{Trace}
+        @type traceid: integer
+
+        @param cache: Map of block offsets to loaded strings, as for
+                      L{openTrace}
+        @type cache: dictionary
+
+        @return: The stored trace
+        @rtype: L{Trace} object
+        '''
+        return self.openTrace(traceid, cache).loadTrace()
+
+    def countTags(self):
+        '''
+        Adds up the number of L{Tag}s across every stored L{Trace}
+
+        @return: The total number of L{Tag}s
+        @rtype: integer
+        '''
+        return sum([e[4] for e in self.entries])
+
+    def getStats(self):
+        '''
+        Works out how much space storing blocks by content saves. The
+        logical size is what the blocks of every L{Snapshot} would take
+        if each were stored separately, as in a pickled L{Trace}; the
+        stored size is what the distinct blocks take in the data file;
+        the loaded size is the memory taken by the blocks of all the
+        L{Trace}s when each is loaded on its own, sharing blocks between
+        its L{Snapshot}s.
+
+        @return: Dictionary with the number of "traces", "snapshots" and
+                 "blocks", the "logical", "stored" and "loaded" sizes of 
+                 the blocks in bytes, the "ratio" of logical to stored 
+                 size and the size of the data file ("datasize")
+        @rtype: dictionary
+        '''
+        self._readBlocks()
+        stats = {"traces" : len(self.entries), "snapshots" : 0, "blocks" : 0,
+                 "logical" : 0, "loaded" : 0, "datasize" : self.datasize}
+        for traceid in xrange(len(self.entries)) :
+            tracefile = self.openTrace(traceid)
+            seen = set()
+            for index in xrange(len(tracefile)) :
+                for (_, size, offset) in tracefile.listBlocks(index) :
+                    stats["blocks"] += 1
+                    stats["logical"] += size
+                    if offset not in seen :
+                        seen.add(offset)
+                        stats["loaded"] += size
+            stats["snapshots"] += len(tracefile)
+        stats["stored"] = sum([length for (_, length) in self.blocks.values()])
+        stats["ratio"] = 1.0
+        if stats["stored"] :
+            stats["ratio"] = float(stats["logical"]) / stats["stored"]
+        return stats
+
+    def importFiles(self, tracedir):
+        '''
+        Adds the L{Trace}s stored as separate files in a trace directory
+        by older versions of Morpher, in the order listed by the
+        directory's L{Manifest}. The files are left in place.
+
+        @param tracedir: The directory holding the trace files
+        @type tracedir: string
+
+        @return: The number of L{Trace}s added
+        @rtype: integer
+        '''
+        man = manifest.Manifest(tracedir)
+        if not man.load() :
+            man.rebuild()
+        for entry in man.entries :
+            self.log.info("Importing trace file %s", entry["file"])
+            self.append(man.loadTrace(entry))
+        return len(man.entries)
+
+    def close(self):
+        '''
+        Closes the memory map of the data file, if it is open
+        '''
+        if self.data != None :
+            self.data.close()
+            self.data = None
+
+    def _readBlocks(self):
+        '''
+        Reads the block index if it hasn't been read yet, ignoring entries
+        for blocks past the last stored L{Trace}.
+        '''
+        if self.blocks != None :
+            return
+        self.blocks = {}
+        if not os.path.isfile(self.blockpath) :
+            return
+        f = open(self.blockpath, "rb")
+        index = f.read()
+        f.close()
+        for pos in xrange(0, len(index) - BLOCKENTRY.size + 1, BLOCKENTRY.size) :
+            (digest, offset, length) = BLOCKENTRY.unpack_from(index, pos)
+            if offset + length > self.datasize :
+                break
+            self.blocks[digest] = (offset, length)
+
+    def _addBlock(self, contents):
+        '''
+        Finds a block's contents in the store, or queues a block record
+        holding them to be written by L{append}
+
+        @param contents: The block's contents
+        @type contents: string
+
+        @return: The offset of the contents in the data file
+        @rtype: integer
+        '''
+        digest = hashlib.sha1(contents).digest()
+        if digest not in self.blocks :
+            # Placed after the blocks already queued for this append
+            offset = self.datasize + RECORD.size
+            if self.pending :
+                (_, last, length, _) = self.pending[-1]
+                offset = last + length + RECORD.size
+            crc = zlib.crc32(contents) & 0xffffffff
+            record = RECORD.pack(BLOCK_MAGIC, crc, len(contents)) + contents
+            self.pending.append((digest, offset, len(contents), record))
+            self.blocks[digest] = (offset, len(contents))
+        return self.blocks[digest][0]
+
+    def _appendIndex(self, path, size, entries):
+        '''
+        Writes entries to the end of an index file and syncs it, cutting
+        off anything past the given size first
+
+        @param path: The path of the index file
+        @type path: string
+
+        @param size: The size of the valid part of the index
+        @type size: integer
+
+        @param entries: The packed entries to write
+        @type entries: string list
+        '''
+        mode = "r+b" if os.path.isfile(path) else "wb"
+        f = open(path, mode)
+        f.truncate(size)
+        f.seek(size)
+        f.write("".join(entries))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def _map(self):
+        '''
+        Maps the data file into memory, read-only
+        '''
+        self.close()
+        f = open(self.datapath, "rb")
+        try :
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally :
+            f.close()
+
+    def _entry(self, offset, contents, mytrace):
+        '''
+        Builds the index entry for a stored L{Trace}
+
+        @param offset: The position of the trace file in the data file
+        @type offset: integer
+
+        @param contents: The trace file
+        @type contents: string
+
+        @param mytrace: The stored trace
+        @type mytrace: L{Trace} object
+
+        @return: The index entry
+        @rtype: integer tuple
+        '''
+        return (offset, len(contents), zlib.crc32(contents) & 0xffffffff,
+                len(mytrace.snapshots), sum([len(s.tags) for s in mytrace.snapshots]))
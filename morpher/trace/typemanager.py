@@ -7,20 +7,62 @@ Contains the L{TypeManager} class for storing and reconstructing types
 @since: November 13, 2011
 '''
 import ctypes
+import hashlib
+
+def readUsertypes(model):
+    '''
+    Gathers the user-defined types described by the model produced by the
+    parser, in the form used by L{TypeManager}.
+    
+    @param model: The root node of the XML DLL model
+    @type model: L{Node} object
+    
+    @return: Dictionary mapping format strings to pairs of type strings
+             and lists of fields' formats
+    @rtype: dictionary of string : (string, string list) pairs
+    '''
+    usertypes = {}
+    for usernode in model.getElementsByTagName("usertype"):
+        userid = usernode.getAttribute("id")
+        usertype = usernode.getAttribute("type")
+        userparams = []
+        for childnode in usernode.getElementsByTagName("param") :
+            userparams.append(childnode.getAttribute("type"))
+        usertypes[userid] = (usertype, userparams)
+    return usertypes
+
+def splitArray(fmt):
+    '''
+    Splits the format string of an array, such as "c[4096]" for a field
+    declared as char[4096], into the format of its elements and their 
+    number. Arrays of several dimensions are given as one flat array.
+    
+    @param fmt: The format string to split
+    @type fmt: string
+    
+    @return: The (element format, count) of the array, or (fmt, I{None}) 
+             if the format string isn't an array
+    @rtype: (string, integer) tuple
+    '''
+    if not fmt.endswith("]") :
+        return (fmt, None)
+    pos = fmt.index("[")
+    return (fmt[:pos], int(fmt[pos + 1:-1]))
 
 class TypeManager(object):
     '''
     Stores type information and can be serialized and reconstructed
     
-    Maintains a map of format strings to classes representing the 
+    Maintains a map of format strings to classes representing the
     equivalent type. Format strings match the same types used in the
     I{struct} module and can also specify a numeric ID of a user-defined
-    type. The information for user-defined types is constructed from
-    a supplied dictionary mapping user type ids to a tuple, where the tuple
-    contains the type ("struct" or "union") and a list of format strings
-    representing each field of that type. This information is used to 
-    construct a matching L{ctypes} Structure or Union class on-the-fly
-    and add it to the map.
+    type, or an array of either such as "c[4096]", which maps to a native
+    L{ctypes} array type of the element's class. The information for
+    user-defined types is constructed from a supplied dictionary mapping
+    user type ids to a tuple, where the tuple contains the type ("struct"
+    or "union") and a list of format strings representing each field of
+    that type. This information is used to construct a matching L{ctypes}
+    Structure or Union class on-the-fly and add it to the map.
     
     This class is also used to retrieve size and alignment information
     for any type represented by a format string, by using the associated
@@ -29,11 +71,31 @@ class TypeManager(object):
     be serialized by the I{pickle} module is discarded upon serialization,
     and the information is reconstructed again after deserialization.
     
+    Each type can also be compiled into a loader (see L{getLoader}), a 
+    function that builds an instance of the type's class from the bytes
+    at an address of a L{Memory}. Loaders are built once per type, with
+    the field offsets worked out by L{ctypes} itself, and are kept for 
+    every later replay.
+    
+    The classes and loaders are shared by every L{TypeManager} in the
+    process with the same usertypes, through a cache keyed by a hash of
+    the usertypes (see L{shared}). A L{Trace} unpickled in a process that
+    already replayed another L{Trace} of the same model reuses its
+    classes rather than building them again, and L{warm} can build them
+    all ahead of time, as harnesses do from the model at startup.
+    
     @ivar table: The dictionary mapping format strings to L{ctypes} classes
+    @ivar formats: The reverse of table, mapping classes to format strings
     @ivar infotable: The memoization table for the L{getInfo} method
+    @ivar loaders: The memoization table for the L{getLoader} method
     @ivar usertypes: The dictionary storing information about user-defined
                      types such as C Structs and Unions 
+    @cvar shared: Map of usertypes hash to the (table, formats, loaders)
+                  shared by every L{TypeManager} with those usertypes
     '''
+    
+    # Tables shared between TypeManagers of the same model
+    shared = {}
 
     def __init__(self, usertypes={}):
         '''
@@ -45,47 +107,61 @@ class TypeManager(object):
                           of type strings and lists of fields' formats
         @type usertypes: dictionary of string : (string, string list) pairs
         '''
-        self.table = {
-                    "c": ctypes.c_char,
-                    "b": ctypes.c_byte,
-                    "B": ctypes.c_ubyte,
-                    "h": ctypes.c_short,
-                    "H": ctypes.c_ushort,
-                    "i": ctypes.c_int,
-                    "I": ctypes.c_uint,
-                    "l": ctypes.c_long,
-                    "L": ctypes.c_ulong,
-                    "q": ctypes.c_longlong,
-                    "Q": ctypes.c_ulonglong,
-                    "f": ctypes.c_float,
-                    "d": ctypes.c_double,
-                    "P": ctypes.c_void_p
-                    }
         self.infotable = {}
         self.usertypes = usertypes
+        self._share()
                 
     def __getstate__(self):
         '''
         The I{pickle} system calls this method when dumping. Prevents the 
-        type table from being serialized (saves space and time reading in 
-        the file)
+        type table and loaders from being serialized (saves space and time
+        reading in the file, and loaders can't be pickled)
         
-        @return: The __dict__ attibute of this object
+        @return: The __dict__ attibute of this object, without the tables
         @rtype: dictionary
         '''
-        self.table = None
-        return self.__dict__
+        state = dict(self.__dict__)
+        state["table"] = None
+        state["formats"] = None
+        state["loaders"] = None
+        return state
     
     def __setstate__(self, newdict):
         '''
-        Pickle calls this method when unpickling. Restores
-        the table to the basic state, just like L{__init__}
+        Pickle calls this method when unpickling. Picks up the tables
+        shared by other L{TypeManager}s with the same usertypes, just like
+        L{__init__}
         
         @param newdict: The state object unserialized by pickle (__dict__)
         @type newdict: dictionary
         '''
         self.__dict__ = newdict
-        self.table = {
+        self._share()
+        
+    def warm(self):
+        '''
+        Builds the class and loader of every user-defined type now, so 
+        that every L{TypeManager} with the same usertypes finds them 
+        already built.
+        '''
+        for fmt in self.usertypes :
+            self.getLoader(fmt)
+        
+    def _share(self):
+        '''
+        Points the type table, reverse map and loaders at the ones shared
+        by every L{TypeManager} with the same usertypes, creating them 
+        with just the basic types if this is the first.
+        '''
+        # The usertypes in a canonical order, since dictionaries have none
+        lines = []
+        for fmt in sorted(self.usertypes) :
+            (usertype, userparams) = self.usertypes[fmt]
+            lines.append("%s:%s:%s" % (fmt, usertype, ",".join(userparams)))
+        key = hashlib.sha1("\n".join(lines)).hexdigest()
+        
+        if key not in TypeManager.shared :
+            table = {
                     "c": ctypes.c_char,
                     "b": ctypes.c_byte,
                     "B": ctypes.c_ubyte,
@@ -101,6 +177,8 @@ class TypeManager(object):
                     "d": ctypes.c_double,
                     "P": ctypes.c_void_p
                     }
+            TypeManager.shared[key] = (table, self._reverse(table), {})
+        (self.table, self.formats, self.loaders) = TypeManager.shared[key]
         
     def getClass(self, mytype):
         '''
@@ -108,13 +186,14 @@ class TypeManager(object):
         a L{ctypes} class object corresponding to its type,
         creating the class on the fly with the stored usertypes
         data if necessary. The function is memoized for improved
-        performance but the memoization table is deleted when
-        the object is serialized.
+        performance; the memoization table is shared with other 
+        L{TypeManager}s of the same usertypes and is not serialized.
         
         Format strings can be of the types defined by the I{struct}
         module, in which case only the first character is used, or
         the text can represent a number, in which case the usertype
-        with the matching id is used. 
+        with the matching id is used. Either can be followed by a count
+        in brackets (see L{splitArray}) for an array of that type.
         
         @param mytype: The format string to translate to a class
         @type mytype: string
@@ -126,20 +205,24 @@ class TypeManager(object):
         if self.table.has_key(mytype) :
             # If we've already created this type, return it
             return self.table[mytype]
+        (elemtype, count) = splitArray(mytype)
+        if count != None :
+            # Native array of the element class
+            myclass = self.getClass(elemtype) * count
+            self.table[mytype] = myclass
+            self.formats.setdefault(myclass, mytype)
+            return myclass
         if not mytype.isdigit() :
             # Return basic type
             return self.table[mytype[0]]
         # This is a custom type we haven't created yet - get node
         (usertype, userparams) = self.usertypes[mytype]
         # Construct the new class
-        class_str = "class %s(ctypes.%s):\n    pass"
         if usertype == "struct" :
-            supertype = "Structure"
+            supertype = ctypes.Structure
         else :
-            supertype = "Union"
-        classname = "Type" + mytype
-        exec (class_str % (classname, supertype))
-        myclass = eval(classname)
+            supertype = ctypes.Union
+        myclass = type(str("Type" + mytype), (supertype,), {})
         
         # Populate the class with field types
         fieldlist = []
@@ -149,8 +232,9 @@ class TypeManager(object):
             fieldlist.append((fieldname, fieldclass))
             
         myclass._fields_ = fieldlist
-        # Add the class to our internal dictionary
+        # Add the class to our internal dictionaries
         self.table[mytype] = myclass
+        self.formats[myclass] = mytype
         return myclass
     
     def getFormat(self, objclass):
@@ -161,12 +245,37 @@ class TypeManager(object):
         @type objclass: L{ctypes} class
         
         @return: The format string matching the supplied class as described
-                 in the L{getClass} function
+                 in the L{getClass} function, or I{None} if it is unknown
         @rtype: string
         '''  
-        for (key, value) in self.table.items() :
-            if value == objclass :
-                return key
+        return self.formats.get(objclass)
+    
+    def getLoader(self, fmt):
+        '''
+        Gives a function that loads an instance of the class for a format
+        string from memory, compiling it the first time the format is seen.
+        
+        The loader is called as loader(mem, addr), with a L{Memory} and the
+        virtual address of the object in it, and returns a new L{ctypes}
+        object holding a copy of the bytes at that address. Basic types, 
+        and user types lying wholly in one L{Block}, are copied in a single
+        I{from_buffer_copy}; a user type or array split across L{Block}s is
+        put together from the loaders of its parts instead - every field of
+        a struct, the largest field of a union, or every element of an 
+        array of a user type. An array of a basic type is read a L{Block}
+        at a time.
+        
+        @param fmt: The format string of the type to load
+        @type fmt: string
+        
+        @return: The loader
+        @rtype: function
+        '''
+        loader = self.loaders.get(fmt)
+        if loader == None :
+            loader = self._compileLoader(fmt)
+            self.loaders[fmt] = loader
+        return loader
             
     def getInfo(self, fmt):
         '''
@@ -204,4 +313,112 @@ class TypeManager(object):
         '''
         leftover = (address % alignment)
         padding = (alignment - leftover) % alignment
-        return address + padding
\ No newline at end of file
+        return address + padding
+    
+    def _compileLoader(self, fmt):
+        '''
+        Builds the loader for a format string, as described in L{getLoader}
+        
+        @param fmt: The format string of the type to load
+        @type fmt: string
+        
+        @return: The loader
+        @rtype: function
+        '''
+        objclass = self.getClass(fmt)
+        size = ctypes.sizeof(objclass)
+        frombytes = objclass.from_buffer_copy
+        (elemfmt, count) = splitArray(fmt)
+        if count != None :
+            elemsize = ctypes.sizeof(self.getClass(elemfmt))
+            if not elemfmt.isdigit() :
+                return self._compileArrayLoader(objclass, elemsize, count)
+            # Offset and loader of each element of a user type
+            elemloader = self.getLoader(elemfmt)
+            fields = [(i*elemsize, elemloader) for i in xrange(count)]
+        elif not fmt.isdigit() :
+            # A basic type is always read from a single block
+            return lambda mem, addr : frombytes(mem.read(addr, size))
+        else :
+            # Offset and loader of each field that is filled in
+            fields = []
+            for (fieldname, fieldclass) in objclass._fields_ :
+                offset = getattr(objclass, fieldname).offset
+                fieldloader = self.getLoader(self.getFormat(fieldclass))
+                fields.append((offset, fieldloader))
+            if issubclass(objclass, ctypes.Union) and fields :
+                # Just the first of the largest fields
+                sizes = [ctypes.sizeof(c) for (_, c) in objclass._fields_]
+                fields = [fields[sizes.index(max(sizes))]]
+        
+        def loader(mem, addr) :
+            if mem.containsAddress(addr, size) :
+                return frombytes(mem.read(addr, size))
+            myinst = objclass()
+            base = ctypes.addressof(myinst)
+            for (offset, partloader) in fields :
+                # Copied as bytes, since ctypes won't assign an array of
+                # chars to a field or element
+                part = partloader(mem, addr + offset)
+                ctypes.memmove(base + offset, ctypes.addressof(part), ctypes.sizeof(part))
+            return myinst
+        return loader
+    
+    def _compileArrayLoader(self, objclass, elemsize, count):
+        '''
+        Builds the loader for an array of a basic type. An array split 
+        across L{Block}s is read as one piece from each L{Block}, each as
+        long as a binary search finds will fit, rather than an element at
+        a time.
+        
+        @param objclass: The L{ctypes} class of the array
+        @type objclass: L{ctypes} class
+        
+        @param elemsize: The size of each element
+        @type elemsize: integer
+        
+        @param count: The number of elements
+        @type count: integer
+        
+        @return: The loader
+        @rtype: function
+        '''
+        size = elemsize * count
+        frombytes = objclass.from_buffer_copy
+        
+        def loader(mem, addr) :
+            if mem.containsAddress(addr, size) :
+                return frombytes(mem.read(addr, size))
+            pieces = []
+            done = 0
+            while done < count :
+                start = addr + done*elemsize
+                (low, high) = (1, count - done)
+                while low < high :
+                    mid = (low + high + 1) // 2
+                    if mem.containsAddress(start, mid*elemsize) :
+                        low = mid
+                    else :
+                        high = mid - 1
+                pieces.append(mem.read(start, low*elemsize))
+                done += low
+            return frombytes("".join(pieces))
+        return loader
+    
+    def _reverse(self, table):
+        '''
+        Builds the map from classes back to format strings for a type
+        table. Some L{ctypes} classes stand for several formats (such as 
+        c_long and c_int where they are the same size); the first format
+        in sorted order is used, so the choice is always the same.
+        
+        @param table: Map of format strings to L{ctypes} classes
+        @type table: dictionary
+        
+        @return: Map of L{ctypes} classes to format strings
+        @rtype: dictionary
+        '''
+        formats = {}
+        for fmt in sorted(table.keys()) :
+            formats.setdefault(table[fmt], fmt)
+        return formats
\ No newline at end of file
@@ -19,14 +19,14 @@ L{Morpher} process.
 
 from morpher import morpher
 from morpher.misc import config
+from morpher.trace import trace_file, trace_store, manifest
 import optparse
 import sys
 import os
 import ctypes
 import traceback
-import pickle
 
-def playback(filename):
+def playback(filename, traceid=0):
     '''
     Can play back a trace manually, allowing the user to attach a debugger
     and step through the trace at their own leisure. 
@@ -37,10 +37,15 @@ def playback(filename):
     caused a crash or hang along with the crash report. This function 
     takes the trace file and replays the L{Snapshot}s one at a time,
     reporting the PID so the engineer can attach a debugger of his 
-    own and follow along.
+    own and follow along. Collected L{Trace}s can be played back by 
+    giving the directory of their L{TraceStore} and the L{Trace}'s id.
     
-    @param filename: The path to the L{Trace} file to be replayed
+    @param filename: The path to the L{Trace} file to be replayed, or
+                     to a directory holding a L{TraceStore}
     @type filename: string
+    
+    @param traceid: The id of the L{Trace} in the L{TraceStore}
+    @type traceid: integer
     '''
     cfg = config.Config()
     dlltype = cfg.get('fuzzer', 'dll_type')
@@ -58,10 +63,17 @@ def playback(filename):
     target = dll.LoadLibrary(path)
     
     # Load the target trace file
-    print "Replaying trace: " + filename
-    f = open(filename, "rb")
-    trace = pickle.load(f)
-    f.close()
+    if os.path.isdir(filename) :
+        store = trace_store.TraceStore(filename)
+        print "Replaying trace %d of %d in store: %s" % (traceid, len(store), filename)
+        trace = store.loadTrace(traceid)
+        store.close()
+    elif not trace_file.isTraceFile(filename) :
+        print "Not a trace file: %s (convert .pkl traces with --convert)" % filename
+        return
+    else :
+        print "Replaying trace: " + filename
+        trace = trace_file.load(filename)
     
     # Run each function capture in order
     for s in trace.snapshots :
@@ -83,6 +95,28 @@ def playback(filename):
         
     print "Trace complete"
 
+def convert(path):
+    '''
+    Converts L{Trace}s pickled by older versions of L{Morpher} to the
+    trace file format. Given a directory, every "trace-*.pkl" file below
+    it is converted - collected traces as well as saved crashes and
+    hangs - and the manifest of any trace directory is rebuilt.
+    
+    @param path: A .pkl file or a directory to search
+    @type path: string
+    '''
+    if os.path.isfile(path) :
+        print "Converted " + trace_file.convert(path)
+        return
+    for (dirpath, _, filenames) in os.walk(path) :
+        for filename in sorted(filenames) :
+            if filename.startswith("trace-") and filename.endswith(".pkl") :
+                pklpath = os.path.join(dirpath, filename)
+                print "Converted " + trace_file.convert(pklpath)
+        if "manifest.json" in filenames :
+            print "Rebuilding manifest in " + dirpath
+            manifest.Manifest(dirpath).rebuild()
+
 # This is the start of the command-line script
 if __name__ == '__main__':
     
@@ -109,7 +143,13 @@ if __name__ == '__main__':
                  help="Flag to enable debug-level output")
     # Option to run in playback mode instead of Morpher
     p.add_option("-p", "--playback", action="store",dest="playback", \
-                 help="Specify a .pkl trace file to play back")
+                 help="Specify a .trc trace file or trace store directory to play back")
+    # Option picking the trace to play back from a trace store
+    p.add_option("-i", "--trace-id", action="store",type="int",dest="traceid", \
+                 default=0, help="The id of the trace to play back from a store")
+    # Option to convert old pickled traces instead of running Morpher
+    p.add_option("--convert", action="store",dest="convert", \
+                 help="Convert .pkl traces in a file or directory to .trc")
         
     # Returns options list and list of unmatched arguments
     opts, args = p.parse_args()
@@ -122,14 +162,19 @@ if __name__ == '__main__':
 
     # Check for playback routine
     if not opts.playback == None :
-        playback(opts.playback)
+        playback(opts.playback, opts.traceid)
+        sys.exit()
+
+    # Check for conversion routine
+    if not opts.convert == None :
+        convert(opts.convert)
         sys.exit()
 
     # Pull out all options that were actually specified        
     params = {}
     
     for (key, value) in opts.__dict__.items() :
-        if value != None :
+        if value != None and key != "traceid" :
             params[key] = value
     
     # Run Morpher